@@ -0,0 +1,180 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Measures the cold start of every entry point: the time for a fresh Python process to import the Lambda
+function or script, the number of modules that pulls in, and the imports that cost the most.
+
+Usage:
+    python benchmarks/cold_start.py [--runs N] [--top N] [--baseline GIT_REV] [--json]
+
+--baseline exports GIT_REV of this repository to a temporary directory and measures it alongside the working tree
+
+Original Author: Scott Cunningham
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import tarfile
+import tempfile
+import argparse
+import statistics
+import subprocess
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+ENTRY_POINTS = [
+    "live_proxy/lambda_function.py",
+    "vod_lambda/scripts/dash_esam_single_period_w_eventstream.py",
+    "vod_lambda/scripts/dash_esam_single_period_w_eventstream_v2.py",
+    "vod_manual/dash_manifest_modifier.py",
+    "vod_post_transcode/dash_manifest_modifier.py"
+]
+
+# Module level code in the entry points reads these, the values don't matter for an import
+ENTRY_POINT_ENVIRONMENT = {
+    "ORIGIN": "https://origin.example.com",
+    "AWS_DEFAULT_REGION": "us-east-1"
+}
+
+### Each run is a new interpreter, so nothing is already in sys.modules. The child loads the entry point the way Lambda
+### or the command line would (its own directory first on sys.path), and reports the import time and module count
+IMPORT_ENTRY_POINT = '''
+import sys, time, json, importlib.util
+path = sys.argv[1]
+sys.path.insert(0, sys.argv[2])
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("entry_point", path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+seconds = time.perf_counter() - started
+sys.stdout.write(json.dumps({"import_seconds": seconds, "modules": len(sys.modules)}))
+'''
+
+def import_times(stderr):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package", top level imports aren't indented
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules.append((int(cumulative_us), int(self_us), name.rstrip()[1:]))
+    return modules
+
+def startup_modules():
+    # Modules the interpreter imports before running any code (site, encodings ...), left out of the slowest imports
+    child = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"], capture_output=True, text=True)
+    return set(name.strip() for cumulative, self_us, name in import_times(child.stderr))
+
+def measure(tree, entry_point, runs, top, skip_modules):
+    path = os.path.join(tree, entry_point)
+    environment = dict(os.environ)
+    for key in ENTRY_POINT_ENVIRONMENT:
+        environment.setdefault(key, ENTRY_POINT_ENVIRONMENT[key])
+
+    import_seconds = []
+    process_seconds = []
+    modules = 0
+    slowest = []
+    for run in range(runs):
+        started = time.perf_counter()
+        child = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_ENTRY_POINT, path, os.path.dirname(path)], env=environment, capture_output=True, text=True)
+        process_seconds.append(time.perf_counter() - started)
+        if child.returncode != 0:
+            raise RuntimeError("%s failed to import : %s" % (path, child.stderr.strip().splitlines()[-1] if child.stderr.strip() else child.returncode))
+        result = json.loads(child.stdout)
+        import_seconds.append(result['import_seconds'])
+        modules = result['modules']
+        if run == 0:
+            # the imports made by the entry point itself, the most expensive first
+            timings = [timing for timing in import_times(child.stderr) if not timing[2].startswith(" ") and timing[2] not in skip_modules]
+            slowest = [{"module": name.strip(), "cumulative_ms": cumulative / 1000.0} for cumulative, self_us, name in sorted(timings, reverse=True)[:top]]
+
+    return {
+        "entry_point": entry_point,
+        "runs": runs,
+        "import_ms_median": statistics.median(import_seconds) * 1000,
+        "import_ms_min": min(import_seconds) * 1000,
+        "process_ms_median": statistics.median(process_seconds) * 1000,
+        "modules": modules,
+        "slowest_imports": slowest
+    }
+
+def export_revision(revision, directory):
+    archive = subprocess.run(["git", "-C", REPO, "archive", "--format=tar", revision], capture_output=True, check=True).stdout
+    archive_path = os.path.join(directory, "tree.tar")
+    with open(archive_path, 'wb') as archive_file:
+        archive_file.write(archive)
+    with tarfile.open(archive_path) as tree:
+        tree.extractall(os.path.join(directory, "tree"))
+    return os.path.join(directory, "tree")
+
+def print_results(label, results):
+    print("%s" % (label))
+    for result in results:
+        if "error" in result:
+            print("  %-66s %s" % (result['entry_point'], result['error']))
+            continue
+        print("  %-66s import %8.1f ms (min %8.1f)  process %8.1f ms  %4s modules" % (result['entry_point'], result['import_ms_median'], result['import_ms_min'], result['process_ms_median'], result['modules']))
+        for slow in result['slowest_imports']:
+            print("      %8.1f ms  %s" % (slow['cumulative_ms'], slow['module']))
+
+def run_trees(trees, runs, top):
+    skip_modules = startup_modules()
+    results = {}
+    for label, tree in trees:
+        results[label] = []
+        for entry_point in ENTRY_POINTS:
+            if not os.path.exists(os.path.join(tree, entry_point)):
+                continue
+            try:
+                results[label].append(measure(tree, entry_point, runs, top, skip_modules))
+            except RuntimeError as e:
+                results[label].append({"entry_point": entry_point, "error": str(e)})
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cold start import time of the DASH manifest modifier entry points")
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per entry point (default 10)")
+    parser.add_argument("--top", type=int, default=5, help="slowest top level imports to list per entry point (default 5)")
+    parser.add_argument("--baseline", help="git revision to measure alongside the working tree, for example HEAD~1")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    trees = [("working tree", REPO)]
+    baseline_directory = None
+    if args.baseline:
+        baseline_directory = tempfile.mkdtemp(prefix="cold-start-")
+        trees.insert(0, ("baseline %s" % (args.baseline), export_revision(args.baseline, baseline_directory)))
+
+    try:
+        results = run_trees(trees, args.runs, args.top)
+    finally:
+        if baseline_directory:
+            shutil.rmtree(baseline_directory, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for label, tree in trees:
+            print_results(label, results[label])
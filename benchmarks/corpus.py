@@ -0,0 +1,147 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Synthetic manifests and sidecar files for the benchmarks: live (dynamic) MPDs shaped like a MediaPackage
+endpoint, single period VOD MPDs shaped like MediaConvert CMAF / DASH ISO output, ESAM SignalProcessingNotifications
+and WebVTT files. Every generator is seeded, so a given set of arguments always gives the same bytes.
+
+Original Author: Scott Cunningham
+'''
+
+import random
+
+TIMESCALE = 90000
+SEGMENT_DURATION = 180180 # 2.002 seconds at 90kHz
+
+MPD_NAMESPACES = 'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="urn:mpeg:dash:schema:mpd:2011" xmlns:scte35="urn:scte:scte35:2013:xml"'
+
+def timeline_runs(rng, runs, start=0, max_repeat=40):
+    # (t, d, r) S elements: runs of full length segments, each followed by one short segment
+    timeline = []
+    t = start
+    for run in range(runs):
+        repeat = rng.randint(0, max_repeat)
+        timeline.append((t, SEGMENT_DURATION, repeat))
+        t += SEGMENT_DURATION * (repeat + 1)
+        short = rng.choice([174174, 96096, 90090])
+        timeline.append((t, short, 0))
+        t += short
+    return timeline, t
+
+def s_elements(timeline, first_t_only=False):
+    lines = []
+    for index, (t, d, r) in enumerate(timeline):
+        t_attribute = ' t="%d"' % (t) if (index == 0 or not first_t_only) else ""
+        r_attribute = ' r="%d"' % (r) if r else ""
+        lines.append('<S%s d="%d"%s/>' % (t_attribute, d, r_attribute))
+    return "".join(lines)
+
+def live_mpd(periods=1, adaptation_sets=2, representations=4, runs=50, max_repeat=40, seed=1):
+    # A dynamic MPD: 'periods' Periods, each with an EventStream, one video AdaptationSet of 'representations'
+    # Representations and 'adaptation_sets' - 1 audio AdaptationSets of one Representation. Every Representation has its
+    # own SegmentTemplate with relative URLs and a SegmentTimeline of 'runs' pairs of S elements
+    rng = random.Random(seed)
+    out = ['<?xml version="1.0" encoding="UTF-8"?>']
+    out.append('<MPD %s type="dynamic" availabilityStartTime="2021-01-01T00:00:00Z" publishTime="2021-06-16T15:47:00Z" minimumUpdatePeriod="PT6S" timeShiftBufferDepth="PT300S" suggestedPresentationDelay="PT20S" minBufferTime="PT6S" profiles="urn:mpeg:dash:profile:isoff-live:2011">' % (MPD_NAMESPACES))
+    start = 0
+    for period in range(periods):
+        timeline, end = timeline_runs(rng, runs, start, max_repeat)
+        out.append('<Period start="PT%.3fS" id="%d">' % (start / float(TIMESCALE), period))
+        out.append('<EventStream schemeIdUri="urn:scte:scte35:2013:xml" timescale="%d"><Event duration="2700000" id="%d"><scte35:SpliceInfoSection protocolVersion="0" ptsAdjustment="0" tier="4095"><scte35:TimeSignal><scte35:SpliceTime ptsTime="%d"/></scte35:TimeSignal></scte35:SpliceInfoSection></Event></EventStream>' % (TIMESCALE, period, start))
+        for adaptation_set in range(adaptation_sets):
+            video = adaptation_set == 0
+            kind = "video" if video else "audio_%d" % (adaptation_set)
+            if video:
+                out.append('<AdaptationSet id="%d" mimeType="video/mp4" segmentAlignment="false" startWithSAP="1" maxWidth="1920" maxHeight="1080" maxFrameRate="30000/1001" par="16:9">' % (adaptation_set))
+            else:
+                out.append('<AdaptationSet id="%d" mimeType="audio/mp4" segmentAlignment="false" startWithSAP="1" lang="eng">' % (adaptation_set))
+            for representation in range(representations if video else 1):
+                representation_id = "%s_%d" % (kind, representation)
+                if video:
+                    out.append('<Representation id="%s" width="%d" height="%d" frameRate="30000/1001" bandwidth="%d" codecs="avc1.4D401F">' % (representation_id, 1920 * (representation + 1) // representations, 1080 * (representation + 1) // representations, 1000000 * (representation + 1)))
+                else:
+                    out.append('<Representation id="%s" bandwidth="96000" audioSamplingRate="48000" codecs="mp4a.40.2"><AudioChannelConfiguration schemeIdUri="urn:mpeg:dash:23003:3:audio_channel_configuration:2011" value="2"/>' % (representation_id))
+                out.append('<SegmentTemplate timescale="%d" presentationTimeOffset="%d" media="../../cmaf/%s_$Number%%09d$.mp4" initialization="../../cmaf/%s_init.mp4" startNumber="%d"><SegmentTimeline>%s</SegmentTimeline></SegmentTemplate>' % (TIMESCALE, start, representation_id, representation_id, 1 + period * 1000, s_elements(timeline)))
+                out.append('</Representation>')
+            out.append('</AdaptationSet>')
+        out.append('</Period>')
+        start = end
+    out.append('</MPD>')
+    return "\n".join(out).encode('utf-8')
+
+def live_refresh(mpd):
+    # The next refresh of a live_mpd(): a later publishTime and one more segment at the end of every SegmentTimeline
+    mpd = mpd.replace(b'publishTime="2021-06-16T15:47:00Z"', b'publishTime="2021-06-16T15:47:06Z"')
+    return mpd.replace(b"</SegmentTimeline>", b'<S d="%d"/></SegmentTimeline>' % (SEGMENT_DURATION))
+
+def vod_mpd(representations=4, audio_tracks=1, runs=200, max_repeat=40, seed=1):
+    # A static single Period MPD: one video AdaptationSet and 'audio_tracks' labeled audio AdaptationSets, every
+    # Representation with the same SegmentTimeline of 'runs' pairs of S elements. Returns (manifest bytes, seconds)
+    rng = random.Random(seed)
+    timeline, end = timeline_runs(rng, runs, 0, max_repeat)
+    segments = s_elements(timeline)
+    duration = end / float(TIMESCALE)
+    out = ['<?xml version="1.0" encoding="UTF-8"?>']
+    out.append('<MPD %s type="static" minBufferTime="PT6S" profiles="urn:mpeg:dash:profile:isoff-main:2011" mediaPresentationDuration="PT%.3fS">' % (MPD_NAMESPACES, duration))
+    out.append('<Period start="PT0S" id="1">')
+    out.append('<AdaptationSet mimeType="video/mp4" frameRate="30000/1001" segmentAlignment="true" subsegmentAlignment="true" startWithSAP="1" subsegmentStartsWithSAP="1" bitstreamSwitching="false"><SegmentTemplate timescale="%d"/>' % (TIMESCALE))
+    representation_id = 1
+    for representation in range(representations):
+        out.append('<Representation id="%d" width="%d" height="%d" bandwidth="%d" codecs="avc1.4d401f"><SegmentTemplate media="video_%d_$Number%%09d$.cmfv" initialization="video_%dinit.cmfv" startNumber="1"><SegmentTimeline>%s</SegmentTimeline></SegmentTemplate></Representation>' % (representation_id, 1920 * (representation + 1) // representations, 1080 * (representation + 1) // representations, 1000000 * (representation + 1), representation_id, representation_id, segments))
+        representation_id += 1
+    out.append('</AdaptationSet>')
+    for track in range(audio_tracks):
+        out.append('<AdaptationSet mimeType="audio/mp4" lang="eng" segmentAlignment="0"><Label>Audio %d</Label><SegmentTemplate timescale="%d"/>' % (track + 1, TIMESCALE))
+        out.append('<Representation id="%d" bandwidth="96000" audioSamplingRate="48000" codecs="mp4a.40.2"><AudioChannelConfiguration schemeIdUri="urn:mpeg:dash:23003:3:audio_channel_configuration:2011" value="2"/><SegmentTemplate media="audio_%d_$Number%%09d$.cmfa" initialization="audio_%dinit.cmfa" startNumber="1"><SegmentTimeline>%s</SegmentTimeline></SegmentTemplate></Representation>' % (representation_id, representation_id, representation_id, segments))
+        representation_id += 1
+        out.append('</AdaptationSet>')
+    out.append('</Period>')
+    out.append('</MPD>')
+    return "\n".join(out).encode('utf-8'), duration
+
+def esam_xml(breaks, duration_seconds):
+    # An ESAM SignalProcessingNotification with 'breaks' ad breaks spread evenly over the asset, a placement
+    # opportunity start (52) and end (53) signal for each
+    signals = []
+    durations = ["PT30S", "PT1M", "PT1M30S", "PT2M15S", "PT45S"]
+    for signal in range(breaks):
+        npt = round(duration_seconds * (signal + 1) / (breaks + 1), 3)
+        for segment_type_id in ("52", "53"):
+            signals.append('<ResponseSignal action="create" acquisitionPointIdentity="ESAM" acquisitionSignalID="%d" signalPointID="%s"><sig:NPTPoint nptPoint="%s"/><sig:SCTE35PointDescriptor spliceCommandType="6"><sig:SegmentationDescriptorInfo duration="%s" segmentEventId="%d" segmentTypeId="%s"/></sig:SCTE35PointDescriptor></ResponseSignal>' % (signal, npt, npt, durations[signal % len(durations)], signal, segment_type_id))
+    return '<SignalProcessingNotification xmlns="urn:cablelabs:iptvservices:esam:xsd:signal:1" xmlns:sig="urn:cablelabs:md:xsd:signaling:3.0" xmlns:common="urn:cablelabs:iptvservices:esam:xsd:common:1">\n%s\n</SignalProcessingNotification>' % ("\n".join(signals))
+
+def vtt_timestamp(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return "%02d:%02d:%06.3f" % (hours, minutes, seconds)
+
+def webvtt(duration_seconds, cues):
+    # A WebVTT file with 'cues' cues spread evenly over the asset. Every seventh cue has a blank line inside it, as
+    # MediaConvert sometimes writes, which the VTT segmenter has to join back onto the cue
+    out = ["WEBVTT"]
+    spacing = max((duration_seconds - 3) / float(max(cues, 1)), 0.5)
+    for cue in range(cues):
+        start = 0.5 + cue * spacing
+        text = "Caption line %d" % (cue)
+        if cue % 7 == 0:
+            text += "\n\nsecond paragraph %d" % (cue)
+        out.append("%s --> %s align:center\n%s" % (vtt_timestamp(start), vtt_timestamp(start + min(spacing, 2.0)), text))
+    return ("\n\n".join(out) + "\n").encode('utf-8')
@@ -0,0 +1,362 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Offline benchmark suite for every entry point. Synthetic manifests (see corpus.py) of increasing size are run
+through the live proxy (each parser backend), both ESAM single period VOD Lambdas and the manual / post-transcode
+modifiers (tree and streaming modes), with S3, MediaConvert and the live origin replaced by local stand-ins (see
+standins.py). Parse, modify, serialize and end to end times are measured, along with the peak memory allocated. The live
+proxy also times an incremental rewrite of the next refresh of each manifest.
+
+Usage:
+    python benchmarks/manifest_suite.py [--quick] [--repeat N] [--only live|vod|cli ...] [--output FILE] [--compare FILE] [--threshold RATIO] [--json]
+
+--output writes the results as JSON. --compare reads the results of an earlier run, prints the change for every
+measurement and exits with status 1 when any of them is slower than --threshold times the earlier result
+
+Original Author: Scott Cunningham
+'''
+
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import importlib.util
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.abspath(os.path.join(BENCHMARKS, os.pardir))
+sys.path.insert(0, REPO)
+
+import corpus
+from standins import LocalAWS, LocalOrigin
+from dash_manifest.metrics import set_metrics_sink
+
+# Module level code in the entry points reads these
+ENTRY_POINT_ENVIRONMENT = {
+    "ORIGIN": "http://127.0.0.1",
+    "AWS_DEFAULT_REGION": "us-east-1"
+}
+
+##
+## Cases
+##
+
+### Each suite runs every case, --quick runs the first two. Sizes are chosen to go from a typical manifest to a long DVR
+### window or a feature length asset with many ad breaks and a full caption file
+LIVE_CASES = [
+    {"periods": 1, "adaptation_sets": 2, "representations": 4, "runs": 25},
+    {"periods": 3, "adaptation_sets": 3, "representations": 6, "runs": 150},
+    {"periods": 6, "adaptation_sets": 4, "representations": 8, "runs": 600}
+]
+VOD_CASES = [
+    {"representations": 4, "runs": 100, "breaks": 3, "cues": 0},
+    {"representations": 4, "runs": 100, "breaks": 3, "cues": 300},
+    {"representations": 6, "runs": 1000, "breaks": 12, "cues": 3000}
+]
+CLI_CASES = [
+    {"representations": 4, "runs": 100},
+    {"representations": 6, "runs": 1000},
+    {"representations": 8, "runs": 5000}
+]
+
+##
+## Measurement
+##
+
+def measure(function, repeat, setup=None):
+    # Times 'repeat' calls of function() (setup() runs before each, untimed), then one more call under tracemalloc for
+    # the peak memory. Returns the statistics and the last result
+    seconds = []
+    for run in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        started = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - started)
+    if setup:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "runs": repeat,
+        "ms_min": min(seconds) * 1000,
+        "ms_median": statistics.median(seconds) * 1000,
+        "peak_kb": peak / 1024.0
+    }, result
+
+def record(results, entry_point, variant, case, stage, statistics_, bytes_in, bytes_out=None):
+    result = {"entry_point": entry_point, "variant": variant, "case": case, "stage": stage, "bytes_in": bytes_in}
+    if bytes_out is not None:
+        result['bytes_out'] = bytes_out
+    result.update(statistics_)
+    results.append(result)
+
+def load_entry_point(relative_path, module_name):
+    # Import an entry point under its own module name, two of them are called dash_manifest_modifier. Their logging is
+    # turned down to WARNING so log formatting and console output aren't what's being measured. Invocation metrics are
+    # still collected and built into a record, which is then dropped
+    for key in ENTRY_POINT_ENVIRONMENT:
+        os.environ.setdefault(key, ENTRY_POINT_ENVIRONMENT[key])
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(REPO, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.LOGGER.setLevel(logging.WARNING)
+    set_metrics_sink(lambda record: None)
+    return module
+
+##
+## Suites
+##
+
+def live_suite(cases, repeat, results):
+    module = load_entry_point("live_proxy/lambda_function.py", "benchmark_live_proxy")
+    # every request has to be parsed, not served from a cache
+    module.MANIFESTCACHE = "False"
+    module.REWRITECACHE = "False"
+    mpd_path = "/out/v1/channel/index.mpd"
+
+    for case in cases:
+        body = corpus.live_mpd(**case)
+        refreshed = corpus.live_refresh(body)
+        with LocalOrigin({mpd_path: body}) as origin:
+            os.environ['ORIGIN'] = origin.url
+            for name, backend in module.MANIFEST_PARSERS.items():
+                stats, document = measure(lambda: backend.parse(body), repeat)
+                record(results, "live_proxy", name, case, "parse", stats, len(body))
+
+                holder = {}
+                def parse_fresh():
+                    holder['document'] = backend.parse(body)
+                stats, ignored = measure(lambda: backend.modify(holder['document'], origin.url + mpd_path, []), repeat, parse_fresh)
+                record(results, "live_proxy", name, case, "modify", stats, len(body))
+
+                stats, output = measure(lambda: backend.serialize(holder['document']), repeat)
+                record(results, "live_proxy", name, case, "serialize", stats, len(body), len(output))
+
+                module.MANIFEST_PARSER = backend
+                event = {"path": mpd_path, "queryStringParameters": None}
+                stats, response = measure(lambda: module.lambda_handler(event, None), repeat)
+                if response['statusCode'] != 200:
+                    raise RuntimeError("live_proxy %s returned %s : %s" % (name, response['statusCode'], response['body'][:200]))
+                record(results, "live_proxy", name, case, "end_to_end", stats, len(body), len(response['body']))
+
+                if name != module.StreamingParser.name:
+                    # The next refresh of the manifest, rewritten incrementally against this one
+                    def prime():
+                        module.INCREMENTAL_STATE.clear()
+                        module.incremental_rewrite(origin.url + mpd_path, origin.url + mpd_path.rsplit('/', 1)[0], body, module.InvocationMetrics("benchmark"))
+                    stats, rewritten = measure(lambda: module.incremental_rewrite(origin.url + mpd_path, origin.url + mpd_path.rsplit('/', 1)[0], refreshed, module.InvocationMetrics("benchmark")), repeat, prime)
+                    record(results, "live_proxy", name, case, "incremental", stats, len(refreshed), len(rewritten[0]))
+
+def vod_event(bucket, vtt):
+    groups = [
+        {"type": "CMAF_GROUP", "playlistFilePaths": ["s3://%s/out/cmaf/index.mpd" % (bucket)]},
+        {"type": "DASH_ISO_GROUP", "playlistFilePaths": ["s3://%s/out/dash/index.mpd" % (bucket)]}
+    ]
+    if vtt:
+        groups.append({"type": "FILE_GROUP", "outputDetails": [{"outputFilePaths": ["s3://%s/out/captions/index_vtt" % (bucket)]}]})
+    return {"region": "us-east-1", "detail": {"jobId": "1", "outputGroupDetails": groups}}
+
+VOD_LAMBDAS = [
+    ("vod_lambda_v1", "vod_lambda/scripts/dash_esam_single_period_w_eventstream.py"),
+    ("vod_lambda_v2", "vod_lambda/scripts/dash_esam_single_period_w_eventstream_v2.py")
+]
+
+def vod_suite(cases, repeat, results):
+    from dash_manifest.model import parse_mpd
+    bucket = "benchmark-bucket"
+
+    for entry_point, relative_path in VOD_LAMBDAS:
+        module = load_entry_point(relative_path, "benchmark_" + entry_point)
+        aws = LocalAWS()
+        module.boto3 = aws
+        if hasattr(module, 's3'):
+            # created at import time
+            module.s3 = aws.s3
+
+        for case in cases:
+            manifest, duration = corpus.vod_mpd(representations=case['representations'], runs=case['runs'])
+            aws.s3.objects[(bucket, "out/cmaf/index.mpd")] = manifest
+            aws.s3.objects[(bucket, "out/dash/index.mpd")] = manifest
+            if case['cues']:
+                aws.s3.objects[(bucket, "out/captions/index_vtt.vtt")] = corpus.webvtt(duration, case['cues'])
+            aws.mediaconvert.jobs["1"] = {"Job": {"Settings": {"Esam": {"SignalProcessingNotification": {"SccXml": corpus.esam_xml(case['breaks'], duration)}}}}}
+            event = vod_event(bucket, case['cues'] > 0)
+
+            stats, document = measure(lambda: parse_mpd(manifest), repeat)
+            record(results, entry_point, "model", case, "parse", stats, len(manifest))
+            stats, output = measure(lambda: document.to_xml(), repeat)
+            record(results, entry_point, "model", case, "serialize", stats, len(manifest), len(output))
+
+            puts = aws.s3.puts
+            stats, response = measure(lambda: module.lambda_handler(event, None), repeat)
+            output_keys = [key for (object_bucket, key) in aws.s3.objects if key.endswith("-dai.mpd") or key.endswith("-new.mpd")]
+            output_bytes = max(len(aws.s3.objects[(bucket, key)]) for key in output_keys) if output_keys else None
+            stats['s3_puts'] = (aws.s3.puts - puts) // (repeat + 1)
+            record(results, entry_point, "handler", case, "end_to_end", stats, len(manifest), output_bytes)
+
+CLI_SCRIPTS = [
+    ("vod_manual", "vod_manual/dash_manifest_modifier.py"),
+    ("vod_post_transcode", "vod_post_transcode/dash_manifest_modifier.py")
+]
+
+def cli_suite(cases, repeat, results):
+    from dash_manifest.model import parse_mpd
+    from dash_manifest.files import parse_manifest_file
+    from dash_manifest.adapters import ModelNodeAdapter
+
+    directory = tempfile.mkdtemp(prefix="manifest-suite-")
+    try:
+        for entry_point, relative_path in CLI_SCRIPTS:
+            module = load_entry_point(relative_path, "benchmark_" + entry_point)
+            for case in cases:
+                manifest, duration = corpus.vod_mpd(**case)
+                source = os.path.join(directory, "source.mpd")
+                path = os.path.join(directory, "index.mpd")
+                with open(source, 'wb') as source_file:
+                    source_file.write(manifest)
+                def fresh_copy():
+                    # the manual modifier overwrites its manifest
+                    shutil.copyfile(source, path)
+
+                stats, document = measure(lambda: parse_manifest_file(source, parse_mpd), repeat)
+                record(results, entry_point, "model", case, "parse", stats, len(manifest))
+
+                holder = {}
+                def parse_fresh():
+                    holder['document'] = parse_manifest_file(source, parse_mpd)
+                stats, ignored = measure(lambda: module.MANIFEST_RULES.apply(ModelNodeAdapter(), holder['document'], []), repeat, parse_fresh)
+                record(results, entry_point, "model", case, "modify", stats, len(manifest))
+
+                stats, output = measure(lambda: holder['document'].to_xml(), repeat)
+                record(results, entry_point, "model", case, "serialize", stats, len(manifest), len(output))
+
+                for variant, stream_rewrite in (("model", "False"), ("stream", "True")):
+                    module.STREAMREWRITE = stream_rewrite
+                    stats, ignored = measure(lambda: module.modify_manifest(path), repeat, fresh_copy)
+                    written = path + "-new.mpd" if entry_point == "vod_post_transcode" else path
+                    record(results, entry_point, variant, case, "end_to_end", stats, len(manifest), os.path.getsize(written))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+SUITES = {
+    "live": live_suite,
+    "vod": vod_suite,
+    "cli": cli_suite
+}
+SUITE_CASES = {
+    "live": LIVE_CASES,
+    "vod": VOD_CASES,
+    "cli": CLI_CASES
+}
+
+##
+## Reporting
+##
+
+def result_key(result):
+    return (result['entry_point'], result['variant'], json.dumps(result['case'], sort_keys=True), result['stage'])
+
+def case_label(case):
+    return " ".join("%s=%s" % (key, case[key]) for key in case)
+
+def print_results(results):
+    for result in results:
+        print("%-20s %-10s %-11s %-58s %9.2f ms (median %9.2f)  peak %9.1f KB" % (result['entry_point'], result['variant'], result['stage'], case_label(result['case']), result['ms_min'], result['ms_median'], result['peak_kb']))
+
+def compare_results(previous, results, threshold):
+    # Prints the change against an earlier run, returns the measurements that are more than 'threshold' times slower
+    earlier = dict((result_key(result), result) for result in previous['results'])
+    regressions = []
+    print("Compared with %s (%s)" % (previous.get('revision'), previous.get('created')))
+    for result in results:
+        before = earlier.get(result_key(result))
+        if before is None:
+            continue
+        ratio = result['ms_min'] / before['ms_min'] if before['ms_min'] else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(result)
+        print("%-20s %-10s %-11s %-58s %9.2f -> %9.2f ms  x%.2f  peak %9.1f -> %9.1f KB%s" % (result['entry_point'], result['variant'], result['stage'], case_label(result['case']), before['ms_min'], result['ms_min'], ratio, before['peak_kb'], result['peak_kb'], flag))
+    return regressions
+
+def git_revision():
+    try:
+        revision = subprocess.run(["git", "-C", REPO, "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "-C", REPO, "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for the DASH manifest modifier entry points, on synthetic manifests")
+    parser.add_argument("--quick", action="store_true", help="only the two smallest cases of each suite")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per measurement (default 5)")
+    parser.add_argument("--only", nargs="+", choices=sorted(SUITES), help="suites to run (default all)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression by --compare (default 1.25)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for suite in args.only or list(SUITES):
+        cases = SUITE_CASES[suite][:2] if args.quick else SUITE_CASES[suite]
+        SUITES[suite](cases, args.repeat, results)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_results(results)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+        if compare_results(previous, results, args.threshold):
+            sys.exit(1)
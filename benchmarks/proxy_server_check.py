@@ -0,0 +1,140 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Checks the live proxy's self-hosted server mode (live_proxy/proxy_server.py) against a local origin: every
+request must get its response within REQUEST_TIMEOUT seconds, including the ones the manifest cache answers without
+going to the origin, and a rewrite that fails must give every request that shared it an error response, in the server
+mode and in the Lambda function alike.
+
+Usage:
+    python benchmarks/proxy_server_check.py
+
+Exits with status 1 when any check fails, after printing which. aiohttp, xmltodict and requests must be installed
+
+Original Author: Scott Cunningham
+'''
+
+import os
+import sys
+import asyncio
+import logging
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, "live_proxy"))
+
+# Module level code in lambda_function.py reads it
+os.environ.setdefault("ORIGIN", "http://127.0.0.1")
+
+import corpus
+from standins import LocalOrigin
+from dash_manifest.metrics import set_metrics_sink
+import proxy_server
+proxy = proxy_server.proxy
+
+REQUEST_TIMEOUT = 10
+MPD_PATH = "/out/v1/index.mpd"
+
+##
+## Checks
+##
+
+def reset(single_flight):
+    proxy.SINGLEFLIGHT = "True" if single_flight else "False"
+    proxy.MANIFESTCACHE = "True"
+    proxy.MANIFEST_CACHE.clear()
+
+async def request(origin, failures, name):
+    event = {"httpMethod": "GET", "path": MPD_PATH, "queryStringParameters": {"origin": origin.url}, "headers": {}}
+    try:
+        return await asyncio.wait_for(proxy_server.async_lambda_handler(event), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        failures.append(name)
+        print("FAILED %s : no response after %s seconds" % (name, REQUEST_TIMEOUT))
+
+def check(name, passed, detail, failures):
+    if not passed:
+        failures.append(name)
+        print("FAILED %s : %s" % (name, detail))
+
+async def check_fresh_cache_hits(origin, single_flight, failures):
+    # The same manifest twice inside its cache lifetime: the second request never reaches the origin
+    name = "fresh cache hit single_flight=%s" % (single_flight)
+    reset(single_flight)
+    origin.requests = 0
+    first = await request(origin, failures, name + " first request")
+    second = await request(origin, failures, name + " second request")
+    if first is None or second is None:
+        return
+    check(name, first['statusCode'] == 200 and second['statusCode'] == 200, "status codes %s and %s" % (first['statusCode'], second['statusCode']), failures)
+    check(name, first['body'] == second['body'], "the cached response differs from the first", failures)
+    check(name, origin.requests == 1, "%d origin requests, expected 1" % (origin.requests), failures)
+    check(name, not proxy_server.IN_FLIGHT, "rewrites still in flight: %s" % (list(proxy_server.IN_FLIGHT)), failures)
+
+def failing_modify(mpd_bytes, mpd_path, metrics):
+    raise ValueError("modify stage failed")
+
+async def check_failed_rewrite(origin, failures):
+    # A rewrite that fails in a stage with no error handling of its own. The request that ran it and the requests that
+    # waited on it all get the error response
+    name = "failed rewrite"
+    reset(True)
+    proxy.REWRITECACHE = "False"
+    modify_manifest = proxy.modify_manifest
+    proxy.modify_manifest = failing_modify
+    try:
+        event = {"httpMethod": "GET", "path": MPD_PATH, "queryStringParameters": {"origin": origin.url}, "headers": {}}
+        try:
+            response = proxy.lambda_handler(event, None)
+            check(name + " lambda_handler", response['statusCode'] == 500, "status code %s" % (response['statusCode']), failures)
+        except Exception as e:
+            check(name + " lambda_handler", False, "raised %r" % (e), failures)
+
+        try:
+            responses = await asyncio.gather(*[request(origin, failures, name + " server") for index in range(3)])
+        except Exception as e:
+            check(name + " server", False, "raised %r" % (e), failures)
+        else:
+            codes = [response['statusCode'] for response in responses if response is not None]
+            check(name + " server", codes == [500, 500, 500], "status codes %s" % (codes), failures)
+    finally:
+        proxy.modify_manifest = modify_manifest
+
+async def run_checks(origin):
+    failures = []
+    for single_flight in (True, False):
+        await check_fresh_cache_hits(origin, single_flight, failures)
+    await check_failed_rewrite(origin, failures)
+    await proxy_server.close_origin_client()
+    return failures
+
+def main():
+    proxy.LOGGER.setLevel(logging.WARNING)
+    set_metrics_sink(lambda record: None)
+    with LocalOrigin({MPD_PATH: corpus.live_mpd()}) as origin:
+        failures = asyncio.run(run_checks(origin))
+    if not failures:
+        print("All proxy server checks passed")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
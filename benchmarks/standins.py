@@ -0,0 +1,127 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Local stand-ins for the services the entry points talk to, so the benchmarks run offline: an in-memory S3
+and MediaConvert behind a boto3-like client() and an HTTP origin on localhost serving manifests from memory.
+
+Original Author: Scott Cunningham
+'''
+
+import io
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+##
+## AWS
+##
+
+### Only the calls the Lambda functions make are implemented. An entry point is pointed at the stand-in by replacing its
+### module level 'boto3' (and any client it created at import time) with a LocalAWS
+
+class LocalS3(object):
+
+    def __init__(self):
+        self.objects = {}
+        self.puts = 0
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)]), 'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        with self.lock:
+            self.objects[(Bucket, Key)] = Body
+            self.puts += 1
+        return {'ETag': '"local"'}
+
+class LocalMediaConvert(object):
+
+    def __init__(self):
+        self.jobs = {}
+
+    def describe_endpoints(self, **kwargs):
+        return {'Endpoints': [{'Url': "https://mediaconvert.local"}]}
+
+    def get_job(self, Id):
+        return self.jobs[Id]
+
+class LocalAWS(object):
+
+    def __init__(self):
+        self.s3 = LocalS3()
+        self.mediaconvert = LocalMediaConvert()
+
+    def client(self, service_name, *args, **kwargs):
+        if service_name == "s3":
+            return self.s3
+        if service_name == "mediaconvert":
+            return self.mediaconvert
+        raise ValueError("No local stand-in for %s" % (service_name))
+
+##
+## Origin
+##
+
+class LocalOrigin(object):
+
+    ### An HTTP server on a free localhost port, in a background thread, serving 'documents' (path -> bytes). Use it as a
+    ### context manager, 'url' is the origin to hand to the live proxy
+
+    def __init__(self, documents=None):
+        self.documents = documents if documents is not None else {}
+        self.requests = 0
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                origin.requests += 1
+                body = origin.documents.get(self.path.split("?", 1)[0])
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/dash+xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:%d" % (self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,171 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Checks that dash_manifest.writer.unparse() and the MPD object model's to_xml() write exactly what
+xmltodict.unparse(short_empty_elements=True) writes, pretty and compact, for synthetic manifests of increasing size
+(see corpus.py) and a set of edge cases, and times the three writers against each other.
+
+The writer matches xmltodict 0.12.0, the version packaged in the Lambda function zips, so that is the version the output
+is compared against: xmltodict.py is loaded from live_proxy/dash-manipulator-lambda.zip, whatever xmltodict is installed.
+Later xmltodict releases write a few edge cases differently (see EDGE_CASES).
+
+Usage:
+    python benchmarks/writer_parity.py [--repeat N] [--quick] [--json]
+
+Exits with status 1 when any output differs, after printing where
+
+Original Author: Scott Cunningham
+'''
+
+import os
+import sys
+import json
+import time
+import zipfile
+import argparse
+import importlib.util
+from collections import OrderedDict
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+from dash_manifest.model import parse_mpd
+from dash_manifest.writer import unparse
+
+# xmltodict as deployed with the live proxy
+XMLTODICT_ZIP = os.path.join(REPO, "live_proxy", "dash-manipulator-lambda.zip")
+XMLTODICT_VERSION = "0.12.0"
+
+def deployed_xmltodict():
+    # Only xmltodict.py is loaded from the zip, the other packages in it (requests ...) are left alone
+    with zipfile.ZipFile(XMLTODICT_ZIP) as bundle:
+        source = bundle.read("xmltodict.py")
+    spec = importlib.util.spec_from_loader("xmltodict", loader=None)
+    module = importlib.util.module_from_spec(spec)
+    exec(compile(source, XMLTODICT_ZIP + "/xmltodict.py", "exec"), module.__dict__)
+    if module.__version__ != XMLTODICT_VERSION:
+        raise RuntimeError("%s holds xmltodict %s, the writer matches %s" % (XMLTODICT_ZIP, module.__version__, XMLTODICT_VERSION))
+    return module
+
+xmltodict = deployed_xmltodict()
+
+##
+## Cases
+##
+
+def vod_manifest(**case):
+    return corpus.vod_mpd(**case)[0]
+
+MANIFEST_CASES = [
+    ("live", corpus.live_mpd, {"periods": 1, "adaptation_sets": 2, "representations": 4, "runs": 25}),
+    ("live", corpus.live_mpd, {"periods": 3, "adaptation_sets": 3, "representations": 6, "runs": 150}),
+    ("vod", vod_manifest, {"representations": 4, "runs": 100}),
+    ("live", corpus.live_mpd, {"periods": 6, "adaptation_sets": 4, "representations": 8, "runs": 600}),
+    ("vod", vod_manifest, {"representations": 8, "runs": 5000})
+]
+
+# Documents as xmltodict would hold them, covering what the writer does besides plain elements and attributes. Cases 3
+# and 5 are where xmltodict 0.12 differs from later releases (1.0.4 for one): text after an empty list of children
+# starts on a new line, and an element whose only children are empty lists is written as an open and close tag pair
+# ('<Period>\n\t</Period>') rather than '<Period/>'
+EDGE_CASES = [
+    {"MPD": {"@a": 'quote " and apostrophe \'', "@b": "both \" '", "@c": "line\nbreak\ttab\rreturn", "@d": "<&>"}},
+    {"MPD": {"BaseURL": "http://example.com/?a=1&b=<2>", "Empty": "", "None": None, "Flag": True, "Off": False, "Number": 7}},
+    {"MPD": {"@xmlns": {"": "urn:mpeg:dash:schema:mpd:2011", "scte35": "urn:scte:scte35:2013:xml"}, "Period": None}},
+    {"MPD": {"Period": [], "#text": "text after no children"}},
+    {"MPD": {"Period": [{"@id": "1"}, None, "text", {"@id": "2", "#text": "x", "Child": {"@n": 3}}], "#text": "tail"}},
+    {"MPD": {"Period": {"AdaptationSet": []}}},
+    {"MPD": {"Period": {"#text": ""}, "Other": {"@x": "", "#text": None}}},
+    {"MPD": OrderedDict([("@z", "1"), ("S", [{"@t": "0", "@d": "1"}, {"@d": "2", "@r": "3"}, {"@d": "4", "Child": "c"}]), ("@a", "2")])},
+    {"MPD": "root text only"}
+]
+
+##
+## Checks
+##
+
+def first_difference(expected, actual):
+    for index in range(min(len(expected), len(actual))):
+        if expected[index] != actual[index]:
+            return index
+    return min(len(expected), len(actual))
+
+def check(name, expected, actual, failures):
+    if expected != actual:
+        index = first_difference(expected, actual)
+        failures.append(name)
+        print("MISMATCH %s at character %d" % (name, index))
+        print("  xmltodict : %r" % (expected[max(index - 60, 0):index + 60]))
+        print("  writer    : %r" % (actual[max(index - 60, 0):index + 60]))
+
+def best_of(function, repeat):
+    seconds = []
+    for run in range(repeat):
+        started = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - started)
+    return min(seconds) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time the manifest writers against xmltodict.unparse")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="only the first two manifest cases")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    failures = []
+    results = []
+
+    for number, document in enumerate(EDGE_CASES):
+        for pretty in (True, False):
+            check("edge case %d pretty=%s" % (number, pretty), xmltodict.unparse(document, short_empty_elements=True, pretty=pretty), unparse(document, pretty=pretty), failures)
+
+    for kind, generate, case in MANIFEST_CASES[:2] if args.quick else MANIFEST_CASES:
+        body = generate(**case)
+        document = xmltodict.parse(body)
+        mpd = parse_mpd(body)
+        label = "%s %s" % (kind, " ".join("%s=%s" % (key, case[key]) for key in case))
+        for pretty in (True, False):
+            expected = xmltodict.unparse(document, short_empty_elements=True, pretty=pretty)
+            check("%s pretty=%s writer" % (label, pretty), expected, unparse(document, pretty=pretty), failures)
+            check("%s pretty=%s model" % (label, pretty), expected, mpd.to_xml(pretty=pretty), failures)
+            result = {
+                "case": label,
+                "pretty": pretty,
+                "bytes": len(expected),
+                "xmltodict_ms": best_of(lambda: xmltodict.unparse(document, short_empty_elements=True, pretty=pretty), args.repeat),
+                "writer_ms": best_of(lambda: unparse(document, pretty=pretty), args.repeat),
+                "model_ms": best_of(lambda: mpd.to_xml(pretty=pretty), args.repeat)
+            }
+            results.append(result)
+            if not args.json:
+                print("%-62s pretty=%-5s %9d bytes  xmltodict %8.2f ms  writer %8.2f ms (x%.1f)  model %8.2f ms (x%.1f)" % (label, pretty, result['bytes'], result['xmltodict_ms'], result['writer_ms'], result['xmltodict_ms'] / result['writer_ms'], result['model_ms'], result['xmltodict_ms'] / result['model_ms']))
+
+    if args.json:
+        print(json.dumps({"results": results, "mismatches": failures}, indent=2))
+    elif not failures:
+        print("All output matches xmltodict %s unparse" % (xmltodict.__version__))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
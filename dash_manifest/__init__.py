@@ -0,0 +1,89 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Shared code for the DASH manifest modifier entry points (live proxy, VOD Lambdas, post-transcode and manual
+scripts): the MPD object model, the manifest rule engine, node adapters, streaming rewriter, manifest writer, manifest
+file I/O, ESAM and SCTE-35 helpers, segment URL resolution and invocation metrics.
+
+Original Author: Scott Cunningham
+'''
+
+import importlib
+
+### Names are exported lazily: 'import dash_manifest' loads nothing else, and a submodule is only imported the first
+### time one of its names is used, so an entry point only pays for the parts of the package it actually touches
+
+EXPORTS = {
+    "lazy_import": "lazy",
+    "as_list": "mpd",
+    "representations": "mpd",
+    "Node": "model",
+    "MPD": "model",
+    "Period": "model",
+    "AdaptationSet": "model",
+    "Representation": "model",
+    "SegmentTemplate": "model",
+    "SegmentTimeline": "model",
+    "EventStream": "model",
+    "element": "model",
+    "parse_mpd": "model",
+    "unparse": "writer",
+    "quote_attribute": "writer",
+    "escape_text": "writer",
+    "ManifestRuleError": "rules",
+    "ManifestRule": "rules",
+    "ManifestRuleSet": "rules",
+    "MANIFEST_RULE_ACTIONS": "rules",
+    "load_manifest_rules": "rules",
+    "DictNodeAdapter": "adapters",
+    "ElementTreeNodeAdapter": "adapters",
+    "ModelNodeAdapter": "adapters",
+    "StreamNode": "stream",
+    "StreamNodeAdapter": "stream",
+    "StreamingManifestRewriter": "stream",
+    "stream_rewrite_manifest": "stream",
+    "parse_manifest_file": "files",
+    "manifest_file_mode": "files",
+    "atomic_manifest_writer": "files",
+    "iso_duration_seconds": "esam",
+    "esam_signals": "esam",
+    "SCTE35_FORMAT": "scte35",
+    "SCTE35_SCHEMES": "scte35",
+    "SCTE35_NAMESPACES": "scte35",
+    "SCTE35_EVENTS_MARKER": "scte35",
+    "splice_info_section": "scte35",
+    "insert_scte35_events": "scte35",
+    "resolve_url": "urls",
+    "InvocationMetrics": "metrics",
+    "set_metrics_sink": "metrics"
+}
+
+__all__ = list(EXPORTS)
+
+def __getattr__(name):
+    if name not in EXPORTS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module("dash_manifest." + EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,125 @@
+from dash_manifest.lazy import lazy_import
+from dash_manifest.mpd import as_list
+
+ET = lazy_import("xml.etree.ElementTree")
+model = lazy_import("dash_manifest.model")
+
+##
+## Node adapters
+##
+
+### The manifest rules only ever reach the manifest through an adapter, which implements children(), get(), set(),
+### remove_attribute(), remove_elements(), add_element() and base_url() for one way of holding a parsed manifest
+
+class DictNodeAdapter(object):
+
+    ### Rule actions on the dictionaries built by xmltodict: attributes are '@name' keys, child elements are a dict or a list of dicts
+
+    def children(self, node, name):
+        return [c for c in as_list(node.get(name)) if isinstance(c, dict)]
+
+    def get(self, node, attribute):
+        return node.get('@' + attribute)
+
+    def set(self, node, attribute, value):
+        node['@' + attribute] = value
+
+    def remove_attribute(self, node, attribute):
+        return node.pop('@' + attribute, None) is not None
+
+    def remove_elements(self, node, name):
+        return node.pop(name, None) is not None
+
+    def add_element(self, node, name, attributes):
+        node[name] = dict(('@' + attribute, attributes[attribute]) for attribute in attributes)
+
+    def base_url(self, node):
+        for base_url in as_list(node.get('BaseURL')):
+            return base_url.get('#text') if isinstance(base_url, dict) else base_url
+        return None
+
+class ElementTreeNodeAdapter(object):
+
+    ### Rule actions on ElementTree elements, element names are qualified with the manifest's default namespace
+
+    # a new element goes ahead of the first of these children, to keep the schema order
+    CONTAINERS = ("SegmentBase", "SegmentList", "SegmentTemplate", "ContentComponent", "Representation", "SubRepresentation", "AdaptationSet", "Subset")
+
+    def __init__(self, ns):
+        self.ns = ns
+        self.containers = [ns + name for name in self.CONTAINERS]
+
+    def children(self, node, name):
+        return node.findall(self.ns + name)
+
+    def get(self, node, attribute):
+        return node.get(attribute)
+
+    def set(self, node, attribute, value):
+        node.set(attribute, value)
+
+    def remove_attribute(self, node, attribute):
+        return node.attrib.pop(attribute, None) is not None
+
+    def remove_elements(self, node, name):
+        children = node.findall(self.ns + name)
+        for child in children:
+            node.remove(child)
+        return len(children) > 0
+
+    def add_element(self, node, name, attributes):
+        new_element = ET.Element(self.ns + name, dict(attributes))
+        existing = node.findall(self.ns + name)
+        if existing:
+            node[list(node).index(existing[0])] = new_element
+            for child in existing[1:]:
+                node.remove(child)
+            return
+        for index, child in enumerate(node):
+            if child.tag in self.containers:
+                node.insert(index, new_element)
+                return
+        node.append(new_element)
+
+    def base_url(self, node):
+        base_url = node.find(self.ns + "BaseURL")
+        return base_url.text if base_url is not None else None
+
+class ModelNodeAdapter(object):
+
+    ### Rule actions on the MPD object model (dash_manifest/model.py). Like the ElementTree adapter, a new element goes
+    ### ahead of the first container child, to keep the schema order
+
+    CONTAINERS = ElementTreeNodeAdapter.CONTAINERS
+
+    def children(self, node, name):
+        return node.findall(name)
+
+    def get(self, node, attribute):
+        return node.attributes.get(attribute)
+
+    def set(self, node, attribute, value):
+        node.set(attribute, value)
+
+    def remove_attribute(self, node, attribute):
+        return node.attributes.pop(attribute, None) is not None
+
+    def remove_elements(self, node, name):
+        return node.remove_children(name) > 0
+
+    def add_element(self, node, name, attributes):
+        new_element = model.element(name, dict(attributes))
+        for index, child in enumerate(node.children):
+            if child.name == name:
+                node.remove_children(name)
+                node.children.insert(index, new_element)
+                return
+        for index, child in enumerate(node.children):
+            if child.name in self.CONTAINERS:
+                node.children.insert(index, new_element)
+                return
+        node.children.append(new_element)
+
+    def base_url(self, node):
+        base_url = node.find("BaseURL")
+        return base_url.text if base_url is not None else None
@@ -0,0 +1,53 @@
+import re
+import logging
+
+from dash_manifest.lazy import lazy_import
+
+ET = lazy_import("xml.etree.ElementTree")
+
+##
+## ESAM signals
+##
+
+### The ad breaks come from the ESAM SignalProcessingNotification in the MediaConvert job settings. It's read in a single
+### pass with an incremental parser, keeping just the three values used from each ResponseSignal, rather than being
+### turned into a dictionary first. Element names are matched without their namespace prefix
+
+ISO_DURATION = re.compile(r'^P(?:(\d+(?:\.\d+)?)D)?(?:T(?:(\d+(?:\.\d+)?)H)?(?:(\d+(?:\.\d+)?)M)?(?:(\d+(?:\.\d+)?)S)?)?$')
+ESAM_READ_SIZE = 65536
+
+def iso_duration_seconds(duration_string):
+    # PT30S / PT1M30.5S / PT1H2M -> seconds as a float, None if the value is not a duration we understand
+    match = ISO_DURATION.match(duration_string.strip()) if duration_string else None
+    if match is None or not any(match.groups()):
+        return None
+    days, hours, minutes, seconds = [float(x) if x else 0.0 for x in match.groups()]
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds
+
+def esam_signals(esam_xml):
+    # (signalPointID, duration in seconds or None, segmentTypeId) for every ResponseSignal, sorted on the signal point.
+    # A signal whose signalPointID is missing or isn't a number is logged and left out
+    signals = []
+    signal_point_id = duration = segment_type_id = None
+    parser = ET.XMLPullParser(events=("start", "end"))
+    for offset in range(0, len(esam_xml), ESAM_READ_SIZE):
+        parser.feed(esam_xml[offset:offset + ESAM_READ_SIZE])
+        for event, element in parser.read_events():
+            name = element.tag.rsplit('}', 1)[-1]
+            if event == "start":
+                if name == "ResponseSignal":
+                    signal_point_id = element.get('signalPointID')
+                    duration = segment_type_id = None
+                elif name == "SegmentationDescriptorInfo":
+                    duration = iso_duration_seconds(element.get('duration'))
+                    segment_type_id = element.get('segmentTypeId')
+            elif name == "ResponseSignal":
+                try:
+                    signals.append((float(signal_point_id), signal_point_id, duration, segment_type_id))
+                except (TypeError, ValueError):
+                    logging.getLogger().warning("ESAM: skipping ResponseSignal with signalPointID %s , segmentTypeId %s " % (signal_point_id, segment_type_id))
+                element.clear()
+    parser.close()
+    signals.sort(key=lambda signal: signal[0])
+    return [signal[1:] for signal in signals]
+
@@ -0,0 +1,58 @@
+import os
+import mmap
+import stat
+import tempfile
+import contextlib
+
+from dash_manifest.lazy import lazy_import
+
+xmltodict = lazy_import("xmltodict")
+
+##
+## Manifest files
+##
+
+### Manifests are read straight into bytes for the parser, and anything over MMAP_THRESHOLD bytes is memory mapped and
+### handed to expat without being copied into a string first. New manifests are written to a temporary file in the same
+### directory, flushed to disk and then renamed over the destination, so a packager or origin reading the directory
+### only ever sees the old manifest or the complete new one, never a half written file
+MMAP_THRESHOLD = int(os.environ.get('MMAP_THRESHOLD', 1048576))
+MANIFESTFSYNC = os.environ.get('MANIFEST_FSYNC', "True")
+
+def parse_manifest_file(path, parse=None):
+    # 'parse' takes the manifest bytes or a readable object, xmltodict.parse when it isn't given
+    parse = parse or xmltodict.parse
+    with open(path, 'rb') as manifest_file:
+        if os.fstat(manifest_file.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(manifest_file.fileno(), 0, access=mmap.ACCESS_READ) as manifest_map:
+                return parse(manifest_map)
+        return parse(manifest_file.read())
+
+def manifest_file_mode(path):
+    # Keep the permissions of the manifest being replaced, a new manifest gets the usual permissions for a new file
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+@contextlib.contextmanager
+def atomic_manifest_writer(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    temporary_fd, temporary_path = tempfile.mkstemp(dir=directory, prefix="." + name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(temporary_fd, 'w', encoding="utf-8") as out:
+            yield out
+            out.flush()
+            if MANIFESTFSYNC == "True":
+                os.fsync(out.fileno())
+        os.chmod(temporary_path, manifest_file_mode(path))
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        raise
+
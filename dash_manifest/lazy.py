@@ -0,0 +1,28 @@
+import sys
+import types
+import importlib
+import importlib.util
+
+### lazy_import() hands back a module object straight away, but the module's code only runs the first time one of its
+### attributes is used. Entry points use it for the heavy dependencies (xmltodict, boto3 ...) that some requests or
+### command line modes never touch, so they no longer add to the Lambda cold start or the command line startup time.
+### A module that isn't installed still fails at import time, exactly as a normal import would
+###
+### The first attribute access does a normal import of the module and copies its attributes onto the lazy module. The
+### import system's own locks make that safe when several threads touch the module at once, which
+### importlib.util.LazyLoader isn't before Python 3.12: a second thread could see a half initialised module
+
+class LazyModule(types.ModuleType):
+
+    def __getattr__(self, attr):
+        # Only called for attributes the lazy module doesn't have yet, so only until the module has been imported
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError("No module named '%s'" % (name), name=name)
+    return LazyModule(name)
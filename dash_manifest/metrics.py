@@ -0,0 +1,163 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Per invocation metrics for the entry points: wall time of each stage (fetch, parse, modify, serialize, upload
+...), byte sizes and node counts, emitted as one JSON line per invocation in CloudWatch Embedded Metric Format.
+
+Original Author: Scott Cunningham
+'''
+
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+### An entry point creates one InvocationMetrics per invocation, times its stages with 'with metrics.stage("parse"):'
+### and calls emit() once at the end. Only a sample of invocations (METRICS_SAMPLE_RATE) is measured: for the rest,
+### stage() hands back a shared do-nothing context manager and add() / set_property() / emit() return straight away,
+### so an unsampled invocation pays for one random() call and nothing else
+###
+### Sinks:
+###   emf   one JSON line on stdout, which CloudWatch Logs turns into metrics (Embedded Metric Format)
+###   log   the same JSON line through the logging module, at INFO
+###   none  nothing is measured or written
+###
+### Any callable taking the record (a dict) can be installed as the sink with set_metrics_sink()
+
+METRICS_SINK = os.environ.get('METRICS_SINK', "emf")
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', "DashManifestModifier")
+
+def emf_sink(record):
+    sys.stdout.write(json.dumps(record, separators=(",", ":")) + "\n")
+    sys.stdout.flush()
+
+def log_sink(record):
+    logging.getLogger().info(json.dumps(record, separators=(",", ":")))
+
+METRICS_SINKS = {
+    "emf": emf_sink,
+    "log": log_sink,
+    "none": None
+}
+
+metrics_sink = METRICS_SINKS[METRICS_SINK]
+
+def set_metrics_sink(sink):
+    # A sink name from METRICS_SINKS, a callable, or None to turn metrics off
+    global metrics_sink
+    metrics_sink = METRICS_SINKS[sink] if isinstance(sink, str) else sink
+
+class Stage(object):
+
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_time(self.name, time.perf_counter() - self.started)
+        return False
+
+class UnsampledStage(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+UNSAMPLED_STAGE = UnsampledStage()
+
+class InvocationMetrics(object):
+
+    def __init__(self, entry_point, sink=None, sample_rate=None):
+        self.entry_point = entry_point
+        self.sink = sink or metrics_sink
+        self.sampled = self.sink is not None and random.random() < (METRICS_SAMPLE_RATE if sample_rate is None else sample_rate)
+        self.started = time.perf_counter()
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+
+    def stage(self, name):
+        # Wall time of the 'with' block, added to the '<name>Time' metric in milliseconds. A stage that runs more than
+        # once in an invocation adds up
+        if not self.sampled:
+            return UNSAMPLED_STAGE
+        return Stage(self, name)
+
+    def add_time(self, name, seconds):
+        if self.sampled:
+            self.add(name + "Time", seconds * 1000, "Milliseconds")
+
+    def add(self, name, value, unit="Count"):
+        if self.sampled:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def set_property(self, name, value):
+        # Written alongside the metrics in the same record, searchable in CloudWatch Logs Insights but not a metric
+        if self.sampled:
+            self.properties[name] = value
+
+    def add_rule_timings(self, manifest_rules):
+        if self.sampled:
+            self.add_time("Rules", manifest_rules.total_seconds())
+            self.add("RuleNodes", manifest_rules.nodes)
+            self.properties["Rules"] = manifest_rules.timing_records()
+
+    def record(self):
+        self.add_time("Total", time.perf_counter() - self.started)
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["EntryPoint"]],
+                    "Metrics": [{"Name": name, "Unit": self.units[name]} for name in self.values]
+                }]
+            },
+            "EntryPoint": self.entry_point
+        }
+        record.update(self.properties)
+        for name in self.values:
+            record[name] = round(self.values[name], 3) if self.units[name] == "Milliseconds" else self.values[name]
+        return record
+
+    def emit(self):
+        if not self.sampled:
+            return
+        try:
+            record = self.record()
+            self.sampled = False # emitted once, however many times emit() is called
+            self.sink(record)
+        except Exception as e:
+            logging.getLogger().warning("Metrics: unable to emit invocation metrics : %s " % (e))
@@ -0,0 +1,431 @@
+from array import array
+from xml.parsers import expat
+
+from dash_manifest.esam import iso_duration_seconds
+from dash_manifest.writer import XML_DECLARATION, escape_text, quote_attribute
+
+##
+## MPD object model
+##
+
+### A manifest held as a tree of Node objects rather than xmltodict dictionaries. Every node has the same four slots:
+### its element name, its attributes (a dict of strings, in document order), its child elements (always a list, in
+### document order, whether there's one of them or many) and its text. The elements the entry points work with get
+### their own classes (MPD, Period, AdaptationSet, Representation, SegmentTemplate, SegmentTimeline, EventStream), which
+### add typed accessors: attribute values stay strings until they're read, then come back as int, float or seconds.
+###
+### S elements aren't nodes at all. A SegmentTimeline keeps its S@t / S@d / S@r values in three array('q') columns, so
+### a DVR window of thousands of segments is three arrays rather than thousands of objects. An S element with anything
+### else on it (S@n, S@k, children ...) turns its timeline back into ordinary S nodes, so nothing is lost.
+###
+### parse_mpd() builds the tree straight from expat, and to_xml() writes it back out in the same layout as
+### xmltodict.unparse(pretty=True, short_empty_elements=True): tab indents, empty elements closed with '/>', element text
+### written after the element's children, whitespace-only text dropped. Unlike xmltodict, sibling elements keep their
+### document order even when elements of the same name are interleaved with others. to_xml(pretty=False) leaves out the
+### indents and line breaks, as xmltodict.unparse(pretty=False) does
+
+class Node(object):
+
+    __slots__ = ('name', 'attributes', 'children', 'text')
+
+    def __init__(self, name, attributes=None, children=None, text=None):
+        self.name = name
+        self.attributes = attributes if attributes is not None else {}
+        self.children = children if children is not None else []
+        self.text = text
+
+    def __repr__(self):
+        return "<%s %s %s children>" % (self.name, self.attributes, len(self.children))
+
+    def get(self, attribute, default=None):
+        return self.attributes.get(attribute, default)
+
+    def set(self, attribute, value):
+        self.attributes[attribute] = str(value)
+
+    def remove(self, attribute):
+        return self.attributes.pop(attribute, None) is not None
+
+    def find(self, name):
+        for child in self.children:
+            if child.name == name:
+                return child
+        return None
+
+    def findall(self, name):
+        return [child for child in self.children if child.name == name]
+
+    def append(self, child):
+        self.children.append(child)
+        return child
+
+    def remove_children(self, name):
+        # Number of child elements called 'name' that were removed
+        count = len(self.children)
+        self.children = [child for child in self.children if child.name != name]
+        return count - len(self.children)
+
+    def copy(self):
+        # A new node with its own attributes and child list, the children themselves are shared
+        node = self.__class__.__new__(self.__class__)
+        Node.__init__(node, self.name, dict(self.attributes), list(self.children), self.text)
+        return node
+
+    def iter(self, name=None):
+        # This node and every node below it, in document order
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if name is None or node.name == name:
+                yield node
+            stack.extend(reversed(node.children))
+
+    def to_xml(self, pretty=True):
+        out = []
+        write_node(self, 0, out.append, pretty)
+        return XML_DECLARATION + "".join(out)
+
+def int_attribute(name):
+    def getter(self):
+        value = self.attributes.get(name)
+        return int(value) if value is not None else None
+    return property(getter, doc="@%s as an int, None when it's missing" % (name))
+
+def float_attribute(name):
+    def getter(self):
+        value = self.attributes.get(name)
+        return float(value) if value is not None else None
+    return property(getter, doc="@%s as a float, None when it's missing" % (name))
+
+def duration_attribute(name):
+    def getter(self):
+        return iso_duration_seconds(self.attributes.get(name))
+    return property(getter, doc="@%s, an ISO 8601 duration, in seconds, None when it's missing" % (name))
+
+def string_attribute(name):
+    def getter(self):
+        return self.attributes.get(name)
+    return property(getter, doc="@%s, None when it's missing" % (name))
+
+def child_elements(name):
+    def getter(self):
+        return [child for child in self.children if child.name == name]
+    return property(getter, doc="The %s child elements, always a list" % (name))
+
+def child_element(name):
+    def getter(self):
+        for child in self.children:
+            if child.name == name:
+                return child
+        return None
+    return property(getter, doc="The first %s child element, None when there isn't one" % (name))
+
+class MPD(Node):
+
+    __slots__ = ()
+
+    type = string_attribute('type')
+    profiles = string_attribute('profiles')
+    minimum_update_period = duration_attribute('minimumUpdatePeriod')
+    media_presentation_duration = duration_attribute('mediaPresentationDuration')
+    periods = child_elements('Period')
+
+    def representations(self):
+        # (period, adaptation set, representation) for every Representation, in document order
+        for period in self.periods:
+            for adaptation_set in period.adaptation_sets:
+                for representation in adaptation_set.representations:
+                    yield period, adaptation_set, representation
+
+class Period(Node):
+
+    __slots__ = ()
+
+    id = string_attribute('id')
+    start = duration_attribute('start')
+    duration = duration_attribute('duration')
+    adaptation_sets = child_elements('AdaptationSet')
+    event_streams = child_elements('EventStream')
+
+class AdaptationSet(Node):
+
+    __slots__ = ()
+
+    id = string_attribute('id')
+    mime_type = string_attribute('mimeType')
+    content_type = string_attribute('contentType')
+    lang = string_attribute('lang')
+    segment_template = child_element('SegmentTemplate')
+    representations = child_elements('Representation')
+
+class Representation(Node):
+
+    __slots__ = ()
+
+    id = string_attribute('id')
+    bandwidth = int_attribute('bandwidth')
+    width = int_attribute('width')
+    height = int_attribute('height')
+    mime_type = string_attribute('mimeType')
+    segment_template = child_element('SegmentTemplate')
+
+class SegmentTemplate(Node):
+
+    __slots__ = ()
+
+    timescale = int_attribute('timescale')
+    duration = int_attribute('duration')
+    start_number = int_attribute('startNumber')
+    presentation_time_offset = int_attribute('presentationTimeOffset')
+    media = string_attribute('media')
+    initialization = string_attribute('initialization')
+    segment_timeline = child_element('SegmentTimeline')
+
+class EventStream(Node):
+
+    __slots__ = ()
+
+    scheme_id_uri = string_attribute('schemeIdUri')
+    timescale = int_attribute('timescale')
+    events = child_elements('Event')
+
+# S@t / S@r not given on an S element
+ABSENT = -(1 << 63)
+
+class SegmentTimeline(Node):
+
+    ### While 'compact', the S elements are the t / d / r columns and 'children' is empty. expand() turns them into S nodes
+
+    __slots__ = ('t', 'd', 'r', 'compact')
+
+    def __init__(self, name="SegmentTimeline", attributes=None, children=None, text=None):
+        Node.__init__(self, name, attributes, children, text)
+        self.t = array('q')
+        self.d = array('q')
+        self.r = array('q')
+        self.compact = not self.children
+
+    def copy(self):
+        timeline = Node.copy(self)
+        timeline.t = array('q', self.t)
+        timeline.d = array('q', self.d)
+        timeline.r = array('q', self.r)
+        timeline.compact = self.compact
+        return timeline
+
+    def __len__(self):
+        # Number of S elements
+        return len(self.t) if self.compact else len(self.findall('S'))
+
+    def append_s(self, t, d, r=ABSENT):
+        # Add an S element, leave t or r as ABSENT to leave that attribute off
+        if not self.compact:
+            s = Node('S', {})
+            if t != ABSENT:
+                s.set('t', t)
+            s.set('d', d)
+            if r != ABSENT:
+                s.set('r', r)
+            self.children.append(s)
+            return
+        self.t.append(t)
+        self.d.append(d)
+        self.r.append(r)
+
+    def clear_s(self):
+        self.t = array('q')
+        self.d = array('q')
+        self.r = array('q')
+        self.remove_children('S')
+
+    def s_elements(self):
+        # (t, d, r) of every S element as written, ABSENT where the attribute isn't there
+        if self.compact:
+            return zip(self.t, self.d, self.r)
+        return [(int(s.get('t', ABSENT)), int(s.get('d')), int(s.get('r', ABSENT))) for s in self.findall('S')]
+
+    def runs(self):
+        # (t, d, r) of every S element with the implied values filled in: a missing S@t follows on from the previous
+        # S element, a missing S@r is 0
+        end = 0
+        for t, d, r in self.s_elements():
+            if t == ABSENT:
+                t = end
+            if r == ABSENT:
+                r = 0
+            end = t + (max(r, 0) + 1) * d
+            yield t, d, r
+
+    def expand(self):
+        # Turn the columns back into S nodes, ahead of any other children
+        if not self.compact:
+            return
+        nodes = []
+        for t, d, r in zip(self.t, self.d, self.r):
+            s = Node('S', {})
+            if t != ABSENT:
+                s.attributes['t'] = str(t)
+            s.attributes['d'] = str(d)
+            if r != ABSENT:
+                s.attributes['r'] = str(r)
+            nodes.append(s)
+        self.children = nodes + self.children
+        self.t = array('q')
+        self.d = array('q')
+        self.r = array('q')
+        self.compact = False
+
+ELEMENT_CLASSES = {
+    "MPD": MPD,
+    "Period": Period,
+    "AdaptationSet": AdaptationSet,
+    "Representation": Representation,
+    "SegmentTemplate": SegmentTemplate,
+    "SegmentTimeline": SegmentTimeline,
+    "EventStream": EventStream
+}
+
+def element(name, attributes=None, children=None, text=None):
+    # A new node of the right class for its element name
+    return ELEMENT_CLASSES.get(name, Node)(name, attributes, children, text)
+
+##
+## Parsing
+##
+
+# S attribute layouts that fit the compact columns, as written by packagers: integer values in t, d, r order
+COMPACT_S_LAYOUTS = frozenset([("d",), ("t", "d"), ("d", "r"), ("t", "d", "r")])
+INT64_MAX = (1 << 63) - 1
+
+def compact_s_value(value):
+    # The integer in an S attribute, None unless it's written the way str() would write it and fits the columns
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    if ABSENT < number <= INT64_MAX and str(number) == value:
+        return number
+    return None
+
+class ModelBuilder(object):
+
+    ### expat handlers that build the tree. The stack holds [node, text pieces] for every open element. While a
+    ### SegmentTimeline is compact the timeline start / end handlers are swapped in: each S goes straight into the columns
+    ### and isn't pushed. The first S that doesn't fit (or anything else inside the timeline) expands it, and the rest of
+    ### the timeline is parsed as ordinary elements. The character data handler is never swapped, pyexpat would hand the
+    ### text being delivered to the new handler as well
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.root = None
+        self.stack = []
+        self.timeline = None
+        self.in_s = False
+        self.set_handlers(False)
+
+    def set_handlers(self, timeline):
+        self.parser.StartElementHandler = self.timeline_start if timeline else self.start
+        self.parser.EndElementHandler = self.timeline_end if timeline else self.end
+
+    def start(self, name, attributes):
+        node = ELEMENT_CLASSES.get(name, Node)(name, attributes)
+        if self.stack:
+            self.stack[-1][0].children.append(node)
+        else:
+            self.root = node
+        self.stack.append([node, None])
+        if node.__class__ is SegmentTimeline:
+            self.timeline = node
+            self.set_handlers(True)
+
+    def end(self, name):
+        node, text = self.stack.pop()
+        if text is not None:
+            node.text = "".join(text).strip() or None
+
+    def characters(self, data):
+        if self.in_s:
+            # leading whitespace in an S would be stripped anyway, anything else needs an S node to hold it
+            if data.isspace():
+                return
+            self.leave_timeline()
+        entry = self.stack[-1]
+        if entry[1] is None:
+            entry[1] = [data]
+        else:
+            entry[1].append(data)
+
+    def leave_timeline(self):
+        # Back to S nodes. An S that's still open becomes the last of them and is pushed like any other element
+        self.timeline.expand()
+        if self.in_s:
+            self.stack.append([self.timeline.children[-1], None])
+            self.in_s = False
+        self.timeline = None
+        self.set_handlers(False)
+
+    def timeline_start(self, name, attributes):
+        if name == "S" and not self.in_s and tuple(attributes) in COMPACT_S_LAYOUTS:
+            d = compact_s_value(attributes['d'])
+            t = compact_s_value(attributes['t']) if 't' in attributes else ABSENT
+            r = compact_s_value(attributes['r']) if 'r' in attributes else ABSENT
+            if d is not None and t is not None and r is not None:
+                timeline = self.timeline
+                timeline.t.append(t)
+                timeline.d.append(d)
+                timeline.r.append(r)
+                self.in_s = True
+                return
+        self.leave_timeline()
+        self.start(name, attributes)
+
+    def timeline_end(self, name):
+        if self.in_s:
+            self.in_s = False
+            return
+        self.timeline = None
+        self.set_handlers(False)
+        self.end(name)
+
+def parse_mpd(source):
+    # Manifest bytes, str or a readable object (an open file, an mmap) -> the root node, an MPD for a DASH manifest
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    builder = ModelBuilder(parser)
+    parser.CharacterDataHandler = builder.characters
+    if hasattr(source, 'read'):
+        parser.ParseFile(source)
+    else:
+        parser.Parse(source, True)
+    return builder.root
+
+##
+## Serializing
+##
+
+def write_node(node, depth, write, pretty=True):
+    indent = "\t" * depth if pretty else ""
+    newline = "\n" if pretty else ""
+    write(indent + "<" + node.name)
+    for attribute, value in node.attributes.items():
+        write(" " + attribute + "=" + quote_attribute(value))
+
+    compact_s = node.__class__ is SegmentTimeline and node.compact and len(node.t) > 0
+    if node.children or compact_s:
+        write(">" + newline)
+        if compact_s:
+            s_indent = indent + "\t" if pretty else ""
+            for t, d, r in zip(node.t, node.d, node.r):
+                write(s_indent + "<S" + ((' t="%d"' % t) if t != ABSENT else "") + (' d="%d"' % d) + ((' r="%d"' % r) if r != ABSENT else "") + "/>" + newline)
+        for child in node.children:
+            write_node(child, depth + 1, write, pretty)
+        if node.text:
+            write(escape_text(node.text))
+        write(indent + "</" + node.name + ">")
+    elif node.text:
+        write(">" + escape_text(node.text) + "</" + node.name + ">")
+    else:
+        write("/>")
+
+    if depth:
+        write(newline)
@@ -0,0 +1,22 @@
+##
+## MPD traversal
+##
+
+### xmltodict gives a child element as a dict when there's one of it and as a list of dicts when there are several, so
+### every loop over Periods, AdaptationSets, Representations or S elements has to handle both layouts. as_list() puts a
+### child in the list layout, whichever way it was parsed, and representations() walks the usual three levels of an MPD
+### dictionary with that done at every level
+
+def as_list(child):
+    if child is None:
+        return []
+    if isinstance(child, list):
+        return child
+    return [child]
+
+def representations(mpd):
+    # (period, adaptation set, representation) for every Representation under the MPD element, in document order
+    for period in as_list(mpd.get('Period')):
+        for adaptation_set in as_list(period.get('AdaptationSet')):
+            for representation in as_list(adaptation_set.get('Representation')):
+                yield period, adaptation_set, representation
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from dash_manifest.urls import resolve_url, document_base_url, child_base_url
+
+##
+## Manifest rules
+##
+
+### Every edit made to the manifest is a rule: a selector (the element path from MPD down, optionally narrowed with
+### 'where' attribute values), an action and a value. Each entry point keeps its own DEFAULT_MANIFEST_RULES, which can be
+### replaced with the MANIFEST_RULES environment variable (a JSON list) or the JSON file named in MANIFEST_RULES_FILE.
+### The rule set is compiled so that the manifest is walked once, each element is visited once and only the rules
+### selecting that element's path are evaluated. The rules never touch the manifest directly, they go through a node
+### adapter (see adapters.py and stream.py), so the same rules work on every parser backend
+###
+### Actions:
+###   set_attribute     name, value : set attribute 'name' to 'value'
+###   remove_attribute  name        : delete attribute 'name'
+###   remove_element    name        : delete every child element called 'name'
+###   add_element       name, value : replace any child elements called 'name' with one that has the 'value' attributes
+###   absolute_url      name        : resolve the relative URL in attribute 'name' against the manifest location (the
+###                                   context's mpd_path) and the BaseURL elements above it, see urls.py
+###
+### A rule that fails is logged as a modify exception and the manifest is still written, unless the rule has "required": true
+
+class ManifestRuleError(Exception):
+    pass
+
+def rule_set_attribute(rule, adapter, node, context):
+    adapter.set(node, rule.name, rule.value)
+
+def rule_remove_attribute(rule, adapter, node, context):
+    if not adapter.remove_attribute(node, rule.name):
+        raise KeyError(rule.name)
+
+def rule_remove_element(rule, adapter, node, context):
+    if not adapter.remove_elements(node, rule.name):
+        raise KeyError(rule.name)
+
+def rule_add_element(rule, adapter, node, context):
+    adapter.add_element(node, rule.name, rule.value)
+
+def rule_absolute_url(rule, adapter, node, context):
+    url = adapter.get(node, rule.name)
+    if url is None:
+        raise KeyError(rule.name)
+    base = context.get('base_url')
+    if base is None:
+        raise KeyError('mpd_path')
+    adapter.set(node, rule.name, resolve_url(base, url))
+
+MANIFEST_RULE_ACTIONS = {
+    "set_attribute": rule_set_attribute,
+    "remove_attribute": rule_remove_attribute,
+    "remove_element": rule_remove_element,
+    "add_element": rule_add_element,
+    "absolute_url": rule_absolute_url
+}
+
+class ManifestRule(object):
+
+    def __init__(self, number, rule):
+        if rule.get('action') not in MANIFEST_RULE_ACTIONS:
+            raise ManifestRuleError("Manifest rule %s has an unknown action : %s" % (number, rule.get('action')))
+        self.number = number
+        self.select = tuple(rule['select'].strip("/").split("/"))
+        self.where = rule.get('where', {})
+        self.action = rule['action']
+        self.function = MANIFEST_RULE_ACTIONS[self.action]
+        self.name = rule['name']
+        self.value = rule.get('value')
+        self.required = rule.get('required', False)
+
+    def describe(self):
+        return "%s %s %s" % ("/".join(self.select), self.action, self.name)
+
+    def matches(self, adapter, node):
+        for attribute in self.where:
+            if adapter.get(node, attribute) != self.where[attribute]:
+                return False
+        return True
+
+class RuleTimings(object):
+
+    ### Elements visited and, for each rule, elements evaluated and seconds spent, since the last reset_timings()
+
+    __slots__ = ('nodes', 'calls', 'seconds')
+
+    def __init__(self, rule_count):
+        self.nodes = 0
+        self.calls = [0] * rule_count
+        self.seconds = [0.0] * rule_count
+
+class ManifestRuleSet(object):
+
+    def __init__(self, rules):
+        self.rules = [ManifestRule(number, rule) for number, rule in enumerate(rules)]
+        # A rule set is compiled once per process and can be applied from several threads at once (the live proxy under
+        # a threaded server), so each thread counts in its own RuleTimings and reads back its own rewrite's timings
+        self.local = threading.local()
+
+        # Changes whenever the rule definitions change, so output rewritten by an older rule set is never reused
+        self.version = hashlib.sha256(json.dumps(rules, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+        # element path -> rules selecting it, and element path -> child element names that lead to more rules
+        self.by_path = {}
+        self.child_names = {}
+        # BaseURL elements are only looked at when a rule resolves URLs against them
+        self.resolves_urls = any(rule.action == "absolute_url" for rule in self.rules)
+        for rule in self.rules:
+            self.by_path.setdefault(rule.select, []).append(rule)
+            for depth in range(1, len(rule.select)):
+                names = self.child_names.setdefault(rule.select[:depth], [])
+                if rule.select[depth] not in names:
+                    names.append(rule.select[depth])
+
+    def reset_timings(self):
+        self.local.timings = RuleTimings(len(self.rules))
+
+    def current_timings(self):
+        timings = getattr(self.local, 'timings', None)
+        if timings is None:
+            timings = self.local.timings = RuleTimings(len(self.rules))
+        return timings
+
+    @property
+    def nodes(self):
+        # elements visited by this thread's last apply
+        return self.current_timings().nodes
+
+    def timings(self):
+        timings = self.current_timings()
+        return ["rule %s (%s) : %s elements, %.3f ms" % (rule.number, rule.describe(), timings.calls[rule.number], timings.seconds[rule.number] * 1000) for rule in self.rules]
+
+    def timing_records(self):
+        timings = self.current_timings()
+        return [{"rule": rule.number, "select": "/".join(rule.select), "action": rule.action, "name": rule.name, "calls": timings.calls[rule.number], "ms": round(timings.seconds[rule.number] * 1000, 3)} for rule in self.rules]
+
+    def total_seconds(self):
+        return sum(self.current_timings().seconds)
+
+    def apply_to_node(self, adapter, node, path, location, context, manifest_modify_exceptions):
+        timings = self.current_timings()
+        timings.nodes += 1
+        for rule in self.by_path.get(path, ()):
+            started = time.perf_counter()
+            try:
+                if rule.matches(adapter, node):
+                    rule.function(rule, adapter, node, context)
+            except Exception as e:
+                if rule.required:
+                    raise ManifestRuleError("%s : Unable to apply required rule %s (%s) : %s" % (location, rule.number, rule.describe(), e))
+                manifest_modify_exceptions.append("%s : Unable to apply rule %s (%s) : %s" % (location, rule.number, rule.describe(), e))
+            timings.calls[rule.number] += 1
+            timings.seconds[rule.number] += time.perf_counter() - started
+
+    def apply(self, adapter, root, manifest_modify_exceptions, context=None):
+        # One pre-order pass from the MPD element, descending only into elements that some rule can still select
+        self.reset_timings()
+        context = context or {}
+        stack = [(root, ("MPD",), "MPD", document_base_url(context))]
+        while stack:
+            node, path, location, base = stack.pop()
+            context['base_url'] = base
+            self.apply_to_node(adapter, node, path, location, context, manifest_modify_exceptions)
+            child_names = self.child_names.get(path, ())
+            if self.resolves_urls and child_names:
+                base = child_base_url(base, adapter.base_url(node))
+            descendants = []
+            for name in child_names:
+                for index, child in enumerate(adapter.children(node, name)):
+                    descendants.append((child, path + (name,), "%s - %s %s" % (location, name, index), base))
+            stack.extend(reversed(descendants))
+
+def load_manifest_rules(default_rules):
+    if os.environ.get('MANIFEST_RULES'):
+        return json.loads(os.environ['MANIFEST_RULES'])
+    if os.environ.get('MANIFEST_RULES_FILE'):
+        with open(os.environ['MANIFEST_RULES_FILE']) as rules_file:
+            return json.load(rules_file)
+    return default_rules
@@ -0,0 +1,95 @@
+import os
+import re
+
+##
+## SCTE-35 events
+##
+
+### The ad break Event elements are written straight from a template rather than built up as dictionaries and serialized
+### by xmltodict. The EventStream holds a marker while the manifest is unparsed, and the marker is then swapped for the
+### rendered Events at the EventStream's indent. Set SCTE35_FORMAT to "bin" to write each Event as a base64 binary
+### splice_info_section (urn:scte:scte35:2014:xml+bin) instead of the XML SpliceInfoSection
+###
+### The XML SpliceInfoSection differs between entry points, so each one passes its own SCTE35_EVENT_XML lines to
+### insert_scte35_events(). Event elements aren't in the manifest while the manifest rules are applied, so rules can't
+### select them
+
+SCTE35_FORMAT = "bin" if os.environ.get('SCTE35_FORMAT', "xml") == "bin" else "xml"
+SCTE35_SCHEMES = {"xml": "urn:scte:scte35:2013:xml", "bin": "urn:scte:scte35:2014:xml+bin"}
+SCTE35_NAMESPACES = {"xml": "urn:scte:scte35:2013:xml", "bin": "http://www.scte.org/schemas/35/2016"}
+SCTE35_EVENTS_MARKER = "__SCTE35_EVENTS__"
+SCTE35_EVENTS_ELEMENT = re.compile(r'^(\t*)(<EventStream\b[^>]*>)%s</EventStream>$' % (SCTE35_EVENTS_MARKER), re.MULTILINE)
+SCTE35_EVENT_BIN = (
+    (0, '<Event%(event_attributes)s>'),
+    (1, '<scte35:Signal>'),
+    (2, '<scte35:Binary>%(binary)s</scte35:Binary>'),
+    (1, '</scte35:Signal>'),
+    (0, '</Event>')
+)
+SCTE35_TEMPLATES = {}
+
+def scte35_template(event_xml, depth):
+    # The lines of one Event, indented for an Event 'depth' tabs deep, compiled to a single format string
+    lines = SCTE35_EVENT_BIN if SCTE35_FORMAT == "bin" else event_xml
+    if (lines, depth) not in SCTE35_TEMPLATES:
+        SCTE35_TEMPLATES[(lines, depth)] = "".join("\t" * (depth + level) + line + "\n" for level, line in lines)
+    return SCTE35_TEMPLATES[(lines, depth)]
+
+def crc32_mpeg2_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for bit in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+# Built the first time a binary section is written, XML Events never need it
+CRC32_MPEG2_TABLE = []
+
+def crc32_mpeg2(data):
+    if not CRC32_MPEG2_TABLE:
+        CRC32_MPEG2_TABLE.extend(crc32_mpeg2_table())
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ CRC32_MPEG2_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+def splice_info_section(pts_time, segmentation_duration, segmentation_event_id, segmentation_type_id, delivery_restrictions=None, upid_type=12, upid=b"", segment_num=0, segments_expected=1):
+    # SCTE-35 splice_info_section holding a time_signal and one segmentation_descriptor. pts_time and segmentation_duration
+    # are 90kHz ticks, delivery_restrictions is None or (web delivery allowed, no regional blackout, archive allowed, device restrictions)
+    descriptor = bytearray(b"CUEI")
+    descriptor += (segmentation_event_id & 0xFFFFFFFF).to_bytes(4, "big")
+    descriptor.append(0x7F) # segmentation_event_cancel_indicator 0
+    if delivery_restrictions is None:
+        descriptor.append(0xFF) # program segmentation, duration, delivery not restricted
+    else:
+        web_delivery_allowed, no_regional_blackout, archive_allowed, device_restrictions = delivery_restrictions
+        descriptor.append(0xC0 | web_delivery_allowed << 4 | no_regional_blackout << 3 | archive_allowed << 2 | (device_restrictions & 0x03))
+    descriptor += (segmentation_duration & 0xFFFFFFFFFF).to_bytes(5, "big")
+    descriptor += bytes((upid_type, len(upid))) + upid
+    descriptor += bytes((segmentation_type_id, segment_num, segments_expected))
+
+    splice_time = bytes((0xFE | (pts_time >> 32) & 0x01,)) + (pts_time & 0xFFFFFFFF).to_bytes(4, "big")
+
+    section = bytearray()
+    section.append(0) # protocol_version
+    section += bytes(5) # not encrypted, pts_adjustment 0
+    section.append(0xFF) # cw_index
+    section += (0xFFF << 12 | len(splice_time)).to_bytes(3, "big") # tier, splice_command_length
+    section.append(0x06) # time_signal
+    section += splice_time
+    section += (len(descriptor) + 2).to_bytes(2, "big") # descriptor_loop_length
+    section += bytes((0x02, len(descriptor))) + descriptor
+
+    header = bytes((0xFC,)) + (0x3000 | (len(section) + 4)).to_bytes(2, "big")
+    section = header + section
+    return bytes(section + crc32_mpeg2(section).to_bytes(4, "big"))
+
+def insert_scte35_events(mpd_xml, scte35_events, event_xml):
+    # Swap the EventStream marker left by the unparse for the rendered Event elements
+    def render(match):
+        indent, start_tag = match.group(1), match.group(2)
+        template = scte35_template(event_xml, len(indent) + 1)
+        return "%s%s\n%s%s</EventStream>" % (indent, start_tag, "".join(template % event for event in scte35_events), indent)
+    return SCTE35_EVENTS_ELEMENT.sub(render, mpd_xml, count=1)
@@ -0,0 +1,187 @@
+import xml.sax
+import xml.sax.handler
+from xml.sax.saxutils import XMLGenerator
+
+from dash_manifest.files import atomic_manifest_writer
+from dash_manifest.urls import document_base_url, child_base_url
+
+##
+## Streaming rewrite
+##
+
+### Rewrites a manifest as a single stream of SAX events without building a tree. Elements are written out as soon as
+### they're read, so memory use stays flat no matter how long the SegmentTimelines are. The manifest rules are applied
+### to each element as it streams past, through a StreamNodeAdapter
+
+class StreamNode(object):
+
+    ### An element as seen by the streaming rewriter: its attributes, the child elements to drop as they
+    ### stream past, and the child elements to write ahead of its first child
+
+    __slots__ = ('attributes', 'skip', 'pending', 'counts')
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.skip = set()
+        self.pending = []
+        self.counts = {}
+
+STREAM_NODE_UNCHANGED = StreamNode({})
+
+class StreamNodeAdapter(object):
+
+    def children(self, node, name):
+        return [] # children arrive as their own events
+
+    def get(self, node, attribute):
+        return node.attributes.get(attribute)
+
+    def set(self, node, attribute, value):
+        node.attributes[attribute] = value
+
+    def remove_attribute(self, node, attribute):
+        return node.attributes.pop(attribute, None) is not None
+
+    def remove_elements(self, node, name):
+        node.skip.add(name)
+        return True
+
+    def add_element(self, node, name, attributes):
+        node.skip.add(name)
+        node.pending.append((name, dict(attributes)))
+
+    def base_url(self, node):
+        return None # BaseURL text arrives after the element, StreamingManifestRewriter picks it up
+
+class StreamingManifestRewriter(xml.sax.handler.ContentHandler):
+
+    def __init__(self, out, manifest_rules, manifest_modify_exceptions, context=None, compact=False):
+        xml.sax.handler.ContentHandler.__init__(self)
+        self.out = XMLGenerator(out, encoding="utf-8", short_empty_elements=True)
+        self.manifest_rules = manifest_rules
+        self.manifest_modify_exceptions = manifest_modify_exceptions
+        self.context = context or {}
+        self.adapter = StreamNodeAdapter()
+        self.paths = [()] # element paths of the open elements, MPD first
+        self.nodes = [StreamNode({})]
+        self.locations = [""]
+        self.bases = [document_base_url(self.context)] # base URL for the children of each open element
+        self.base_url_text = None # text of the BaseURL element being read, when rules resolve URLs
+        self.skip_depth = 0 # greater than zero while inside an element that is being removed
+        self.pending_whitespace = "" # indentation is held back so it can be dropped along with a removed element
+        self.compact = compact # drop the whitespace between elements instead of copying it
+        self.prefix = ""
+        self.minimum_update_period = None
+
+    def flush_whitespace(self):
+        if self.pending_whitespace:
+            if not self.compact:
+                self.out.characters(self.pending_whitespace)
+            self.pending_whitespace = ""
+
+    def flush_elements(self, node):
+        # elements added by a rule are written ahead of the first child, with the same indentation
+        if node.pending:
+            indent = "" if self.compact else self.pending_whitespace
+            for name, attributes in node.pending:
+                if indent:
+                    self.out.characters(indent)
+                self.out.startElement(self.prefix + name, attributes)
+                self.out.endElement(self.prefix + name)
+            node.pending = []
+
+    def startDocument(self):
+        self.out.startDocument()
+
+    def endDocument(self):
+        self.flush_whitespace()
+        self.out.endDocument()
+
+    def startElement(self, name, attrs):
+        if self.skip_depth:
+            self.skip_depth += 1
+            return
+
+        element = name.rsplit(":", 1)[-1]
+        parent = self.nodes[-1]
+        if element in parent.skip:
+            self.pending_whitespace = ""
+            self.skip_depth = 1
+            return
+
+        parent_path = self.paths[-1]
+        if parent_path is None or (parent_path and parent_path not in self.manifest_rules.child_names):
+            # no rule selects anything below the parent, so this element (and everything in it) is copied as is
+            self.flush_elements(parent)
+            self.flush_whitespace()
+            self.paths.append(None)
+            self.nodes.append(STREAM_NODE_UNCHANGED)
+            self.locations.append(None)
+            self.bases.append(self.bases[-1])
+            self.out.startElement(name, attrs)
+            return
+
+        path = parent_path + (element,)
+        index = parent.counts.get(element, 0)
+        parent.counts[element] = index + 1
+        location = "%s - %s %s" % (self.locations[-1], element, index) if len(path) > 1 else element
+        node = StreamNode(dict(attrs))
+        if len(path) == 1:
+            self.prefix = name[:-len(element)]
+            self.minimum_update_period = node.attributes.get('minimumUpdatePeriod')
+        self.context['base_url'] = self.bases[-1]
+        self.manifest_rules.apply_to_node(self.adapter, node, path, location, self.context, self.manifest_modify_exceptions)
+        if element == "BaseURL" and index == 0 and self.manifest_rules.resolves_urls:
+            self.base_url_text = ""
+
+        self.flush_elements(parent)
+        self.flush_whitespace()
+        self.paths.append(path)
+        self.nodes.append(node)
+        self.locations.append(location)
+        self.bases.append(self.bases[-1])
+        self.out.startElement(name, node.attributes)
+
+    def endElement(self, name):
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
+
+        if self.base_url_text is not None:
+            # the end of the parent's first BaseURL: it's the base for the parent's other children
+            self.bases[-2] = child_base_url(self.bases[-2], self.base_url_text)
+            self.base_url_text = None
+        self.paths.pop()
+        self.locations.pop()
+        self.bases.pop()
+        self.flush_elements(self.nodes.pop())
+        self.flush_whitespace()
+        self.out.endElement(name)
+
+    def characters(self, content):
+        if self.skip_depth:
+            return
+        if self.base_url_text is not None:
+            self.base_url_text += content
+        if content.isspace():
+            self.pending_whitespace += content
+        else:
+            # whitespace inside element text is kept, even in compact mode
+            if self.pending_whitespace:
+                self.out.characters(self.pending_whitespace)
+                self.pending_whitespace = ""
+            self.out.characters(content)
+
+    def ignorableWhitespace(self, content):
+        self.characters(content)
+
+    def processingInstruction(self, target, data):
+        if not self.skip_depth:
+            self.flush_whitespace()
+            self.out.processingInstruction(target, data)
+
+def stream_rewrite_manifest(source_path, destination_path, manifest_rules, manifest_modify_exceptions, context=None):
+    # The source and destination can be the same file, the new manifest only replaces it once it's complete
+    manifest_rules.reset_timings()
+    with atomic_manifest_writer(destination_path) as out:
+        xml.sax.parse(source_path, StreamingManifestRewriter(out, manifest_rules, manifest_modify_exceptions, context))
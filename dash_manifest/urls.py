@@ -0,0 +1,34 @@
+import os
+import functools
+from urllib.parse import urljoin
+
+##
+## Segment URL resolution
+##
+
+### absolute_url rules resolve SegmentTemplate URLs against the manifest's base URL: the directory of the manifest,
+### then the BaseURL elements of the MPD, Period, AdaptationSet and Representation that hold the template, each one
+### resolved against the last (DASH section 5.6). Resolution follows RFC 3986 section 5, so '../' and './' segments,
+### absolute paths and absolute URLs all come out right.
+###
+### Every Representation of a manifest shares the same few bases and templates, and a live manifest is rewritten again
+### on every refresh, so resolve_url() is memoized per (base, reference) in an LRU of URL_CACHE_MAX_ENTRIES
+
+URL_CACHE_MAX_ENTRIES = int(os.environ.get('URL_CACHE_MAX_ENTRIES', 4096))
+
+@functools.lru_cache(maxsize=URL_CACHE_MAX_ENTRIES)
+def resolve_url(base, reference):
+    return urljoin(base, reference)
+
+def document_base_url(context):
+    # The base URL at the MPD element: the directory of the manifest, from the context's mpd_path, or None
+    mpd_path = context.get('mpd_path')
+    if mpd_path is None:
+        return None
+    return mpd_path if mpd_path.endswith("/") else mpd_path + "/"
+
+def child_base_url(base, base_url_text):
+    # The base URL below an element with a BaseURL of base_url_text (the first BaseURL, when there are alternatives)
+    if base_url_text is None:
+        return base
+    return resolve_url(base or "", base_url_text.strip())
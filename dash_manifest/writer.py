@@ -0,0 +1,131 @@
+import os
+import re
+import functools
+
+##
+## Manifest writer
+##
+
+### Writes manifests as text without going through xml.sax's XMLGenerator. unparse() takes the dictionaries built by
+### xmltodict and writes exactly what xmltodict 0.12.0, the version packaged with the Lambda functions, writes for
+### unparse(document, short_empty_elements=True, pretty=pretty): tab indents, empty elements closed with '/>', element
+### text after the element's children. Later xmltodict releases differ on a couple of edge cases, an element whose only
+### children are empty lists is still written as '<Period>\n\t</Period>' here, as 0.12 does. Every piece of the
+### document is appended to one list and joined once at the end. The MPD object model (model.py) writes itself with
+### the same escaping helpers.
+###
+### A manifest repeats the same few attribute values over and over (bandwidths, codecs, timescales, S durations), so
+### quoted attribute values are kept in an LRU of QUOTE_CACHE_MAX_ENTRIES and most attributes are written without
+### being scanned for characters that need escaping. benchmarks/writer_parity.py checks the output against xmltodict 0.12
+
+QUOTE_CACHE_MAX_ENTRIES = int(os.environ.get('QUOTE_CACHE_MAX_ENTRIES', 4096))
+
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n'
+ATTRIBUTE_SPECIAL = re.compile(r'[&<>"\n\r\t]')
+TEXT_SPECIAL = re.compile(r'[&<>]')
+
+def escape_text(text):
+    if TEXT_SPECIAL.search(text) is None:
+        return text
+    return text.replace("&", "&amp;").replace(">", "&gt;").replace("<", "&lt;")
+
+@functools.lru_cache(maxsize=QUOTE_CACHE_MAX_ENTRIES)
+def quote_attribute(value):
+    # The same quoting as xml.sax.saxutils.quoteattr, without importing it (it pulls in urllib.request)
+    if ATTRIBUTE_SPECIAL.search(value) is None:
+        return '"' + value + '"'
+    value = escape_text(value).replace("\n", "&#10;").replace("\r", "&#13;").replace("\t", "&#9;")
+    if '"' in value:
+        if "'" in value:
+            return '"' + value.replace('"', "&quot;") + '"'
+        return "'" + value + "'"
+    return '"' + value + '"'
+
+def unparse(document, pretty=True):
+    if len(document) != 1:
+        raise ValueError("Document must have exactly one root.")
+    out = []
+    for name, value in document.items():
+        write_dict_element(name, value, 0, out.append, pretty)
+    return XML_DECLARATION + "".join(out)
+
+def dict_elements(value):
+    # xmltodict holds one element as a dict (or its text) and several as a list
+    if value is None or isinstance(value, (str, dict)) or not hasattr(value, '__iter__'):
+        return (value,)
+    return list(value)
+
+def write_dict_element(name, value, depth, write, pretty=True):
+    indent = "\t" * depth if pretty else ""
+    newline = "\n" if pretty and depth else ""
+    for element in dict_elements(value):
+        if element is None:
+            element = {}
+        elif isinstance(element, bool):
+            element = "true" if element else "false"
+        elif not isinstance(element, (str, dict)):
+            element = str(element)
+
+        if element.__class__ is str:
+            if element:
+                write(indent + "<" + name + ">" + escape_text(element) + "</" + name + ">" + newline)
+            else:
+                write(indent + "<" + name + "/>" + newline)
+            continue
+
+        start = [indent, "<", name]
+        text = None
+        children = []
+        for key, item in element.items():
+            if key[:1] == "@":
+                if key == "@xmlns" and isinstance(item, dict):
+                    for prefix, uri in item.items():
+                        start.append(" xmlns" + (":" + prefix if prefix else "") + "=" + quote_attribute(str(uri)))
+                    continue
+                start.append(" " + key[1:] + "=" + quote_attribute(item if item.__class__ is str else str(item)))
+            elif key == "#text":
+                text = item if item is None or item.__class__ is str else str(item)
+            else:
+                children.append((key, dict_elements(item)))
+        write("".join(start))
+
+        if pretty and children:
+            write(">\n")
+            write_dict_children(children, depth + 1, write, pretty)
+            if text:
+                write(escape_text(text))
+            write(indent + "</" + name + ">" + newline)
+        elif any(items for key, items in children):
+            write(">")
+            write_dict_children(children, depth + 1, write, pretty)
+            if text:
+                write(escape_text(text))
+            write("</" + name + ">" + newline)
+        elif text:
+            write(">" + escape_text(text) + "</" + name + ">" + newline)
+        else:
+            write("/>" + newline)
+
+def write_dict_children(children, depth, write, pretty=True):
+    for name, elements in children:
+        if name == "S":
+            write_s_run(elements, depth, write, pretty)
+        else:
+            write_dict_element(name, elements, depth, write, pretty)
+
+def write_s_run(elements, depth, write, pretty=True):
+    # The S elements of a SegmentTimeline, thousands of them in a long DVR window. They nearly always have attributes
+    # and nothing else, so each is written in one go and the whole run is joined once. Any other S is written as usual
+    start = ("\t" * depth if pretty else "") + "<S"
+    end = "/>\n" if pretty else "/>"
+    run = []
+    for element in elements:
+        if isinstance(element, dict):
+            attributes = [" " + key[1:] + "=" + quote_attribute(value) for key, value in element.items() if key[:1] == "@" and value.__class__ is str]
+            if attributes and len(attributes) == len(element):
+                run.append(start + "".join(attributes) + end)
+                continue
+        write("".join(run))
+        run = []
+        write_dict_element("S", element, depth, write, pretty)
+    write("".join(run))
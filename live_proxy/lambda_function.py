@@ -0,0 +1,989 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: This script is designed to parse and modify an MPEG DASH manifest.
+
+Original Author: Scott Cunningham
+'''
+
+import json
+import os
+import sys
+import re
+import time
+import collections
+import hashlib
+import io
+import gzip
+import base64
+import tempfile
+import threading
+import requests
+import xml.etree.ElementTree as ET
+import xml.sax
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# The shared dash_manifest package sits at the root of the repository, and at the root of the Lambda zip next to this
+# file, which takes precedence
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from dash_manifest.lazy import lazy_import
+from dash_manifest.esam import iso_duration_seconds
+from dash_manifest.rules import ManifestRuleError, ManifestRuleSet, load_manifest_rules
+from dash_manifest.adapters import DictNodeAdapter, ElementTreeNodeAdapter, ModelNodeAdapter
+from dash_manifest.model import parse_mpd
+from dash_manifest.stream import StreamingManifestRewriter
+from dash_manifest.metrics import InvocationMetrics
+from dash_manifest.writer import unparse
+
+# Only the xmltodict parser backend uses xmltodict, to parse. Manifests and error responses are written by unparse()
+xmltodict = lazy_import("xmltodict")
+
+# brotli isn't in the Lambda runtime, responses are only brotli compressed when it's packaged with the function
+try:
+    brotli = lazy_import("brotli")
+except ModuleNotFoundError:
+    brotli = None
+
+import logging
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+MANIFESTMODIFY="True"
+
+##
+## Origin manifest cache
+##
+
+### The cache lives at module level, so it is shared by every invocation that lands on the same warm container
+### Entries are keyed on the resolved mpd_url and hold the already-rewritten manifest body, along with the
+### origin validators (ETag / Last-Modified) needed to revalidate with a conditional GET once the entry goes stale
+MANIFESTCACHE = os.environ.get('MANIFEST_CACHE', "True")
+MANIFEST_CACHE_MAX_ENTRIES = int(os.environ.get('MANIFEST_CACHE_MAX_ENTRIES', 256))
+MANIFEST_CACHE_DEFAULT_TTL = float(os.environ.get('MANIFEST_CACHE_DEFAULT_TTL', 0))
+MANIFEST_CACHE = collections.OrderedDict()
+MANIFEST_CACHE_LOCK = threading.Lock()
+
+MAX_AGE = re.compile(r'(?:^|,)\s*(?:s-maxage|max-age)\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+def manifest_cache_ttl(response_headers, minimum_update_period):
+    # Freshness lifetime of a cached manifest, in seconds. None means the response must not be cached at all
+    cache_control = response_headers.get('Cache-Control', "")
+    if "no-store" in cache_control.lower() or "private" in cache_control.lower():
+        return None
+    if "no-cache" in cache_control.lower():
+        return 0.0
+
+    ttl = MANIFEST_CACHE_DEFAULT_TTL
+    max_age = MAX_AGE.search(cache_control)
+    if max_age:
+        ttl = float(max_age.group(1))
+
+    # A live manifest can change every minimumUpdatePeriod, never hold it longer than that
+    mup = iso_duration_seconds(minimum_update_period)
+    if mup is not None:
+        ttl = min(ttl, mup) if max_age else mup
+
+    return max(ttl, 0.0)
+
+def manifest_cache_get(mpd_url):
+    with MANIFEST_CACHE_LOCK:
+        entry = MANIFEST_CACHE.get(mpd_url)
+        if entry is not None:
+            MANIFEST_CACHE.move_to_end(mpd_url)
+    return entry
+
+def manifest_cache_put(mpd_url, response_headers, minimum_update_period, body):
+    etag = response_headers.get('ETag')
+    last_modified = response_headers.get('Last-Modified')
+    ttl = manifest_cache_ttl(response_headers, minimum_update_period)
+
+    # Nothing to gain from an entry that is already stale and can't be revalidated
+    if ttl is None or (ttl <= 0 and etag is None and last_modified is None):
+        with MANIFEST_CACHE_LOCK:
+            MANIFEST_CACHE.pop(mpd_url, None)
+        return
+
+    entry = {
+        "etag": etag,
+        "last_modified": last_modified,
+        "cache_control": response_headers.get('Cache-Control'),
+        "minimum_update_period": minimum_update_period,
+        "expires": time.monotonic() + ttl,
+        "body": body
+    }
+    with MANIFEST_CACHE_LOCK:
+        MANIFEST_CACHE[mpd_url] = entry
+        MANIFEST_CACHE.move_to_end(mpd_url)
+        while len(MANIFEST_CACHE) > MANIFEST_CACHE_MAX_ENTRIES:
+            evicted_url, evicted_entry = MANIFEST_CACHE.popitem(last=False)
+            LOGGER.debug("Manifest Cache: evicted least recently used entry %s " % (evicted_url))
+
+def manifest_cache_revalidated(mpd_url, entry, response_headers):
+    # A 304 updates the stored response rather than replacing it (RFC 7234 4.3.4). The validators it leaves out are
+    # kept, so the next refresh is still conditional, and its Cache-Control sets the new freshness lifetime
+    headers = {}
+    for name, stored in (('ETag', entry['etag']), ('Last-Modified', entry['last_modified']), ('Cache-Control', entry['cache_control'])):
+        value = response_headers.get(name) or stored
+        if value is not None:
+            headers[name] = value
+    manifest_cache_put(mpd_url, headers, entry['minimum_update_period'], entry['body'])
+
+def manifest_cache_revalidation_headers(entry):
+    headers = {}
+    if entry is not None:
+        if entry['etag'] is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified'] is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+##
+## Origin HTTP sessions
+##
+
+### One pooled requests.Session per origin (scheme + host), kept at module level so the TCP/TLS connection to the
+### origin is reused across invocations on a warm container. The ?origin= override can point at any host, so the
+### registry is bounded and the least recently used session is closed when it's full
+ORIGIN_POOL_MAX_ORIGINS = int(os.environ.get('ORIGIN_POOL_MAX_ORIGINS', 16))
+ORIGIN_POOL_MAXSIZE = int(os.environ.get('ORIGIN_POOL_MAXSIZE', 10))
+ORIGIN_CONNECT_TIMEOUT = float(os.environ.get('ORIGIN_CONNECT_TIMEOUT', 2))
+ORIGIN_READ_TIMEOUT = float(os.environ.get('ORIGIN_READ_TIMEOUT', 5))
+ORIGIN_RETRIES = int(os.environ.get('ORIGIN_RETRIES', 2))
+ORIGIN_RETRY_BACKOFF = float(os.environ.get('ORIGIN_RETRY_BACKOFF', 0.1))
+ORIGIN_SESSIONS = collections.OrderedDict()
+ORIGIN_SESSIONS_LOCK = threading.Lock()
+
+def origin_session(url):
+    split_url = urlsplit(url)
+    origin_key = "%s://%s" % (split_url.scheme, split_url.netloc)
+
+    with ORIGIN_SESSIONS_LOCK:
+        session = ORIGIN_SESSIONS.get(origin_key)
+        if session is not None:
+            ORIGIN_SESSIONS.move_to_end(origin_key)
+            return session
+        return new_origin_session(origin_key)
+
+def new_origin_session(origin_key):
+    # Called with ORIGIN_SESSIONS_LOCK held
+    retries = Retry(
+        total = ORIGIN_RETRIES,
+        connect = ORIGIN_RETRIES,
+        read = ORIGIN_RETRIES,
+        status = ORIGIN_RETRIES,
+        backoff_factor = ORIGIN_RETRY_BACKOFF,
+        status_forcelist = [500, 502, 503, 504],
+        allowed_methods = frozenset(['GET']),
+        raise_on_status = False
+    )
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = ORIGIN_POOL_MAXSIZE, max_retries = retries)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    ORIGIN_SESSIONS[origin_key] = session
+    LOGGER.info("Origin Session: opened new connection pool for %s " % (origin_key))
+
+    while len(ORIGIN_SESSIONS) > ORIGIN_POOL_MAX_ORIGINS:
+        evicted_origin, evicted_session = ORIGIN_SESSIONS.popitem(last=False)
+        evicted_session.close()
+        LOGGER.debug("Origin Session: closed least recently used connection pool for %s " % (evicted_origin))
+
+    return session
+
+def origin_get(url, headers):
+    return origin_session(url).get(url, headers = headers, timeout = (ORIGIN_CONNECT_TIMEOUT, ORIGIN_READ_TIMEOUT))
+
+##
+## Manifest rules
+##
+
+### Every edit made to the manifest is a rule: a selector (the element path from MPD down, optionally narrowed with
+### 'where' attribute values), an action and a value. Rules are loaded once, when the function is first loaded, from the
+### MANIFEST_RULES environment variable (a JSON list), from the JSON file named in MANIFEST_RULES_FILE, or from the
+### defaults below. The rule set is compiled so that the manifest is walked once, each element is visited once and
+### only the rules selecting that element's path are evaluated. The rule engine is shared by every variation of the
+### modifier, see dash_manifest/rules.py
+###
+### Actions:
+###   set_attribute     name, value : set attribute 'name' to 'value'
+###   remove_attribute  name        : delete attribute 'name'
+###   remove_element    name        : delete every child element called 'name'
+###   add_element       name, value : replace any child elements called 'name' with one that has the 'value' attributes
+###   absolute_url      name        : resolve the relative URL in attribute 'name' against the origin manifest location
+###
+### A rule that fails is logged as a modify exception and the manifest is still served, unless the rule has "required": true
+
+DEFAULT_MANIFEST_RULES = [
+    {"select": "MPD", "action": "set_attribute", "name": "profiles", "value": "urn:mpeg:dash:profile:isoff-live:2011"},
+    {"select": "MPD/Period", "action": "remove_attribute", "name": "start"},
+    {"select": "MPD/Period", "action": "remove_element", "name": "EventStream"},
+    {"select": "MPD/Period/AdaptationSet", "action": "set_attribute", "name": "segmentAlignment", "value": "true"},
+    # hard-code CC accessibility elements
+    {"select": "MPD/Period/AdaptationSet", "action": "add_element", "name": "Role", "value": {"schemeIdUri": "urn:mpeg:dash:role:2011", "value": "main"}},
+    {"select": "MPD/Period/AdaptationSet", "where": {"mimeType": "video/mp4"}, "action": "add_element", "name": "Accessibility", "value": {"schemeIdUri": "urn:scte:dash:cc:cea-608:2015", "value": "CC1=eng"}},
+    # segment URLs are made absolute so the player fetches segments from the origin, not through the proxy
+    {"select": "MPD/Period/AdaptationSet/Representation/SegmentTemplate", "action": "absolute_url", "name": "media", "required": True},
+    {"select": "MPD/Period/AdaptationSet/Representation/SegmentTemplate", "action": "absolute_url", "name": "initialization", "required": True}
+]
+
+MANIFEST_RULES = ManifestRuleSet(load_manifest_rules(DEFAULT_MANIFEST_RULES))
+
+##
+## Manifest parsers
+##
+
+### Every request is parsed exactly once, by one of the backends below, then modified in place by the manifest rules
+### and serialized once. A backend implements parse(), modify(), serialize() and minimum_update_period(). Select one
+### with the MANIFEST_PARSER environment variable. etree is the default, model is about as quick and much smaller in memory
+### Set COMPACT_MANIFEST=True to serialize without the indents and line breaks between elements
+COMPACTMANIFEST = os.environ.get('COMPACT_MANIFEST', "False")
+
+class ManifestParseError(Exception):
+    pass
+
+def apply_manifest_rules(adapter, root, mpd_path, manifest_modify_exceptions):
+    try:
+        MANIFEST_RULES.apply(adapter, root, manifest_modify_exceptions, {"mpd_path": mpd_path})
+    except ManifestRuleError as e:
+        raise ManifestParseError("Manifest parse issue: %s" % (e))
+
+class XmlToDictParser(object):
+
+    name = "xmltodict"
+
+    def parse(self, mpd_bytes):
+        return xmltodict.parse(mpd_bytes)
+
+    def minimum_update_period(self, mpddoc):
+        return mpddoc['MPD'].get('@minimumUpdatePeriod')
+
+    def serialize(self, mpddoc):
+        return unparse(mpddoc, pretty=COMPACTMANIFEST != "True")
+
+    def modify(self, mpddoc, mpd_path, manifest_modify_exceptions):
+        apply_manifest_rules(DictNodeAdapter(), mpddoc['MPD'], mpd_path, manifest_modify_exceptions)
+
+class ElementTreeParser(object):
+
+    name = "etree"
+
+    def parse(self, mpd_bytes):
+        # Parse the tree and collect the namespace prefixes the origin used, so they survive serialization
+        iterparser = ET.iterparse(io.BytesIO(mpd_bytes), events=("start-ns",))
+        namespaces = [namespace for event, namespace in iterparser]
+        root = iterparser.root
+
+        # ElementTree refuses default_namespace= when attributes are unqualified, as they always are in an MPD,
+        # so the default namespace is registered with an empty prefix instead
+        default_namespace = None
+        for prefix, uri in namespaces:
+            if prefix == "":
+                default_namespace = uri
+            if not re.match(r"ns\d+$", prefix):
+                ET.register_namespace(prefix, uri)
+
+        return {"root": root, "default_namespace": default_namespace}
+
+    def minimum_update_period(self, mpddoc):
+        return mpddoc['root'].get('minimumUpdatePeriod')
+
+    def serialize(self, mpddoc):
+        if COMPACTMANIFEST == "True":
+            for node in mpddoc['root'].iter():
+                if node.text is not None and node.text.isspace():
+                    node.text = None
+                if node.tail is not None and node.tail.isspace():
+                    node.tail = None
+        elif hasattr(ET, "indent"):
+            ET.indent(mpddoc['root'], space="\t")
+        return '<?xml version="1.0" encoding="utf-8"?>\n' + ET.tostring(mpddoc['root'], encoding="unicode")
+
+    def modify(self, mpddoc, mpd_path, manifest_modify_exceptions):
+        ns = "{%s}" % (mpddoc['default_namespace']) if mpddoc['default_namespace'] else ""
+        apply_manifest_rules(ElementTreeNodeAdapter(ns), mpddoc['root'], mpd_path, manifest_modify_exceptions)
+
+class ModelParser(object):
+
+    ### The MPD object model, see dash_manifest/model.py. S elements are held in arrays rather than as one object each,
+    ### which keeps the memory for a long DVR window small. The output is indented the same way as xmltodict's, but elements
+    ### added by add_element rules go ahead of the Representation / SegmentTemplate ... children, in schema order, as with
+    ### etree, where the xmltodict backend appends them after the last child
+
+    name = "model"
+
+    def parse(self, mpd_bytes):
+        return parse_mpd(mpd_bytes)
+
+    def minimum_update_period(self, mpd):
+        return mpd.get('minimumUpdatePeriod')
+
+    def serialize(self, mpd):
+        return mpd.to_xml(pretty=COMPACTMANIFEST != "True")
+
+    def modify(self, mpd, mpd_path, manifest_modify_exceptions):
+        apply_manifest_rules(ModelNodeAdapter(), mpd, mpd_path, manifest_modify_exceptions)
+
+class StreamingParser(object):
+
+    ### Rewrites the manifest in a single pass of SAX events without building a tree. The manifest rules are applied to
+    ### each element as it streams past, serialize() just hands back the body written by modify()
+
+    name = "stream"
+
+    def parse(self, mpd_bytes):
+        return {"source": mpd_bytes, "minimum_update_period": None, "body": None}
+
+    def minimum_update_period(self, mpddoc):
+        return mpddoc['minimum_update_period']
+
+    def serialize(self, mpddoc):
+        return mpddoc['body']
+
+    def modify(self, mpddoc, mpd_path, manifest_modify_exceptions):
+        out = io.StringIO()
+        rewriter = StreamingManifestRewriter(out, MANIFEST_RULES, manifest_modify_exceptions, {"mpd_path": mpd_path}, COMPACTMANIFEST == "True")
+        MANIFEST_RULES.reset_timings()
+        try:
+            xml.sax.parseString(mpddoc['source'], rewriter)
+        except ManifestRuleError as e:
+            raise ManifestParseError("Manifest parse issue: %s" % (e))
+        mpddoc['minimum_update_period'] = rewriter.minimum_update_period
+        mpddoc['body'] = out.getvalue()
+
+MANIFEST_PARSERS = {
+    XmlToDictParser.name: XmlToDictParser(),
+    ElementTreeParser.name: ElementTreeParser(),
+    ModelParser.name: ModelParser(),
+    StreamingParser.name: StreamingParser()
+}
+MANIFEST_PARSER = MANIFEST_PARSERS[os.environ.get('MANIFEST_PARSER', ElementTreeParser.name)]
+
+##
+## Rewritten manifest output cache
+##
+
+### Live origins often return identical manifest bytes for many requests in a row (no validators, or a new segment
+### hasn't been published yet). The rewritten output is a pure function of the origin bytes, the mpd_path used for
+### absolute urls, the rule set, the parser backend and COMPACT_MANIFEST, so it's cached under a hash of all of them and a
+### repeat of the same origin bytes skips parse / modify / serialize entirely. A small in-memory LRU tier sits in front
+### of an optional on-disk tier under /tmp, which is kept by Lambda for as long as the container is warm
+REWRITECACHE = os.environ.get('REWRITE_CACHE', "True")
+REWRITE_CACHE_MAX_ENTRIES = int(os.environ.get('REWRITE_CACHE_MAX_ENTRIES', 32))
+REWRITECACHEDISK = os.environ.get('REWRITE_CACHE_DISK', "False")
+REWRITE_CACHE_DIR = os.environ.get('REWRITE_CACHE_DIR', os.path.join(tempfile.gettempdir(), "rewrite-cache"))
+REWRITE_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('REWRITE_CACHE_DISK_MAX_ENTRIES', 256))
+REWRITE_CACHE = collections.OrderedDict()
+REWRITE_CACHE_LOCK = threading.Lock()
+REWRITE_CACHE_STATS = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+def rewrite_cache_key(origin_body, mpd_path):
+    key = hashlib.sha256(origin_body)
+    key.update(b"\0")
+    key.update(mpd_path.encode("utf-8"))
+    key.update(b"\0")
+    key.update(("%s:%s:%s" % (MANIFEST_RULES.version, MANIFEST_PARSER.name, COMPACTMANIFEST)).encode("utf-8"))
+    return key.hexdigest()
+
+def rewrite_cache_memory_put(key, entry):
+    with REWRITE_CACHE_LOCK:
+        REWRITE_CACHE[key] = entry
+        REWRITE_CACHE.move_to_end(key)
+        while len(REWRITE_CACHE) > REWRITE_CACHE_MAX_ENTRIES:
+            REWRITE_CACHE.popitem(last=False)
+
+def rewrite_cache_get(key):
+    with REWRITE_CACHE_LOCK:
+        entry = REWRITE_CACHE.get(key)
+        if entry is not None:
+            REWRITE_CACHE.move_to_end(key)
+            REWRITE_CACHE_STATS['hits'] += 1
+            return entry
+
+    if REWRITECACHEDISK == "True":
+        try:
+            with open(os.path.join(REWRITE_CACHE_DIR, key + ".json")) as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            entry = None
+        if entry is not None:
+            rewrite_cache_memory_put(key, entry)
+            with REWRITE_CACHE_LOCK:
+                REWRITE_CACHE_STATS['disk_hits'] += 1
+            return entry
+
+    with REWRITE_CACHE_LOCK:
+        REWRITE_CACHE_STATS['misses'] += 1
+    return None
+
+def rewrite_cache_put(key, minimum_update_period, body):
+    entry = {
+        "minimum_update_period": minimum_update_period,
+        "body": body
+    }
+    rewrite_cache_memory_put(key, entry)
+
+    if REWRITECACHEDISK == "True":
+        # Write to a temp file and rename it into place, a concurrent reader never sees a half written entry
+        try:
+            os.makedirs(REWRITE_CACHE_DIR, exist_ok=True)
+            temp_fd, temp_path = tempfile.mkstemp(dir=REWRITE_CACHE_DIR, suffix=".tmp")
+            with os.fdopen(temp_fd, 'w') as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(temp_path, os.path.join(REWRITE_CACHE_DIR, key + ".json"))
+            rewrite_cache_disk_prune()
+        except OSError as e:
+            LOGGER.warning("Rewrite Cache: unable to write disk entry %s : %s " % (key, e))
+
+def rewrite_cache_disk_prune():
+    entries = [entry for entry in os.scandir(REWRITE_CACHE_DIR) if entry.name.endswith(".json")]
+    if len(entries) <= REWRITE_CACHE_DISK_MAX_ENTRIES:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - REWRITE_CACHE_DISK_MAX_ENTRIES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+##
+## Incremental rewrites
+##
+
+### Consecutive refreshes of a live manifest differ in publishTime and in the S elements appended to and expired from
+### each SegmentTimeline, while the S elements are most of the manifest. With INCREMENTAL_MANIFEST on, the S elements
+### are cut out of the origin manifest before it's parsed: each SegmentTimeline is left holding one placeholder S, and
+### only this skeleton goes through parse / modify / serialize. The rendered skeleton shows how the parser backend lays
+### out an S element at each placeholder (indent and closing), and the S elements of each SegmentTimeline are written
+### there with a single regular expression substitution, no parsing.
+###
+### What was written for each mpd_url is kept: a skeleton identical to the previous one isn't rewritten again, and a
+### SegmentTimeline identical to the one at the same place last time reuses its rendered S elements. The output is
+### the same as a full rewrite. A SegmentTimeline holding anything other than S elements with integer attributes is left
+### in the skeleton. Rule sets that touch SegmentTimeline elements, and the stream backend, always get a full rewrite
+INCREMENTALMANIFEST = os.environ.get('INCREMENTAL_MANIFEST', "False")
+INCREMENTAL_MAX_ENTRIES = int(os.environ.get('INCREMENTAL_MAX_ENTRIES', 32))
+INCREMENTAL_STATE = collections.OrderedDict()
+INCREMENTAL_STATE_LOCK = threading.Lock()
+
+S_RUN = re.compile(rb'(?:<S(?: [a-z]+="-?\d+")+ ?/>\s*)+')
+S_ELEMENT = re.compile(rb'\s*<S((?: [a-z]+="-?\d+")+) ?/>')
+S_PLACEHOLDER = re.compile(r'(\s*)<S t="#(\d+)"(\s*/>)')
+
+def incremental_rules_supported(manifest_rules):
+    return not any("SegmentTimeline" in rule.select or rule.name == "SegmentTimeline" for rule in manifest_rules.rules)
+
+if INCREMENTALMANIFEST == "True" and not incremental_rules_supported(MANIFEST_RULES):
+    LOGGER.warning("Incremental: the manifest rules select or replace SegmentTimeline elements, incremental rewrites are off")
+    INCREMENTALMANIFEST = "False"
+if INCREMENTALMANIFEST == "True" and MANIFEST_PARSER.name == StreamingParser.name:
+    # The stream backend builds no tree to skip, and it keeps the origin's own whitespace between S elements
+    LOGGER.warning("Incremental: not used with the stream parser backend, incremental rewrites are off")
+    INCREMENTALMANIFEST = "False"
+
+def split_timelines(origin_body, known_timelines):
+    # The origin manifest with a placeholder S in place of the S elements of each SegmentTimeline, and those S elements
+    # (stripped of surrounding whitespace). known_timelines have been checked before and aren't checked again
+    skeleton = []
+    timelines = []
+    position = 0
+    start = origin_body.find(b"<SegmentTimeline")
+    while start >= 0:
+        inner_start = origin_body.find(b">", start) + 1
+        inner_end = origin_body.find(b"</SegmentTimeline>", inner_start)
+        if inner_start == 0 or inner_end < 0:
+            break
+        timeline = origin_body[inner_start:inner_end].strip()
+        if origin_body[inner_start - 2:inner_start] != b"/>" and origin_body[start + 16:start + 17] in b"> \t\r\n" and (timeline in known_timelines or S_RUN.fullmatch(timeline)):
+            skeleton.append(origin_body[position:inner_start])
+            skeleton.append(b'<S t="#%d"/>' % (len(timelines)))
+            timelines.append(timeline)
+            position = inner_end
+        start = origin_body.find(b"<SegmentTimeline", inner_end)
+    skeleton.append(origin_body[position:])
+    return b"".join(skeleton), timelines
+
+def split_skeleton(skeleton_mpd, timeline_count):
+    # The rewritten skeleton cut at its placeholders, and the whitespace before / closing after each placeholder S
+    parts = S_PLACEHOLDER.split(skeleton_mpd)
+    pieces = parts[0::4]
+    layouts = list(zip(parts[1::4], parts[3::4]))
+    if parts[2::4] != [str(index) for index in range(timeline_count)]:
+        return None, None
+    return pieces, layouts
+
+def render_timeline(timeline, layout):
+    # The S elements of a checked SegmentTimeline written the way the parser backend writes them
+    separator, closing = [part.encode("ascii") for part in layout]
+    body = timeline.replace(b" />", b"/>")
+    count = body.count(b"<S")
+    first_end = body.find(b"/>") + 2
+    between = body[first_end:body.find(b"<S", first_end)] if count > 1 else b""
+    if body.count(b"/>" + between + b"<S") == count - 1:
+        # The origin puts the same whitespace between every pair of S elements, as packagers do: plain replaces will do
+        body = separator + body[:-2].replace(b"/>" + between + b"<S", closing + separator + b"<S") + closing
+    else:
+        body = S_ELEMENT.sub(separator + rb'<S\1' + closing, timeline)
+    return body.decode("ascii")
+
+def incremental_rewrite(mpd_url, mpd_path, origin_body, metrics):
+    # Returns (rewritten manifest, minimumUpdatePeriod), or None when the manifest needs a full rewrite
+    with INCREMENTAL_STATE_LOCK:
+        state = INCREMENTAL_STATE.get(mpd_url)
+    previous = state['timelines'] if state is not None else []
+    skeleton, timelines = split_timelines(origin_body, set(timeline for timeline, layout, body in previous))
+    if not timelines:
+        metrics.set_property("Incremental", "full")
+        return None
+
+    skeleton_key = hashlib.sha256(skeleton).digest()
+    if state is not None and state['skeleton_key'] == skeleton_key:
+        pieces, layouts, minimum_update_period = state['pieces'], state['layouts'], state['minimum_update_period']
+        metrics.set_property("Incremental", "timelines")
+    else:
+        skeleton_mpd, minimum_update_period = modify_manifest(skeleton, mpd_path, metrics)
+        pieces, layouts = split_skeleton(skeleton_mpd, len(timelines))
+        if pieces is None:
+            LOGGER.info("Incremental: placeholders missing from the rewritten skeleton of %s , falling back to a full rewrite" % (mpd_url))
+            with INCREMENTAL_STATE_LOCK:
+                INCREMENTAL_STATE.pop(mpd_url, None)
+            metrics.set_property("Incremental", "full")
+            return None
+        metrics.set_property("Incremental", "skeleton")
+
+    rendered = []
+    with metrics.stage("Timelines"):
+        for index, timeline in enumerate(timelines):
+            if index < len(previous) and previous[index][0] == timeline and previous[index][1] == layouts[index]:
+                rendered.append(previous[index])
+            else:
+                rendered.append((timeline, layouts[index], render_timeline(timeline, layouts[index])))
+                metrics.add("TimelinesRendered", 1)
+
+        new_mpd = [pieces[0]]
+        for (timeline, layout, body), piece in zip(rendered, pieces[1:]):
+            new_mpd.append(body)
+            new_mpd.append(piece)
+        new_mpd = "".join(new_mpd)
+
+    state = {
+        "skeleton_key": skeleton_key,
+        "pieces": pieces,
+        "layouts": layouts,
+        "minimum_update_period": minimum_update_period,
+        "timelines": rendered
+    }
+    with INCREMENTAL_STATE_LOCK:
+        INCREMENTAL_STATE[mpd_url] = state
+        INCREMENTAL_STATE.move_to_end(mpd_url)
+        while len(INCREMENTAL_STATE) > INCREMENTAL_MAX_ENTRIES:
+            INCREMENTAL_STATE.popitem(last=False)
+
+    return new_mpd, minimum_update_period
+
+##
+## Responses
+##
+
+### Every manifest response carries a strong ETag and a Cache-Control max-age. The max-age is a fraction of the
+### manifest's minimumUpdatePeriod, so a CDN in front of API Gateway can answer most player polls on its own. A request
+### whose If-None-Match matches the ETag gets a 304 with no body. When RESPONSE_COMPRESSION is on, the body is gzip or
+### brotli compressed to match the request's Accept-Encoding and handed to API Gateway base64 encoded (the API needs
+### binary media types set, see the README). The ETag and the compressed bodies of the most recent manifests are kept,
+### so a manifest served from the caches above is hashed and compressed once rather than on every request
+RESPONSECOMPRESSION = os.environ.get('RESPONSE_COMPRESSION', "False")
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', 1024))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 6))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', 5))
+RESPONSE_MAX_AGE_FACTOR = float(os.environ.get('RESPONSE_MAX_AGE_FACTOR', 0.5))
+RESPONSE_STATIC_MAX_AGE = int(os.environ.get('RESPONSE_STATIC_MAX_AGE', 60))
+RESPONSE_VARIANTS_MAX_ENTRIES = int(os.environ.get('RESPONSE_VARIANTS_MAX_ENTRIES', 16))
+RESPONSE_VARIANTS = collections.OrderedDict()
+RESPONSE_VARIANTS_LOCK = threading.Lock()
+
+# In order of preference when the client accepts more than one with the same q value
+RESPONSE_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+def response_encoding(accept_encoding):
+    # The content coding to answer with, from the request's Accept-Encoding. None means no compression
+    qvalues = {}
+    for coding in accept_encoding.split(","):
+        coding, _, parameters = coding.partition(";")
+        q = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for encoding in RESPONSE_ENCODINGS:
+        q = qvalues.get(encoding, qvalues.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def response_max_age(minimum_update_period):
+    mup = iso_duration_seconds(minimum_update_period)
+    if mup is None:
+        return RESPONSE_STATIC_MAX_AGE
+    return max(int(mup * RESPONSE_MAX_AGE_FACTOR), 0)
+
+def response_variant(body, encoding):
+    # (ETag, body) for the body in one content coding, compressed bodies are base64 encoded
+    with RESPONSE_VARIANTS_LOCK:
+        variants = RESPONSE_VARIANTS.get(body)
+        if variants is None:
+            variants = {None: ('"%s"' % (hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]), body)}
+            RESPONSE_VARIANTS[body] = variants
+            while len(RESPONSE_VARIANTS) > RESPONSE_VARIANTS_MAX_ENTRIES:
+                RESPONSE_VARIANTS.popitem(last=False)
+        else:
+            RESPONSE_VARIANTS.move_to_end(body)
+
+    # Compressed outside the lock: two threads may both compress the same body, and store the same variant
+
+    if encoding not in variants:
+        if encoding == "br":
+            compressed = brotli.compress(body.encode("utf-8"), quality=RESPONSE_BROTLI_QUALITY)
+        else:
+            compressed = gzip.compress(body.encode("utf-8"), compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+        # A strong ETag has to differ between content codings of the same manifest
+        variants[encoding] = (variants[None][0][:-1] + '-%s"' % (encoding), base64.b64encode(compressed).decode("ascii"))
+    return variants[encoding]
+
+def if_none_match(header, etag):
+    # If-None-Match uses the weak comparison, a W/ prefix doesn't stop a match
+    if header is None:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.replace("W/", "", 1) == etag:
+            return True
+    return False
+
+##
+## Requests
+##
+
+### A request is handled in three parts. The manifest URL is resolved from the event (manifest_url), the manifest is
+### fetched from the origin and rewritten (rewrite_steps) and the response is built for this one request
+### (manifest_response: compression, ETag, 304). rewrite_steps is a generator: it yields the one origin request it needs
+### and is sent back the origin's response, or the exception the fetch raised. That way the same rewrite runs under the
+### blocking requests session in this function and under the asyncio server in proxy_server.py
+
+class ManifestProxyError(Exception):
+    pass
+
+class OriginResponse(object):
+
+    ### The parts of an origin response rewrite_steps reads, for HTTP clients other than requests
+
+    __slots__ = ('status_code', 'headers', 'content')
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+def manifest_url(event):
+    origin = ""
+    try:
+        if "origin" in event['queryStringParameters']:
+            encoded_origin = event['queryStringParameters']['origin']
+            origin = encoded_origin.replace("%2F","/")
+            origin = origin.replace("%3A",":")
+            LOGGER.info("Origin query string was sent with request, overriding static origin and using %s" % (origin))
+        else:
+            origin = os.environ['ORIGIN']
+    except:
+        origin = os.environ['ORIGIN']
+
+    return origin + event['path']
+
+def request_headers(event):
+    return dict((name.lower(), value) for name, value in (event.get('headers') or {}).items())
+
+def error_response(message, mpd_url):
+    LOGGER.error(message)
+    error_message = {"error":{
+        "message":message,
+        "mpd_url": mpd_url
+    }}
+    return {
+        'statusCode': 500,
+        "headers": {
+            "Content-Type": "application/xml",
+            "Access-Control-Allow-Origin":"*"
+        },
+        'body': unparse(error_message, pretty=True)
+        }
+
+def manifest_response(body, minimum_update_period, headers_in, metrics):
+    encoding = None
+    if RESPONSECOMPRESSION == "True" and len(body) >= RESPONSE_COMPRESSION_MIN_BYTES:
+        encoding = response_encoding(headers_in.get('accept-encoding', ""))
+    with metrics.stage("Encode"):
+        etag, response_body = response_variant(body, encoding)
+    headers = {
+        "Content-Type": "application/xml",
+        "Access-Control-Allow-Origin":"*",
+        "Cache-Control": "max-age=%d" % (response_max_age(minimum_update_period)),
+        "ETag": etag
+    }
+    if RESPONSECOMPRESSION == "True":
+        headers['Vary'] = "Accept-Encoding"
+
+    if if_none_match(headers_in.get('if-none-match'), etag):
+        metrics.add("NotModified", 1)
+        return {
+            'statusCode': 304,
+            "headers": headers,
+            'body': ""
+            }
+
+    response = {
+        'statusCode': 200,
+        "headers": headers,
+        'body': response_body
+        }
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+        response['isBase64Encoded'] = True
+    metrics.set_property("ContentEncoding", encoding or "identity")
+    metrics.add("ResponseBytes", len(response_body), "Bytes")
+    return response
+
+def parse_manifest(mpd_bytes, metrics):
+    try:
+        with metrics.stage("Parse"):
+            return MANIFEST_PARSER.parse(mpd_bytes)
+    except Exception as e:
+        raise ManifestProxyError("Unable to parse manifest from origin, got exception %s " % (e))
+
+def modify_manifest(mpd_bytes, mpd_path, metrics):
+    # Parses, modifies and serializes one manifest with MANIFEST_PARSER, returns (rewritten manifest, minimumUpdatePeriod)
+    mpddoc = parse_manifest(mpd_bytes, metrics)
+    manifest_modify_exceptions = []
+
+    ### All of the MPD modify/delete actions are manifest rules, see DEFAULT_MANIFEST_RULES
+    ### Add or remove rules there, or supply your own with the MANIFEST_RULES / MANIFEST_RULES_FILE environment variables
+    ### Any rule that fails will be caught and displayed in a DEBUG message.
+    ### A failed rule does not cause the workflow to fail, unless the rule is marked as required
+
+    LOGGER.info("Manifest Modifier: Starting with %s parser..." % (MANIFEST_PARSER.name))
+    metrics.set_property("Parser", MANIFEST_PARSER.name)
+
+    try:
+        with metrics.stage("Modify"):
+            MANIFEST_PARSER.modify(mpddoc, mpd_path, manifest_modify_exceptions)
+    except ManifestParseError as e:
+        raise ManifestProxyError(str(e))
+
+    LOGGER.info("Manifest Modifier: Complete...")
+    LOGGER.info("Manifest Modifier: %s rules applied in %.3f ms" % (str(len(MANIFEST_RULES.rules)), MANIFEST_RULES.total_seconds() * 1000))
+    LOGGER.info("Manifest Modifier: Exceptions during modify : %s " % (str(len(manifest_modify_exceptions))))
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("Manifest Modifier - Rule timings : %s " % (MANIFEST_RULES.timings()))
+        LOGGER.debug("Manifest Modifier - Exceptions caught : %s " % (manifest_modify_exceptions))
+    metrics.add_rule_timings(MANIFEST_RULES)
+    metrics.add("ModifyExceptions", len(manifest_modify_exceptions))
+
+    with metrics.stage("Serialize"):
+        new_mpd = MANIFEST_PARSER.serialize(mpddoc)
+
+    return new_mpd, MANIFEST_PARSER.minimum_update_period(mpddoc)
+
+def rewrite_steps(mpd_url, metrics):
+    # Yields (url, headers) for the origin request, returns (rewritten manifest, minimumUpdatePeriod). Raises
+    # ManifestProxyError when the manifest can't be served
+
+    cache_entry = None
+    if MANIFESTCACHE == "True":
+        cache_entry = manifest_cache_get(mpd_url)
+        if cache_entry is not None and time.monotonic() < cache_entry['expires']:
+            LOGGER.info("Manifest Cache: fresh hit for %s " % (mpd_url))
+            metrics.set_property("ManifestCache", "fresh")
+            return cache_entry['body'], cache_entry['minimum_update_period']
+
+    mpd_path = mpd_url.rsplit('/', 1)[0]
+    mpd_xml = yield mpd_url, manifest_cache_revalidation_headers(cache_entry)
+    if isinstance(mpd_xml, Exception):
+        raise ManifestProxyError("Unable to get manifest from origin, got exception %s " % (mpd_xml))
+
+    if mpd_xml.status_code == 304 and cache_entry is not None:
+        # Origin manifest hasn't changed, the rewritten body we already hold is still good
+        LOGGER.info("Manifest Cache: origin revalidated %s , serving cached manifest" % (mpd_url))
+        metrics.set_property("ManifestCache", "revalidated")
+        manifest_cache_revalidated(mpd_url, cache_entry, mpd_xml.headers)
+        return cache_entry['body'], cache_entry['minimum_update_period']
+
+    if mpd_xml.status_code != 200:
+        raise ManifestProxyError("Unable to get manifest from origin, got code %s " % (str(mpd_xml.status_code)))
+    metrics.add("OriginBytes", len(mpd_xml.content), "Bytes")
+
+    rewrite_key = None
+    if MANIFESTMODIFY == "True" and REWRITECACHE == "True":
+        rewrite_key = rewrite_cache_key(mpd_xml.content, mpd_path)
+        rewrite_entry = rewrite_cache_get(rewrite_key)
+        metrics.set_property("RewriteCache", "miss" if rewrite_entry is None else "hit")
+        LOGGER.info("Rewrite Cache: %s for %s , hits %s , disk hits %s , misses %s " % ("miss" if rewrite_entry is None else "hit", mpd_url, REWRITE_CACHE_STATS['hits'], REWRITE_CACHE_STATS['disk_hits'], REWRITE_CACHE_STATS['misses']))
+        if rewrite_entry is not None:
+            # Same origin bytes as a manifest we've already rewritten, no need to parse it again
+            if MANIFESTCACHE == "True":
+                manifest_cache_put(mpd_url, mpd_xml.headers, rewrite_entry['minimum_update_period'], rewrite_entry['body'])
+            return rewrite_entry['body'], rewrite_entry['minimum_update_period']
+
+    if MANIFESTMODIFY == "True":
+        rewritten = None
+        if INCREMENTALMANIFEST == "True":
+            rewritten = incremental_rewrite(mpd_url, mpd_path, mpd_xml.content, metrics)
+        if rewritten is None:
+            rewritten = modify_manifest(mpd_xml.content, mpd_path, metrics)
+        new_mpd, minimum_update_period = rewritten
+        metrics.add("OutputBytes", len(new_mpd), "Bytes")
+
+        if rewrite_key is not None:
+            rewrite_cache_put(rewrite_key, minimum_update_period, new_mpd)
+    else:
+        mpddoc = parse_manifest(mpd_xml.content, metrics)
+        new_mpd = mpd_xml.text.replace("\n"," ") # no change from original MPD
+        minimum_update_period = MANIFEST_PARSER.minimum_update_period(mpddoc)
+
+    if MANIFESTCACHE == "True":
+        manifest_cache_put(mpd_url, mpd_xml.headers, minimum_update_period, new_mpd)
+
+    return new_mpd, minimum_update_period
+
+def finish_rewrite(steps, origin_response):
+    # Hands the origin response to rewrite_steps and returns what it returns
+    try:
+        steps.send(origin_response)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError("rewrite_steps asked for a second origin request")
+
+def rewrite_manifest(mpd_url, metrics):
+    steps = rewrite_steps(mpd_url, metrics)
+    try:
+        url, headers = next(steps)
+    except StopIteration as done:
+        return done.value
+    try:
+        with metrics.stage("Fetch"):
+            origin_response = origin_get(url, headers)
+    except requests.exceptions.RequestException as e:
+        origin_response = e
+    return finish_rewrite(steps, origin_response)
+
+##
+## Single-flight
+##
+
+### At every segment boundary the players watching a channel all poll the same manifest at nearly the same time. When
+### the handler is driven by several threads at once (a Lambda container only ever runs one request at a time, so this
+### is for the function embedded in a threaded server or test harness), the first request for an mpd_url (origin +
+### path) fetches and rewrites it and every request for the same mpd_url that arrives meanwhile waits for that result
+### instead of going to the origin too. A waiter gives up with an error response after SINGLE_FLIGHT_MAX_WAIT seconds,
+### and an error in the shared rewrite becomes the error response of every request that waited on it
+### Requests for different mpd_urls rewrite side by side: the module-level caches (MANIFEST_CACHE, ORIGIN_SESSIONS,
+### REWRITE_CACHE, INCREMENTAL_STATE, RESPONSE_VARIANTS) each have a lock, and MANIFEST_RULES keeps its rule timings per
+### thread, so each request's metrics only count its own rewrite
+SINGLEFLIGHT = os.environ.get('SINGLE_FLIGHT', "True")
+SINGLE_FLIGHT_MAX_WAIT = float(os.environ.get('SINGLE_FLIGHT_MAX_WAIT', 10))
+SINGLE_FLIGHTS = {}
+SINGLE_FLIGHTS_LOCK = threading.Lock()
+
+class SingleFlight(object):
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+def single_flight_rewrite(mpd_url, metrics):
+    if SINGLEFLIGHT != "True":
+        return rewrite_manifest(mpd_url, metrics)
+
+    with SINGLE_FLIGHTS_LOCK:
+        flight = SINGLE_FLIGHTS.get(mpd_url)
+        leader = flight is None
+        if leader:
+            flight = SINGLE_FLIGHTS[mpd_url] = SingleFlight()
+
+    if not leader:
+        LOGGER.info("Single-flight: waiting on the request in flight for %s " % (mpd_url))
+        metrics.add("Coalesced", 1)
+        if not flight.done.wait(SINGLE_FLIGHT_MAX_WAIT):
+            raise ManifestProxyError("Timed out after %s seconds waiting on the request in flight for this manifest " % (SINGLE_FLIGHT_MAX_WAIT))
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = rewrite_manifest(mpd_url, metrics)
+        return flight.result
+    except ManifestProxyError as e:
+        flight.error = e
+        raise
+    except Exception as e:
+        # the leader gets the same error response as its waiters, not an unhandled exception
+        flight.error = ManifestProxyError("Unable to rewrite manifest, got exception %s " % (e))
+        raise flight.error from e
+    finally:
+        with SINGLE_FLIGHTS_LOCK:
+            SINGLE_FLIGHTS.pop(mpd_url, None)
+        flight.done.set()
+
+def lambda_handler(event, context):
+    # One metrics record per request, see dash_manifest/metrics.py
+    metrics = InvocationMetrics("live_proxy")
+    try:
+        response = proxy_manifest(event, metrics)
+        metrics.set_property("StatusCode", response['statusCode'])
+        return response
+    finally:
+        metrics.emit()
+
+def proxy_manifest(event, metrics):
+
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("event : %s" % (str(event)))
+
+    mpd_url = manifest_url(event)
+    try:
+        body, minimum_update_period = single_flight_rewrite(mpd_url, metrics)
+    except ManifestProxyError as e:
+        return error_response(str(e), mpd_url)
+    return manifest_response(body, minimum_update_period, request_headers(event), metrics)
@@ -0,0 +1,202 @@
+'''
+Copyright (c) 2021 Scott Cunningham
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+Summary: Self-hosted server mode for the live proxy. Serves the same manifests as the Lambda function from an asyncio
+HTTP server, fetching from the origin over pooled async connections and sharing one origin fetch and rewrite between
+simultaneous requests for the same manifest.
+
+Usage: python proxy_server.py
+
+Original Author: Scott Cunningham
+'''
+
+import asyncio
+import base64
+import os
+import sys
+import concurrent.futures
+import aiohttp
+from aiohttp import web
+
+# lambda_function.py sits next to this file
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import lambda_function as proxy
+from dash_manifest.metrics import InvocationMetrics
+
+LOGGER = proxy.LOGGER
+
+SERVER_HOST = os.environ.get('SERVER_HOST', "0.0.0.0")
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 8080))
+
+##
+## Origin client
+##
+
+### One aiohttp session for the life of the server. Its connector keeps up to ORIGIN_POOL_MAXSIZE connections alive
+### per origin host, and the timeouts and retries use the same ORIGIN_* environment variables as the Lambda function
+ORIGIN_RETRY_STATUS = (500, 502, 503, 504)
+ORIGIN_CLIENT = None
+
+def origin_client():
+    global ORIGIN_CLIENT
+    if ORIGIN_CLIENT is None or ORIGIN_CLIENT.closed:
+        ORIGIN_CLIENT = aiohttp.ClientSession(
+            connector = aiohttp.TCPConnector(limit_per_host = proxy.ORIGIN_POOL_MAXSIZE),
+            timeout = aiohttp.ClientTimeout(sock_connect = proxy.ORIGIN_CONNECT_TIMEOUT, sock_read = proxy.ORIGIN_READ_TIMEOUT),
+            auto_decompress = True
+        )
+    return ORIGIN_CLIENT
+
+async def origin_get(url, headers):
+    attempt = 0
+    while True:
+        try:
+            async with origin_client().get(url, headers = headers) as response:
+                if response.status not in ORIGIN_RETRY_STATUS or attempt >= proxy.ORIGIN_RETRIES:
+                    return proxy.OriginResponse(response.status, response.headers, await response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt >= proxy.ORIGIN_RETRIES:
+                raise
+        await asyncio.sleep(proxy.ORIGIN_RETRY_BACKOFF * (2 ** attempt))
+        attempt += 1
+
+async def close_origin_client(app=None):
+    if ORIGIN_CLIENT is not None:
+        await ORIGIN_CLIENT.close()
+
+##
+## Request coalescing
+##
+
+### Every rewrite runs on a single worker thread, so the manifest and rewrite caches in lambda_function.py are only
+### ever touched from one thread and the event loop stays free to accept requests while a manifest is parsed
+### IN_FLIGHT holds the rewrite under way for each mpd_url. A request that arrives while one is running waits for it
+### instead of going to the origin again, then builds its own response (compression, ETag, 304) from the shared body
+REWRITE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="rewrite")
+IN_FLIGHT = {}
+
+def first_step(steps):
+    # Runs rewrite_steps up to its origin request. Returns (True, result) when it finished without one (a fresh
+    # manifest cache hit): a StopIteration can't be raised through an executor future into a coroutine
+    try:
+        return False, next(steps)
+    except StopIteration as done:
+        return True, done.value
+
+async def rewrite_manifest(mpd_url, metrics):
+    loop = asyncio.get_running_loop()
+    steps = proxy.rewrite_steps(mpd_url, metrics)
+    done, value = await loop.run_in_executor(REWRITE_EXECUTOR, first_step, steps)
+    if done:
+        return value
+    url, headers = value
+    try:
+        with metrics.stage("Fetch"):
+            origin_response = await origin_get(url, headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        origin_response = e
+    return await loop.run_in_executor(REWRITE_EXECUTOR, proxy.finish_rewrite, steps, origin_response)
+
+async def coalesced_rewrite(mpd_url, metrics):
+    # The asyncio counterpart of lambda_function.single_flight_rewrite, with the same SINGLE_FLIGHT settings
+    if proxy.SINGLEFLIGHT != "True":
+        return await rewrite_manifest(mpd_url, metrics)
+
+    try:
+        task = IN_FLIGHT.get(mpd_url)
+        if task is None:
+            task = asyncio.ensure_future(rewrite_manifest(mpd_url, metrics))
+            IN_FLIGHT[mpd_url] = task
+            task.add_done_callback(lambda done: IN_FLIGHT.pop(mpd_url, None))
+            # shield, so a client hanging up doesn't cancel the rewrite other requests may be waiting on
+            return await asyncio.shield(task)
+
+        LOGGER.info("Single-flight: waiting on the request in flight for %s " % (mpd_url))
+        metrics.add("Coalesced", 1)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), proxy.SINGLE_FLIGHT_MAX_WAIT)
+        except asyncio.TimeoutError:
+            raise proxy.ManifestProxyError("Timed out after %s seconds waiting on the request in flight for this manifest " % (proxy.SINGLE_FLIGHT_MAX_WAIT))
+    except proxy.ManifestProxyError:
+        raise
+    except Exception as e:
+        # the leader and its waiters all get the same error response
+        raise proxy.ManifestProxyError("Unable to rewrite manifest, got exception %s " % (e)) from e
+
+##
+## Lambda event adapter
+##
+
+async def async_lambda_handler(event, context=None):
+    # Takes and returns the same API Gateway proxy event and response as lambda_function.lambda_handler
+    metrics = InvocationMetrics("live_proxy_server")
+    try:
+        response = await proxy_manifest(event, metrics)
+        metrics.set_property("StatusCode", response['statusCode'])
+        return response
+    finally:
+        metrics.emit()
+
+async def proxy_manifest(event, metrics):
+
+    if LOGGER.isEnabledFor(proxy.logging.DEBUG):
+        LOGGER.debug("event : %s" % (str(event)))
+
+    mpd_url = proxy.manifest_url(event)
+    try:
+        body, minimum_update_period = await coalesced_rewrite(mpd_url, metrics)
+    except proxy.ManifestProxyError as e:
+        return proxy.error_response(str(e), mpd_url)
+    return proxy.manifest_response(body, minimum_update_period, proxy.request_headers(event), metrics)
+
+def request_event(request):
+    return {
+        "httpMethod": request.method,
+        "path": request.path,
+        "queryStringParameters": dict(request.query) or None,
+        "headers": dict(request.headers)
+    }
+
+def http_response(response):
+    body = response.get('body', "")
+    if response.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode("utf-8")
+    return web.Response(status = response['statusCode'], headers = response.get('headers'), body = body)
+
+##
+## Server
+##
+
+async def handle_request(request):
+    return http_response(await async_lambda_handler(request_event(request)))
+
+def server_app():
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handle_request)
+    app.on_cleanup.append(close_origin_client)
+    return app
+
+if __name__ == "__main__":
+    LOGGER.addHandler(proxy.logging.StreamHandler())
+    web.run_app(server_app(), host = SERVER_HOST, port = SERVER_PORT)
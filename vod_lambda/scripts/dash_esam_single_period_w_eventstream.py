@@ -1,12 +1,29 @@
 import json
 import boto3
-import datetime
 import math
 import os
-import requests
-import xmltodict
-import copy
-import re
+import sys
+from xml.sax.saxutils import escape
+import base64
+import bisect
+from array import array
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+
+# The shared dash_manifest package sits at the root of the repository, and at the root of the Lambda zip next to this
+# file, which takes precedence
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+
+from dash_manifest.mpd import as_list
+from dash_manifest.model import parse_mpd, element, ABSENT
+from dash_manifest.rules import ManifestRuleSet, load_manifest_rules
+from dash_manifest.adapters import ModelNodeAdapter
+from dash_manifest.esam import esam_signals
+from dash_manifest.scte35 import SCTE35_FORMAT, SCTE35_SCHEMES, SCTE35_NAMESPACES, SCTE35_EVENTS_MARKER, splice_info_section, insert_scte35_events
+from dash_manifest.metrics import InvocationMetrics
 
 import logging
 
@@ -14,13 +31,279 @@ LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 MANIFESTUPDATE="True" # LEAVE THIS VALUE to True
 
-# S3 client
-s3 = boto3.client('s3')
+### WebVTT segments are written to S3 by a pool of upload threads while the segmenter is still cutting the rest
+VTT_UPLOAD_CONCURRENCY = int(os.environ.get('VTT_UPLOAD_CONCURRENCY', 16))
+VTT_UPLOAD_RETRIES = int(os.environ.get('VTT_UPLOAD_RETRIES', 5))
+VTT_UPLOAD_BACKOFF = float(os.environ.get('VTT_UPLOAD_BACKOFF', 0.1))
+
+# S3 client, shared by the upload threads. The connection pool is sized so that every upload thread can hold a connection
+s3 = boto3.client('s3', config=Config(max_pool_connections=max(10, VTT_UPLOAD_CONCURRENCY)))
+
+##
+## Manifest rules
+##
+
+### Every edit made to the manifest is a rule: a selector (the element path from MPD down, optionally narrowed with
+### 'where' attribute values), an action and a value. Rules are loaded once, when the function is first loaded, from the
+### MANIFEST_RULES environment variable (a JSON list), from the JSON file named in MANIFEST_RULES_FILE, or from the
+### defaults below. The rules are applied to the new single period manifest before it's written. The rule set is compiled
+### so that the manifest is walked once, each element is visited once and only the rules selecting that element's path
+### are evaluated. The rule engine is shared by every variation of the modifier, see dash_manifest/rules.py
+###
+### Actions:
+###   set_attribute     name, value : set attribute 'name' to 'value'
+###   remove_attribute  name        : delete attribute 'name'
+###   remove_element    name        : delete every child element called 'name'
+###   add_element       name, value : replace any child elements called 'name' with one that has the 'value' attributes
+###
+### A rule that fails is logged as a modify exception and the manifest is still written, unless the rule has "required": true
+
+DEFAULT_MANIFEST_RULES = [
+    {"select": "MPD/Period/AdaptationSet", "action": "set_attribute", "name": "segmentAlignment", "value": "true"}
+]
+
+MANIFEST_RULES = ManifestRuleSet(load_manifest_rules(DEFAULT_MANIFEST_RULES))
+
+##
+## Segment timelines
+##
+
+### A representation's segments are held as runs, one per S element: the time and duration of the first segment of the run
+### and its number of repeats (S@r). The runs are stored in array('q') columns, so a long asset with many representations
+### is never expanded into one object per segment. 'cumulative' is the number of segments before each run, which gives
+### segment numbers without walking the timeline. While every run starts at or after the end of the one before it (the usual
+### case, 'ordered'), a window only looks at the runs a binary search on t says can overlap it
+
+class SegmentTimeline(object):
+
+    __slots__ = ('t', 'd', 'r', 'cumulative', 'count', 'first_number', 'ordered')
+
+    def __init__(self):
+        self.t = array('q')
+        self.d = array('q')
+        self.r = array('q')
+        self.cumulative = array('q')
+        self.count = 0
+        self.first_number = 1
+        self.ordered = True
+
+    @classmethod
+    def from_model(cls, segment_timeline):
+        # From a SegmentTimeline of the MPD object model
+        timeline = cls()
+        for t, d, r in segment_timeline.runs():
+            # A negative S@r (repeat until the next S element) isn't expanded, same as an S without a repeat
+            timeline.append(t, d, max(r, 0))
+        return timeline
+
+    def append(self, t, d, r=0):
+        if self.t and t < self.end():
+            self.ordered = False
+        self.t.append(t)
+        self.d.append(d)
+        self.r.append(r)
+        self.cumulative.append(self.count)
+        self.count += r + 1
+
+    def extend(self, other):
+        for run in range(len(other.t)):
+            self.append(other.t[run], other.d[run], other.r[run])
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # (t, d) of every segment, in timeline order
+        for run in range(len(self.t)):
+            t, d = self.t[run], self.d[run]
+            for repeat in range(self.r[run] + 1):
+                yield t + repeat * d, d
+
+    def end(self):
+        # End time of the last segment
+        return self.t[-1] + (self.r[-1] + 1) * self.d[-1]
+
+    def duration(self):
+        return sum((self.r[run] + 1) * self.d[run] for run in range(len(self.t)))
+
+    def first_segment_at(self, run, seconds, timescale):
+        # Index within the run of the first segment with t / timescale >= seconds, r + 1 if there isn't one. The float
+        # comparison is the one made against period boundaries, the estimate is only a starting point
+        t, d, last = self.t[run], self.d[run], self.r[run] + 1
+        if d <= 0:
+            return 0 if t / timescale >= seconds else last
+        k = min(max(int(math.ceil((seconds * timescale - t) / d)), 0), last)
+        while k > 0 and (t + (k - 1) * d) / timescale >= seconds:
+            k -= 1
+        while k < last and (t + k * d) / timescale < seconds:
+            k += 1
+        return k
+
+    def window(self, start_seconds, end_seconds, timescale):
+        # New timeline with the segments whose t / timescale falls within [start_seconds, end_seconds), each run is clipped
+        # rather than expanded. first_number is the segment number (from 1) of the window's first segment in this timeline
+        window = SegmentTimeline()
+        first_run, last_run = 0, len(self.t)
+        if self.ordered:
+            # a couple of ticks either side covers any float rounding in the boundary comparison
+            first_run = max(bisect.bisect_right(self.t, int(math.floor(start_seconds * timescale)) - 2) - 1, 0)
+            last_run = bisect.bisect_left(self.t, int(math.ceil(end_seconds * timescale)) + 2, first_run)
+        for run in range(first_run, last_run):
+            first = self.first_segment_at(run, start_seconds, timescale)
+            last = self.first_segment_at(run, end_seconds, timescale)
+            if first < last:
+                if window.count == 0:
+                    window.first_number = self.cumulative[run] + first + 1
+                window.append(self.t[run] + first * self.d[run], self.d[run], last - first - 1)
+        return window
+
+    def to_model(self):
+        # Back to a SegmentTimeline of the MPD object model, a run only gets an @r attribute when it repeats
+        segment_timeline = element('SegmentTimeline')
+        for run in range(len(self.t)):
+            segment_timeline.append_s(self.t[run], self.d[run], self.r[run] if self.r[run] > 0 else ABSENT)
+        return segment_timeline
+
+##
+## WebVTT segmenter
+##
+
+### The full WebVTT file from MediaConvert is cut into one small .vtt per video segment. The cue blocks are cleaned up
+### and their timestamps parsed once, into a list sorted on cue start time, so each segment finds its cues with a binary
+### search instead of re-reading the whole file
+
+def vtt_timestamp_seconds(timestamp):
+    # "00:00:01.042" -> 1.042
+    hours, minutes, seconds = timestamp.split(":")
+    return (int(hours) * 3600) + (int(minutes) * 60) + float(seconds)
+
+def vtt_cue_index(vtt_list):
+    # Any block that doesn't start with a timestamp is malformed or should be a part of the previous block
+    lines_to_delete = []
+    for line in range(1,len(vtt_list)):
+        if not vtt_list[line][0:2].isdigit():
+            vtt_list[line-1] = vtt_list[line-1] + "\n" + vtt_list[line]
+            lines_to_delete.append(line)
+    for ltd in reversed(lines_to_delete):
+        vtt_list.pop(ltd)
+
+    cues = []
+    for line_number in range(1,len(vtt_list)):
+        if len(vtt_list[line_number]) < 20:
+            LOGGER.info("VTT Line number %s has no good VTT Data, malformed or empty" % (line_number) )
+            continue
+        start_time_str = vtt_list[line_number].split("-->")[0].replace(" ","") # "00:00:01.042"
+        ## the string replace is because the 'music note' gets malformed during the vtt response decode
+        cues.append((vtt_timestamp_seconds(start_time_str), line_number, vtt_list[line_number].replace("â\u0099ª","♪") + "\n\n"))
+
+    # Sorted on start time, ties keep the order they had in the file
+    cues.sort(key=lambda cue: (cue[0], cue[1]))
+    return vtt_list[0] + "\n\n", [cue[0] for cue in cues], cues
+
+def vtt_segments(vtt_list, segments, timescale):
+    # Yields (segment number, vtt body) for every (t, d) segment, a segment holds the cues that start within [t, t + d)
+    header, cue_starts, cues = vtt_cue_index(vtt_list)
+    timescale = float(timescale)
+    for segment_number, (segment_time, segment_duration) in enumerate(segments, 1):
+        vtt_start = segment_time / timescale
+        vtt_end = vtt_start + segment_duration / timescale
+        first = bisect.bisect_left(cue_starts, vtt_start)
+        last = bisect.bisect_left(cue_starts, vtt_end, first)
+        segment_cues = sorted(cues[first:last], key=lambda cue: cue[1])
+        yield segment_number, header + "".join(cue[2] for cue in segment_cues)
+
+THROTTLING_ERROR_CODES = ("SlowDown", "Throttling", "ThrottlingException", "RequestLimitExceeded", "ServiceUnavailable", "TooManyRequestsException")
+
+def s3_put_with_retry(bucket, key, body):
+    attempt = 0
+    while True:
+        try:
+            return s3.put_object(Body=body, Bucket=bucket, Key=key, ACL='public-read')
+        except Exception as e:
+            error_code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+            if error_code not in THROTTLING_ERROR_CODES or attempt >= VTT_UPLOAD_RETRIES:
+                raise
+            attempt += 1
+            # Exponential backoff with full jitter, so throttled threads don't all come back at once
+            time.sleep(random.uniform(0, VTT_UPLOAD_BACKOFF * (2 ** attempt)))
+
+def upload_vtt_segments(vtt_segment_bodies, bucket, key_prefix, manifest_exceptions):
+    # The calling thread produces segments and hands each one to the pool. The semaphore bounds how many segments can be
+    # waiting for an upload thread, so a slow S3 holds back the segmenter instead of the whole VTT piling up in memory
+    failures = []
+    in_flight = threading.BoundedSemaphore(VTT_UPLOAD_CONCURRENCY * 2)
+
+    def upload(segment_number, key, body):
+        try:
+            s3_put_with_retry(bucket, key, body)
+        except Exception as e:
+            failures.append((segment_number, key, e))
+        finally:
+            in_flight.release()
+
+    segment_count = 0
+    with ThreadPoolExecutor(max_workers=VTT_UPLOAD_CONCURRENCY) as pool:
+        for segment_number, body in vtt_segment_bodies:
+            in_flight.acquire()
+            # key is = original key + _ + segment_number + .vtt
+            pool.submit(upload, segment_number, "%s_%s.vtt" % (key_prefix, segment_number), body)
+            segment_count += 1
+
+    if failures:
+        manifest_exceptions.append("Unable to write %s of %s new VTT Files to S3" % (len(failures), segment_count))
+        for segment_number, key, e in sorted(failures, key=lambda failure: failure[0]):
+            manifest_exceptions.append("Unable to write new VTT File %s to S3, got exception : %s " % (key, e))
+    return segment_count, len(failures)
+
+##
+## SCTE-35 events
+##
+
+### The Event templates, the binary splice_info_section and the EventStream marker are shared, see
+### dash_manifest/scte35.py. These are the lines of the XML SpliceInfoSection this function writes for each Event
+
+SCTE35_EVENT_XML = (
+    (0, '<Event%(event_attributes)s>'),
+    (1, '<scte35:SpliceInfoSection protocolVersion="0" tier="4095">'),
+    (2, '<scte35:TimeSignal>'),
+    (3, '<scte35:SpliceTime ptsTime="%(pts_time)s"/>'),
+    (2, '</scte35:TimeSignal>'),
+    (2, '<scte35:SegmentationDescriptor segmentationEventId="%(event_id)s" segmentationEventCancelIndicator="false" segmentationDuration="%(duration)s">'),
+    (3, '<scte35:DeliveryRestrictions webDeliveryAllowedFlag="false" noRegionalBlackoutFlag="false" archiveAllowedFlag="true" deviceRestrictions="3"/>'),
+    (3, '<scte35:SegmentationUpid segmentationUpidType="12" segmentationUpidLength="0" segmentationTypeId="%(segmentation_type_id)s" segmentNum="0" segmentsExpected="1"/>'),
+    (3, '<scte35:BreakDuration duration="%(duration)s"/>'),
+    (2, '</scte35:SegmentationDescriptor>'),
+    (1, '</scte35:SpliceInfoSection>'),
+    (0, '</Event>')
+)
+def scte35_event(event_id, segmentation_type_id, signal_point, break_duration, timescale):
+    # Template fields for one Event, times in the video timescale. The binary section is always in 90kHz ticks
+    pts_time = int(float(signal_point) * float(timescale))
+    duration = int(float(break_duration) * float(timescale))
+    event = {
+        "event_attributes": ' timescale="%s" duration="%s" presentationTime="%s"' % (escape(str(timescale), {'"': "&quot;"}), duration, pts_time),
+        "pts_time": pts_time,
+        "duration": duration,
+        "event_id": event_id,
+        "segmentation_type_id": segmentation_type_id
+    }
+    if SCTE35_FORMAT == "bin":
+        event["binary"] = base64.b64encode(splice_info_section(int(round(float(signal_point) * 90000)), int(round(float(break_duration) * 90000)), event_id, segmentation_type_id, (0, 0, 1, 3))).decode("ascii")
+    return event
 
 def lambda_handler(event, context):
+    # One metrics record per job, see dash_manifest/metrics.py
+    metrics = InvocationMetrics("vod_esam_single_period")
+    try:
+        return modify_vod_manifest(event, metrics)
+    finally:
+        metrics.emit()
+
+def modify_vod_manifest(event, metrics):
 
 
-    LOGGER.info("event : %s" % (str(event)))
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("event : %s" % (str(event)))
 
     ## CloudWatch Event Trigger
 
@@ -31,9 +314,10 @@ def lambda_handler(event, context):
     except Exception as e:
         LOGGER.error("Got wrong event as a trigger for this function. This function needs to parse event[region] and event[detail][jobid]. This is what we received : %s " % (event))
         raise Exception("Got wrong event as a trigger for this function. This function needs to parse event[region] and event[detail][jobid]. This is what we received : %s " % (event))
-
+    metrics.set_property("JobId", job_id)
 
     # get the account-specific mediaconvert endpoint for this region
+    job_fetch_started = time.perf_counter()
     mediaconvert_client = boto3.client('mediaconvert', region_name=region)
 
     try:
@@ -48,44 +332,23 @@ def lambda_handler(event, context):
     except:
         LOGGER.error("Unable to get job data from MediaConvert, got exception: %s " % (e))
         raise Exception("Unable to get job data from MediaConvert, got exception: %s " % (e))
+    metrics.add_time("JobFetch", time.perf_counter() - job_fetch_started)
 
     # Get the ESAM Data and put NPTpoints into List
     job_details = json.loads(json.dumps(response, default = lambda o: f"<<non-serializable: {type(o).__qualname__}>>"))
     esam_xml = job_details['Job']['Settings']['Esam']['SignalProcessingNotification']['SccXml']
-    esam_doc = xmltodict.parse(esam_xml.replace("\n"," "))
 
     esam_break_points = []
     esam_break_points_duration = []
-    for signal in esam_doc['SignalProcessingNotification']['ResponseSignal']:
-        try:
-            duration_string = signal['sig:SCTE35PointDescriptor']['sig:SegmentationDescriptorInfo']['@duration']
-
-            # If break is minutes long, convert any M integer to seconds
-            try:
-                duration_m = int(re.search('PT(.+?)M', duration_string).group(1))
-                duration_m_s = duration_m * 60
-            except AttributeError:
-                # PT<>M not found in ESAM duration
-                duration_m_s = 0 # apply your error handling
-
-            # If break is seconds long, grab the S integer
-            if re.search('PT[0-9]M(.+?)S', duration_string):
-                duration_s = int(re.search('PT[0-9]M(.+?)S', duration_string).group(1))
-            elif re.search('PT(.+?)S', duration_string):
-                duration_s = int(re.search('PT(.+?)S', duration_string).group(1))
-            else: # S is not present, so we'll check if M was specified, and if not we'll do a default duration of 30 seconds
-                if duration_m_s == 0:
-                    duration_s = 0
-
-            # Duration of break in seconds
-            break_duration = str(duration_m_s + duration_s)
-        except:
-            LOGGER.warning("unable to get adbreak duration from ESAM xml, defaulting to 30 seconds")
-            break_duration = str(0)
-
-        if signal['sig:SCTE35PointDescriptor']['sig:SegmentationDescriptorInfo']['@segmentTypeId'] == "52":
-            esam_break_points_duration.append([signal['@signalPointID'],break_duration])
-            esam_break_points.append(signal['@signalPointID'])
+    with metrics.stage("Esam"):
+        for signal_point_id, duration, segment_type_id in esam_signals(esam_xml):
+            if segment_type_id == "52":
+                if duration is None:
+                    LOGGER.warning("unable to get adbreak duration for signal %s from ESAM xml, defaulting to 0 seconds" % (signal_point_id))
+                    duration = 0
+                esam_break_points_duration.append([signal_point_id,duration])
+                esam_break_points.append(signal_point_id)
+    metrics.add("AdBreaks", len(esam_break_points))
 
 
     # Get the MPD and VTT if present
@@ -96,20 +359,7 @@ def lambda_handler(event, context):
             key = outputgroup['playlistFilePaths'][0].split("/",3)[3]
         elif outputgroup['type'] == "FILE_GROUP":
 
-            if isinstance(outputgroup['outputDetails'], list):
-                outputs = len(outputgroup['outputDetails'])
-                o_layout = "m"
-            else:
-                outputs = 1
-                o_layout = "s"
-
-            ### PERIOD
-            for output in range(0,outputs):
-                if o_layout == "s":
-                    o = outputgroup['type']
-                else:
-                    o = outputgroup['outputDetails'][output]
-
+            for o in as_list(outputgroup['outputDetails']):
                 final_path_name = '/'.join(o['outputFilePaths'][0].split("/")[-2:])
                 if "vtt" in final_path_name or "VTT" in final_path_name or "Vtt" in final_path_name:
                     if ".jpg" not in final_path_name:
@@ -127,7 +377,9 @@ def lambda_handler(event, context):
     # Get Manifest from S3
     try:
         key = event['detail']['outputGroupDetails'][0]['playlistFilePaths'][0].split("/",3)[3]
-        data_mpd = s3.get_object(Bucket=bucket, Key=key)
+        with metrics.stage("Fetch"):
+            data_mpd = s3.get_object(Bucket=bucket, Key=key)
+            mpd_file = data_mpd['Body'].read()
     except Exception as e:
         LOGGER.error("Failed to get manifest from S3, got exception : %s " % (e))
         raise Exception("Failed to get manifest from S3, got exception : %s " % (e))
@@ -137,16 +389,19 @@ def lambda_handler(event, context):
         LOGGER.info("There is a webVTT file present in the job output, location : %s " % (vtt_full))
         vtt_key = vtt_full.split("/",3)[3]
         try:
-            data_vtt = s3.get_object(Bucket=bucket, Key=vtt_key)
-            vtt_file = data_vtt['Body'].read()
+            with metrics.stage("VttFetch"):
+                data_vtt = s3.get_object(Bucket=bucket, Key=vtt_key)
+                vtt_file = data_vtt['Body'].read()
+            metrics.add("VttBytes", len(vtt_file), "Bytes")
             vtt_list = vtt_file.decode('utf-8').split("\n\n")
         except Exception as e:
             LOGGER.error("Unable to get WebVTT file from S3, got exception : %s " % (e))
             raise Exception("Unable to get WebVTT file from S3, got exception : %s " % (e))
 
-    # Read the MPD into a variable and convert from xml to Dict
-    mpd_file = data_mpd['Body'].read()
-    mpddoc = xmltodict.parse(mpd_file)
+    # Parse the MPD into the MPD object model, see dash_manifest/model.py
+    metrics.add("ManifestBytes", len(mpd_file), "Bytes")
+    with metrics.stage("Parse"):
+        mpd = parse_mpd(mpd_file)
 
     # Create a list to track exceptions and exit if necessary
     manifest_exceptions = []
@@ -160,158 +415,105 @@ def lambda_handler(event, context):
         ### An exception does not cause the workflow to fail
 
         LOGGER.info("Manifest Modifier: Starting...")
+        build_started = time.perf_counter()
 
         ### Get details at the MPD Level Here ### START
-        # EXAMPLE : mpddoc['MPD']['@attribute'] == XX
+        # EXAMPLE : mpd.get('attribute') == XX
 
 
-        mpd_header = dict(mpddoc['MPD'])
-        mpd_header['@xmlns:scte35'] = "urn:scte:scte35:2013:xml"
-        del mpd_header['Period']
+        mpd_header = mpd.copy()
+        mpd_header.set('xmlns:scte35', SCTE35_NAMESPACES[SCTE35_FORMAT])
+        mpd_header.remove_children('Period')
 
         ### Get details at the MPD Level Here ### END
 
+        # adaptation set and representation headers, with the representation ids of each adaptation set and the segments
+        # of each representation alongside
         adaptation_sets = dict()
+        adaptation_set_representations = dict()
         representations_d = dict()
+        representation_segments = dict()
 
-        if isinstance(mpddoc['MPD']['Period'], list):
-            periods = len(mpddoc['MPD']['Period'])
-            LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(periods)))
-            p_layout = "m"
-        else:
-            periods = 1
-            LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(periods)))
-            p_layout = "s"
+        periods = mpd.periods
+        LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(len(periods))))
 
         ### PERIOD
-        for period in range(0,periods):
-            if p_layout == "s":
-                p = mpddoc['MPD']['Period']
-            else:
-                p = mpddoc['MPD']['Period'][period]
+        for period, p in enumerate(periods):
 
             ### Get details at the Period Level Here ### START
-            ## p['attribute']
+            ## p.get('attribute')
 
 
             ### Get details at the Period Level Here ### END
 
             ### ADAPTATION SET
-            if isinstance(p['AdaptationSet'], list):
-                adaptationsets = len(p['AdaptationSet'])
-                LOGGER.debug("Manifest Modifier: Period %s has %s AdaptationSets" % (str(period),str(adaptationsets)))
-                a_layout = "m"
-            else:
-                adaptationsets = 1
-                a_layout = "s"
-            for adaptationset in range(0,adaptationsets):
+            adaptationsets = p.adaptation_sets
+            LOGGER.debug("Manifest Modifier: Period %s has %s AdaptationSets" % (str(period),str(len(adaptationsets))))
+            for adaptationset, a in enumerate(adaptationsets):
                 LOGGER.debug("Manifest Modifier: Iterating through AS %s " % (str(adaptationset)))
-                if a_layout == "s":
-                    a = p['AdaptationSet']
-                else:
-                    a = p['AdaptationSet'][adaptationset]
 
                 adapt_reps = []
-                a_dict = dict(a)
-                del a_dict['Representation']
+                a_header = a.copy()
+                a_header.remove_children('Representation')
                 ### Get details at the AdaptationSet Level Here ### START
-                ## a['attribute']
+                ## a.get('attribute')
 
 
-                if a['@mimeType'] == "audio/mp4": # this is audio
+                if a.mime_type == "audio/mp4": # this is audio
                     try:
-                        adaptation_set_type = "audio!" + a['Label']
+                        adaptation_set_type = "audio!" + a.find('Label').text
                         if adaptation_set_type not in adaptation_sets:
-                            adaptation_sets[adaptation_set_type] = a_dict
-                            adaptation_sets[adaptation_set_type]['representations'] = ""
+                            adaptation_sets[adaptation_set_type] = a_header
                     except:
                         raise Exception("Audio Adaptation Sets must be labeled.")
 
-                elif a['@mimeType'] == "video/mp4": # assume video
-                    adaptation_set_type = a['@mimeType']
+                elif a.mime_type == "video/mp4": # assume video
+                    adaptation_set_type = a.mime_type
                     if adaptation_set_type not in adaptation_sets:
-                        adaptation_sets[adaptation_set_type] = a_dict
-                        adaptation_sets[adaptation_set_type]['representations'] = ""
+                        adaptation_sets[adaptation_set_type] = a_header
                 #
 
-                #adapt_reps.append(r['@id'])
-                #adaptation_sets[adaptation_set_type]['representations'] = adapt_reps
+                #adapt_reps.append(r.id)
+                #adaptation_set_representations[adaptation_set_type] = adapt_reps
 
                 ### Get details at the AdaptationSet Level Here ### END
 
 
                 ### REPRESENTATION ###
-                if isinstance(a['Representation'], list):
-                    representations = len(a['Representation'])
-                    LOGGER.debug("Manifest Modifier: AdaptationSet %s has %s Representations" % (str(adaptationset),str(representations)))
-                    r_layout = "m"
-                else:
-                    representations = 1
-                    LOGGER.debug("Manifest Modifier: AdaptationSet %s has %s Representations" % (str(adaptationset),str(representations)))
-                    r_layout = "s"
-                for representation in range(0,representations):
+                representations = a.representations
+                LOGGER.debug("Manifest Modifier: AdaptationSet %s has %s Representations" % (str(adaptationset),str(len(representations))))
+                for representation, r in enumerate(representations):
                     LOGGER.debug("Manifest Modifier: Iterating through Representation %s " % (str(representation)))
-                    if r_layout == "s":
-                        r = a['Representation']
-                    else:
-                        r = a['Representation'][representation]
 
-                    rep_id = str(r['@id'])
-                    rep_details = dict(r)
+                    rep_id = str(r.id)
 
                     ### Get details at the Representation Level Here ### START
-                    ## r['attribute']
-                    if isinstance(r['SegmentTemplate']['SegmentTimeline']['S'],list):
-                        timeline = len(r['SegmentTemplate']['SegmentTimeline']['S'])
-                        LOGGER.debug("Manifest Modifier: Representation %s has multiple segments in timeline" % (r))
-                        t_layout = "m"
-                    else:
-                        timeline = 1
-                        LOGGER.debug("Manifest Modifier: Representation %s has single segment timeline element in timeline" % (r))
-                        t_layout = "s"
+                    ## r.get('attribute')
+                    rep_segments = SegmentTimeline.from_model(r.segment_template.segment_timeline)
+                    LOGGER.debug("Manifest Modifier: Representation %s has %s segments in %s timeline elements" % (rep_id, len(rep_segments), len(rep_segments.t)))
 
                     adapt_reps.append(rep_id)
 
-                    rep_segments = []
-                    rep_segments.clear()
-                    for segmenttime in range(0,timeline):
-                        if t_layout == "s":
-                            t = r['SegmentTemplate']['SegmentTimeline']['S']
-                        else:
-                            t = r['SegmentTemplate']['SegmentTimeline']['S'][segmenttime]
-
-                        segtime = t['@t']
-                        segdur = t['@d']
-                        rep_segments.append({"@t":segtime,"@d":segdur})
-
-                        if "@r" in t: # repetitive segments
-
-                            for reprange in range(1,int(t['@r'])+1):
-                                reptime = int(reprange) * int(segdur) + int(segtime)
-                                rep_segments.append({"@t":reptime,"@d":segdur})
-
-
-                    del r['SegmentTemplate']['SegmentTimeline']
+                    r.segment_template.remove_children('SegmentTimeline')
                     if rep_id not in representations_d:
                         representations_d[rep_id] = r
 
-                    if "segments" in representations_d[rep_id]:
-                        merge_segments = representations_d[rep_id]['segments'] + rep_segments
-                        representations_d[rep_id]['segments'] = merge_segments
+                    if rep_id in representation_segments:
+                        representation_segments[rep_id].extend(rep_segments)
                     else:
-                        representations_d[rep_id]['segments'] = rep_segments
+                        representation_segments[rep_id] = rep_segments
 
-                adaptation_sets[adaptation_set_type]['representations'] = adapt_reps
+                adaptation_set_representations[adaptation_set_type] = adapt_reps
         # get the video timescale to calculate duration
         try:
-            video_timescale = adaptation_sets[list(adaptation_sets.keys())[0]]['SegmentTemplate']['@timescale']
+            video_timescale = adaptation_sets[list(adaptation_sets.keys())[0]].segment_template.get('timescale')
         except Exception as e:
             LOGGER.error("Unable to get timescale from adaptation set, got exception %s " % (e))
             manifest_exceptions("Unable to get timescale from adaptation set, got exception %s " % (e))
             raise Exception("Unable to get timescale from adaptation set, got exception %s " % (e))
 
         # Asset Duration , calculated from last PTS stamp of representation id 1 + duration of that segment
-        duration_pts = int(representations_d['1']['segments'][-1]['@t']) + int(representations_d['1']['segments'][-1]['@d'])
+        duration_pts = representation_segments['1'].end()
         duration_presentation_m = int((duration_pts / int(video_timescale)) / 60)
         duration_presentation_s = round((duration_pts / int(video_timescale)) - (duration_presentation_m * 60),3)
         duration_presentation = "PT"+str(duration_presentation_m)+"M"+str(duration_presentation_s)+"S"
@@ -323,82 +525,29 @@ def lambda_handler(event, context):
 
             # Create VTT Representation and add to dict
             vtt_representation = str(len(representations_d) + 1)
-            representations_d[vtt_representation] = copy.deepcopy(representations_d[list(representations_d.keys())[0]])
-            representations_d[vtt_representation] = {}
-            representations_d[vtt_representation]['@id'] = vtt_representation_id #Path to vtt base /vtt/fullvtt
-            representations_d[vtt_representation]['@bandwidth'] = "52"
-            representations_d[vtt_representation]['SegmentTemplate'] = {}
-            representations_d[vtt_representation]['SegmentTemplate']['@timescale'] = video_timescale
-            representations_d[vtt_representation]['SegmentTemplate']['@media'] = "$RepresentationID$_$Number$.vtt"
-            representations_d[vtt_representation]['segments'] = copy.deepcopy(representations_d[list(representations_d.keys())[0]]['segments'])
+            representations_d[vtt_representation] = element('Representation', {'id': vtt_representation_id, 'bandwidth': "52"}) #Path to vtt base /vtt/fullvtt
+            representations_d[vtt_representation].append(element('SegmentTemplate', {'timescale': video_timescale, 'media': "$RepresentationID$_$Number$.vtt"}))
+            representation_segments[vtt_representation] = representation_segments[list(representations_d.keys())[0]]
 
             # Create VTT Adaptation Set
-            vtt_dict = dict()
-            vtt_dict['text/vtt'] = {}
-            vtt_dict['text/vtt']['@mimeType'] = "text/vtt"
-            vtt_dict['text/vtt']['@lang'] = "en"
-            vtt_dict['text/vtt']['SegmentTemplate'] = {}
-            vtt_dict['text/vtt']['SegmentTemplate']['@timescale'] = video_timescale
-            vtt_dict['text/vtt']['representations'] = [vtt_representation]
+            vtt_adaptation_set = element('AdaptationSet', {'mimeType': "text/vtt", 'lang': "en"})
+            vtt_adaptation_set.append(element('SegmentTemplate', {'timescale': video_timescale}))
 
             # Add Adaptation Set to dict
-            adaptation_sets.update(vtt_dict)
+            adaptation_sets['text/vtt'] = vtt_adaptation_set
+            adaptation_set_representations['text/vtt'] = [vtt_representation]
 
             # Create VTT segments from full vtt
             LOGGER.info("Starting VTT Segmenter process.. this may take a few minutes")
-            vtt_segment_number = 1
-            for segment in representations_d[vtt_representation]['segments']:
-                new_vtt = []
-                new_vtt.clear()
-                vtt_start = float(float(segment['@t']) / float(video_timescale))
-                vtt_end = float(vtt_start + float(segment['@d']) / float(video_timescale))
-
-                lines_to_delete = []
-                for line in range(1,len(vtt_list)):
-                    if not vtt_list[line][0:2].isdigit():
-                        # this line is malformed or should be a part of the previous line
-                        vtt_list[line-1] = vtt_list[line-1] + "\n" + vtt_list[line]
-                        lines_to_delete.append(int(line))
-
-                lines_to_delete.sort(reverse = True )
-                for ltd in lines_to_delete:
-                    #return ltd
-                    vtt_list.pop(ltd)
-
-                new_vtt.append(vtt_list[0] + "\n\n")
-                for line_number in range(1,len(vtt_list)):
-                    if len(vtt_list[line_number]) < 20:
-                        LOGGER.info("VTT Line number %s has no good VTT Data, malformed or empty" % (line_number) )
-                    else:
-                        start_time_str = vtt_list[line_number].split("-->")[0].replace(" ","") # "00:00:01.042"
-                        end_time_str = vtt_list[line_number].split("-->")[1].split(" ")[1].split("\n")[0]
-
-                        start_time_seconds = (int(start_time_str.split(":")[0]) * 3600) + (int(start_time_str.split(":")[1]) * 60) + float(start_time_str.split(":")[2])
-                        end_time_seconds = (int(end_time_str.split(":")[0]) * 3600) + (int(end_time_str.split(":")[1]) * 60) + float(end_time_str.split(":")[2])
-
-                        if start_time_seconds >= vtt_start and start_time_seconds < vtt_end:
-                            new_start_time_seconds = datetime.timedelta(seconds = start_time_seconds - vtt_start)
-                            new_end_time_seconds = datetime.timedelta(seconds = end_time_seconds - vtt_start)
-                            new_start_time = str("0") + str(new_start_time_seconds)[:-3]
-                            new_end_time = str("0") + str(new_end_time_seconds)[:-3]
-                            new_start_time = start_time_str
-                            new_end_time = end_time_str
-
-                            new_vtt.append(vtt_list[line_number].replace("â\u0099ª","♪").replace(start_time_str,new_start_time).replace(end_time_str,new_end_time) + "\n\n") ## the string replace is because the 'music note' gets malformed during the vtt response decode
-
-                vtt_str = ""
-                for line in new_vtt:
-                    vtt_str = vtt_str + line
-
-                # bucket is known
-                # key is = original key + _ + segment_number + .vtt
-                new_vtt_key = "%s_%s.vtt" % (vtt_full_no_ext.split("/",3)[-1],vtt_segment_number)
-                try:
-                    s3_put_response = s3.put_object(Body=vtt_str, Bucket=bucket, Key=new_vtt_key, ACL='public-read')
-                except Exception as e:
-                    manifest_exceptions.append("Unable to write new VTT File to S3, got exception : %s " % (e))
-
-                vtt_segment_number += 1
+            vtt_upload_start = time.perf_counter()
+            vtt_segment_count, vtt_failures = upload_vtt_segments(vtt_segments(vtt_list, representation_segments[vtt_representation], video_timescale), bucket, vtt_full_no_ext.split("/",3)[-1], manifest_exceptions)
+            vtt_upload_seconds = time.perf_counter() - vtt_upload_start
+            LOGGER.info("VTT Segmenter: wrote %s segments, %s failed, in %.3f s with %s upload threads" % (vtt_segment_count, vtt_failures, vtt_upload_seconds, VTT_UPLOAD_CONCURRENCY))
+            # The segmenter and the uploads overlap, the stage covers both
+            metrics.add_time("VttSegment", vtt_upload_seconds)
+            metrics.add("VttSegments", vtt_segment_count)
+            metrics.add("VttUploadFailures", vtt_failures)
+            build_started += vtt_upload_seconds
 
         ### VTT Segment creation end
 
@@ -410,52 +559,26 @@ def lambda_handler(event, context):
         period_timing[str(period_number)] = 0,duration_pts
 
         ## Create EventStream Elements
-        eventstream = []
-
-
-
+        scte35_events = []
         scte_type = [52,53]
-        for break_point in range(0,len(esam_break_points_duration)):
-            for s_type in scte_type:
-                break_info = esam_break_points_duration[break_point]
-                pts_time = int(float(break_info[0]) * float(video_timescale))
-                duration = int(float(break_info[1]) * float(video_timescale))
-                event_id = str(break_point)
-
-
-                LOGGER.debug("EventStream PTS time %s " % (str(pts_time)))
-
-                scte_event = dict()
-                scte_event['@timescale'] = video_timescale
-                scte_event['@duration'] = str(duration)
-                scte_event['@presentationTime'] = str(pts_time)
-                scte_event['scte35:SpliceInfoSection'] = {}
-                scte_event['scte35:SpliceInfoSection']['@protocolVersion'] = "0"
-                scte_event['scte35:SpliceInfoSection']['@tier'] = "4095"
-                scte_event['scte35:SpliceInfoSection']['scte35:TimeSignal'] = {}
-                scte_event['scte35:SpliceInfoSection']['scte35:TimeSignal']['scte35:SpliceTime'] = {}
-                scte_event['scte35:SpliceInfoSection']['scte35:TimeSignal']['scte35:SpliceTime']['@ptsTime'] = str(pts_time)
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor'] = {}
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['@segmentationEventId'] = event_id
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['@segmentationEventCancelIndicator'] = "false"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['@segmentationDuration'] = str(duration)
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions'] = {}
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions']['@webDeliveryAllowedFlag'] = "false"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions']['@noRegionalBlackoutFlag'] = "false"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions']['@archiveAllowedFlag'] = "true"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions']['@deviceRestrictions'] = "3"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid'] = {}
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentationUpidType'] = "12"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentationUpidLength'] = "0"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentationTypeId'] = str(s_type)
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentNum'] = "0"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentsExpected'] = "1"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:BreakDuration'] = {}
-                #scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:BreakDuration']['@autoReturn'] = "true"
-                scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:BreakDuration']['@duration'] = str(duration)
-
-                eventstream.append(scte_event)
-
+        with metrics.stage("Events"):
+            for break_point in range(0,len(esam_break_points_duration)):
+                for s_type in scte_type:
+                    break_info = esam_break_points_duration[break_point]
+                    scte35_events.append(scte35_event(break_point, s_type, break_info[0], break_info[1], video_timescale))
+                    LOGGER.debug("EventStream PTS time %s " % (str(scte35_events[-1]['pts_time'])))
+        metrics.add("Events", len(scte35_events))
+
+        # The Events are rendered into the EventStream after the manifest is serialized, see insert_scte35_events
+        eventstream = element('EventStream', {"timescale":video_timescale,"schemeIdUri":SCTE35_SCHEMES[SCTE35_FORMAT]})
+        if scte35_events:
+            eventstream.text = SCTE35_EVENTS_MARKER
+
+        # Timescale of every representation, resolved once from its adaptation set
+        representation_timescales = dict()
+        for a in adaptation_sets:
+            for r in adaptation_set_representations[a]:
+                representation_timescales[r] = float(adaptation_sets[a].segment_template.get('timescale'))
 
         # Start building new MPD
         new_mpd_period_layout = []
@@ -463,9 +586,10 @@ def lambda_handler(event, context):
         p_adaptation_sets = dict()
 
         for new_mpd_period in period_timing:
-            # create dictionary copies
-            p_representations = copy.deepcopy(representations_d)
-            p_adaptation_sets = copy.deepcopy(adaptation_sets)
+            # per period copies of the adaptation set headers. The representations are only read, their headers are copied
+            # below as each one is added to the period
+            p_representations = representations_d
+            p_adaptation_sets = dict((a, adaptation_sets[a].copy()) for a in adaptation_sets)
 
 
             period_start = period_timing[new_mpd_period][0]
@@ -477,113 +601,83 @@ def lambda_handler(event, context):
 
             period_duration = dict()
             for r in p_representations:
-                representation_index[str(r)] = []
-                segment_number = 1
-                start_index = []
-                period_duration_pts = 0
-
-                # get timescale
-                factor = 0
-                for a in p_adaptation_sets:
-                    if r in p_adaptation_sets[a]['representations']:
-                        factor = float(p_adaptation_sets[a]['SegmentTemplate']['@timescale'])
-
+                factor = representation_timescales.get(r, 0)
                 if factor == 0:
                     manifest_exceptions.append("Unable to get timescale from the adaptation set of representation %s" % (str(r)))
 
-                for s in p_representations[r]['segments']:
-
-                    if float(s['@t']) / factor >= float(period_start) - 0.33 and float(int(s['@t']) / factor) < period_end - 0.33:
-                        representation_index[str(r)].append(s)
-                        start_index.append(segment_number)
-                        period_duration_pts += int(s['@d'])
-                    segment_number += 1
+                # segments that start within the period, with the same repeats (S@r) they had in the source timeline
+                period_segments = representation_segments[r].window(float(period_start) - 0.33, period_end - 0.33, factor)
+                period_duration_pts = period_segments.duration()
 
                 period_duration_presentation_m = int((period_duration_pts / factor) / 60)
                 period_duration_presentation_s = round((period_duration_pts / factor) - (period_duration_presentation_m * 60),3)
                 period_duration_presentation = "PT"+str(period_duration_presentation_m)+"M"+str(period_duration_presentation_s)+"S"
                 period_duration[r] = period_duration_presentation
 
-                # representation_index[r] should have all segments in timeline listed explicitly. now we can compress with @r attributes
-                segment_count = 0
-                repeat_timeline = []
-
-                while segment_count < len(representation_index[str(r)]):
-
-                    repeat_counter = 0
-                    segment_timeline = copy.deepcopy(representation_index[str(r)][segment_count])
-
-                    #if segment_count < len(representation_index[r]):
-
-                    repeat_true = "true"
-                    while repeat_true == "true" and segment_count + 1 < len(representation_index[str(r)]):
-
-                        if segment_count + 1 < len(representation_index[r]):
-
-                            if representation_index[str(r)][segment_count+1]['@d'] is representation_index[str(r)][segment_count]['@d']:
-
-                                repeat_counter += 1
-                                segment_count += 1
-                            else:
-                                repeat_true = "false"
-
-                    if repeat_counter > 0:
-                        segment_timeline.update({"@r":repeat_counter})
-                        #segment_timeline.update({"@t":segment_timeline['@t'],"@d":segment_timeline['@d'], "@r":repeat_counter})
-                    repeat_timeline.append(segment_timeline)
-                    segment_count += 1
-                representation_collapse[r] = repeat_timeline
-
-                representation_index['startNumber_'+str(r)] = start_index[0]
-                representation_index['periodDuration_'+str(new_mpd_period)] = period_duration_presentation
+                representation_collapse[r] = period_segments
+                representation_index['startNumber_'+str(r)] = period_segments.first_number
 
             for a in p_adaptation_sets:
 
                 adaptation_representation = []
-                for r in p_adaptation_sets[a]['representations']:
+                adaptation_segment_template = p_adaptation_sets[a].segment_template
+                for r in adaptation_set_representations[a]:
 
-                    representation_header = dict(p_representations[r])
+                    # The representation's own SegmentTemplate, with the adaptation set's attributes merged in and the
+                    # period's segments as its SegmentTimeline
+                    representation_header = p_representations[r].copy()
+                    segment_template = representation_header.segment_template.copy()
+                    representation_header.children[representation_header.children.index(representation_header.segment_template)] = segment_template
 
-                    del representation_header['segments']
-                    representation_header['SegmentTemplate'].update(p_adaptation_sets[a]['SegmentTemplate'])
-                    representation_header['SegmentTemplate']['SegmentTimeline'] = {}
-                    representation_header['SegmentTemplate']['SegmentTimeline']['S'] = representation_collapse[r] # representation_collapse will have 'r' attributes in segment timelines
+                    segment_template.attributes.update(adaptation_segment_template.attributes)
+                    segment_template.append(representation_collapse[r].to_model()) # representation_collapse will have 'r' attributes in segment timelines
 
-                    representation_header['SegmentTemplate']['@startNumber'] = str(representation_index['startNumber_'+r])
+                    segment_template.set('startNumber', representation_index['startNumber_'+r])
 
                     adaptation_representation.append(representation_header)
 
-                    representation_header['SegmentTemplate']['@presentationTimeOffset'] = adaptation_representation[0]['SegmentTemplate']['SegmentTimeline']['S'][0]['@t']
+                    segment_template.set('presentationTimeOffset', adaptation_representation[0].segment_template.segment_timeline.t[0])
 
-                p_adaptation_sets[a]['@segmentAlignment'] = "true"
-                del p_adaptation_sets[a]['representations']
-                del p_adaptation_sets[a]['SegmentTemplate']
-                p_adaptation_sets[a]['Representation'] = adaptation_representation
+                p_adaptation_sets[a].remove_children('SegmentTemplate')
+                p_adaptation_sets[a].children.extend(adaptation_representation)
 
             new_ad_sets = []
 
             for a in p_adaptation_sets:
                 new_ad_sets.append(p_adaptation_sets[a])
 
-            new_mpd_period_layout.append({"@start":"PT0.00S","@duration":period_duration["1"], "@id":new_mpd_period, "EventStream":{"@timescale":video_timescale,"@schemeIdUri":"urn:scte:scte35:2013:xml", "Event":eventstream}, "AdaptationSet":new_ad_sets})
-            #new_mpd_period_layout.append({"@duration":period_duration["1"], "@id":new_mpd_period, "AdaptationSet":new_ad_sets})
+            new_mpd_period_layout.append(element('Period', {"start":"PT0.00S","duration":period_duration["1"], "id":new_mpd_period}, [eventstream.copy()] + new_ad_sets))
+            #new_mpd_period_layout.append(element('Period', {"duration":period_duration["1"], "id":new_mpd_period}, new_ad_sets))
+
 
+        new_mpd = mpd_header
+        new_mpd.children.extend(new_mpd_period_layout)
+        # Building the new single period layout, Events included. The VTT segmenter is left out, it has its own stage
+        metrics.add_time("Build", time.perf_counter() - build_started)
+        metrics.add("Representations", len(representations_d))
 
-        new_mpd = dict()
-        new_mpd['MPD'] = mpd_header
-        new_mpd['MPD']['Period'] = new_mpd_period_layout
+        MANIFEST_RULES.apply(ModelNodeAdapter(), new_mpd, manifest_exceptions)
+        LOGGER.info("Manifest Modifier: %s rules applied in %.3f ms" % (str(len(MANIFEST_RULES.rules)), MANIFEST_RULES.total_seconds() * 1000))
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("Manifest Modifier - Rule timings : %s " % (MANIFEST_RULES.timings()))
+        metrics.add_rule_timings(MANIFEST_RULES)
 
         #return new_mpd
-        new_mpd_xml = xmltodict.unparse(new_mpd, short_empty_elements=True, pretty=True).encode('utf-8')
+        with metrics.stage("Serialize"):
+            new_mpd_xml = insert_scte35_events(new_mpd.to_xml(), scte35_events, SCTE35_EVENT_XML).encode('utf-8')
+        metrics.add("OutputBytes", len(new_mpd_xml), "Bytes")
 
         LOGGER.info("Manifest Modifier: Complete...")
         LOGGER.info("Manifest Modifier: Exceptions during Get details : %s " % (str(len(manifest_exceptions))))
         LOGGER.debug("Manifest Modifier - Exceptions caught : %s " % (manifest_exceptions))
+        metrics.add("ModifyExceptions", len(manifest_exceptions))
 
-        LOGGER.debug("New MPD : %s" % (new_mpd_xml))
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("New MPD : %s" % (new_mpd_xml))
 
         try:
-            s3_put_response = s3.put_object(Body=new_mpd_xml, Bucket=bucket, Key=new_key, ACL='public-read')
+            with metrics.stage("Upload"):
+                s3_put_response = s3.put_object(Body=new_mpd_xml, Bucket=bucket, Key=new_key, ACL='public-read')
         except Exception as e:
             raise Exception("Unable to write new manifest to S3, got exception : %s " % (e))
         return s3_put_response
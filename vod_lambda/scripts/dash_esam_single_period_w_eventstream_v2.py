@@ -26,12 +26,21 @@ Original Author: Scott Cunningham
 
 import json
 import boto3
-import datetime
-import math
 import os
-import requests
-import xmltodict
-import re
+import base64
+import sys
+import time
+
+# The shared dash_manifest package sits at the root of the repository, and at the root of the Lambda zip next to this
+# file, which takes precedence
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+
+from dash_manifest.model import parse_mpd, element
+from dash_manifest.rules import ManifestRuleSet, load_manifest_rules
+from dash_manifest.adapters import ModelNodeAdapter
+from dash_manifest.esam import esam_signals
+from dash_manifest.scte35 import SCTE35_FORMAT, SCTE35_SCHEMES, SCTE35_NAMESPACES, SCTE35_EVENTS_MARKER, splice_info_section, insert_scte35_events
+from dash_manifest.metrics import InvocationMetrics
 
 import logging
 
@@ -40,9 +49,79 @@ LOGGER.setLevel(logging.INFO)
 MANIFESTMODIFY = True
 INSERTEMCEVENTS = True
 
+##
+## Manifest rules
+##
+
+### Every edit made to the manifest is a rule: a selector (the element path from MPD down, optionally narrowed with
+### 'where' attribute values), an action and a value. Rules are loaded once, when the function is first loaded, from the
+### MANIFEST_RULES environment variable (a JSON list), from the JSON file named in MANIFEST_RULES_FILE, or from the
+### defaults below. The rule set is compiled so that the manifest is walked once, each element is visited once and
+### only the rules selecting that element's path are evaluated. The rule engine is shared by every variation of the
+### modifier, see dash_manifest/rules.py
+###
+### Actions:
+###   set_attribute     name, value : set attribute 'name' to 'value'
+###   remove_attribute  name        : delete attribute 'name'
+###   remove_element    name        : delete every child element called 'name'
+###   add_element       name, value : replace any child elements called 'name' with one that has the 'value' attributes
+###
+### A rule that fails is logged as a modify exception and the manifest is still written, unless the rule has "required": true
+
+DEFAULT_MANIFEST_RULES = [
+    # EXAMPLE, hard-code CC accessibility elements:
+    # {"select": "MPD/Period/AdaptationSet", "action": "add_element", "name": "Role", "value": {"schemeIdUri": "urn:mpeg:dash:role:2011", "value": "main"}},
+    # {"select": "MPD/Period/AdaptationSet", "where": {"mimeType": "video/mp4"}, "action": "add_element", "name": "Accessibility", "value": {"schemeIdUri": "urn:scte:dash:cc:cea-608:2015", "value": "CC1=eng"}}
+]
+
+MANIFEST_RULES = ManifestRuleSet(load_manifest_rules(DEFAULT_MANIFEST_RULES))
+
+##
+## SCTE-35 events
+##
+
+### The Event templates, the binary splice_info_section and the EventStream marker are shared, see
+### dash_manifest/scte35.py. These are the lines of the XML SpliceInfoSection this function writes for each Event
+
+SCTE35_EVENT_XML = (
+    (0, '<Event%(event_attributes)s>'),
+    (1, '<scte35:SpliceInfoSection protocolVersion="0" tier="4095" ptsAdjustment="0">'),
+    (2, '<scte35:TimeSignal>'),
+    (3, '<scte35:SpliceTime ptsTime="%(pts_time)s"/>'),
+    (2, '</scte35:TimeSignal>'),
+    (2, '<scte35:SegmentationDescriptor segmentationEventId="%(event_id)s" segmentationEventCancelIndicator="false" segmentationDuration="%(duration)s" autoReturn="true">'),
+    (3, '<scte35:SegmentationUpid segmentationUpidType="12" segmentationUpidLength="0" segmentationTypeId="%(segmentation_type_id)s" segmentNum="0" segmentsExpected="1"/>'),
+    (2, '</scte35:SegmentationDescriptor>'),
+    (1, '</scte35:SpliceInfoSection>'),
+    (0, '</Event>')
+)
+def scte35_event(dash_event_id, event_id, segmentation_type_id, signal_point, break_duration, timescale):
+    # Template fields for one Event, times in the video timescale. The binary section is always in 90kHz ticks
+    pts_time = int(float(signal_point) * float(timescale))
+    duration = int(float(break_duration) * float(timescale))
+    event = {
+        "event_attributes": ' id="%s" duration="%s" presentationTime="%s"' % (dash_event_id, duration, pts_time),
+        "pts_time": pts_time,
+        "duration": duration,
+        "event_id": event_id,
+        "segmentation_type_id": segmentation_type_id
+    }
+    if SCTE35_FORMAT == "bin":
+        event["binary"] = base64.b64encode(splice_info_section(int(round(float(signal_point) * 90000)), int(round(float(break_duration) * 90000)), event_id, segmentation_type_id)).decode("ascii")
+    return event
+
 def lambda_handler(event, context):
+    # One metrics record per job, see dash_manifest/metrics.py
+    metrics = InvocationMetrics("vod_esam_single_period_v2")
+    try:
+        return modify_vod_manifest(event, metrics)
+    finally:
+        metrics.emit()
 
-    LOGGER.info("event : %s" % (str(event)))
+def modify_vod_manifest(event, metrics):
+
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("event : %s" % (str(event)))
 
     ## CloudWatch Event Trigger
 
@@ -50,6 +129,7 @@ def lambda_handler(event, context):
     event_body = event
     region = event_body['region']
     job_id = str(event_body['detail']['jobId'])
+    metrics.set_property("JobId", job_id)
 
     # S3 client
     s3 = boto3.client('s3')
@@ -71,10 +151,12 @@ def lambda_handler(event, context):
             key = outputgroup['playlistFilePaths'][0].split("/",3)[3]
 
 
-    data_mpd = s3.get_object(Bucket=bucket, Key=key)
+    with metrics.stage("Fetch"):
+        data_mpd = s3.get_object(Bucket=bucket, Key=key)
 
-    # Read S3 object response into Variable
-    mpd_file = data_mpd['Body'].read()
+        # Read S3 object response into Variable
+        mpd_file = data_mpd['Body'].read()
+    metrics.add("ManifestBytes", len(mpd_file), "Bytes")
 
     ################ FOR USE WITH S3 TRIGGERS #########################
     # s3 = boto3.client('s3')
@@ -113,7 +195,8 @@ def lambda_handler(event, context):
         client = boto3.client('mediaconvert', region_name=region, endpoint_url=endpoints['Endpoints'][0]['Url'], verify=True)
 
         try:
-            response = client.get_job(Id=job_id)
+            with metrics.stage("JobFetch"):
+                response = client.get_job(Id=job_id)
         except Exception as e:
             LOGGER.error("Unable to get job data from MediaConvert, got exception: %s " % (e))
             raise Exception("Unable to get job data from MediaConvert, got exception: %s " % (e))
@@ -121,212 +204,83 @@ def lambda_handler(event, context):
         # Get the ESAM Data and put NPTpoints into List
         job_details = json.loads(json.dumps(response, default = lambda o: f"<<non-serializable: {type(o).__qualname__}>>"))
         esam_xml = job_details['Job']['Settings']['Esam']['SignalProcessingNotification']['SccXml']
-        esam_doc = xmltodict.parse(esam_xml.replace("\n"," "))
 
         esam_break_points = []
         esam_break_points_duration = []
-        for signal in esam_doc['SignalProcessingNotification']['ResponseSignal']:
-
-            if signal['sig:SCTE35PointDescriptor']['sig:SegmentationDescriptorInfo']['@segmentTypeId'] == "52":
-                try:
-                    duration_string = signal['sig:SCTE35PointDescriptor']['sig:SegmentationDescriptorInfo']['@duration']
-
-                    # If break is minutes long, convert any M integer to seconds
-                    try:
-                        duration_m = int(re.search('PT(.+?)M', duration_string).group(1))
-                        duration_m_s = duration_m * 60
-                    except AttributeError:
-                        # PT<>M not found in ESAM duration
-                        duration_m_s = 0 # apply your error handling
-
-                    # If break is seconds long, grab the S integer
-                    if re.search('PT[0-9]M(.+?)S', duration_string):
-                        duration_s = int(re.search('PT[0-9]M(.+?)S', duration_string).group(1))
-                    elif re.search('PT(.+?)S', duration_string):
-                        duration_s = int(re.search('PT(.+?)S', duration_string).group(1))
-                    else: # S is not present, so we'll check if M was specified, and if not we'll do a default duration of 30 seconds
-                        if duration_m_s == 0:
-                            duration_s = 30
-                        else:
-                            duration_s = str(0)
-
-                    # Duration of break in seconds
-                    break_duration = duration_m_s + duration_s
-                except Exception as e:
-                    LOGGER.warning("unable to get adbreak duration from ESAM xml, defaulting to 30 seconds. Exception: %s " % (e))
-                    break_duration = str(30)
-
-            if signal['sig:SCTE35PointDescriptor']['sig:SegmentationDescriptorInfo']['@segmentTypeId'] == "52":
-                esam_break_points_duration.append([signal['@signalPointID'],break_duration])
-                esam_break_points.append(signal['@signalPointID'])
+        with metrics.stage("Esam"):
+            for signal_point_id, duration, segment_type_id in esam_signals(esam_xml):
+                if segment_type_id == "52":
+                    if duration is None:
+                        LOGGER.warning("unable to get adbreak duration for signal %s from ESAM xml, defaulting to 30 seconds" % (signal_point_id))
+                        duration = 30
+                    esam_break_points_duration.append([signal_point_id,duration])
+                    esam_break_points.append(signal_point_id)
+        metrics.add("AdBreaks", len(esam_break_points))
 
         ## Create EventStream Elements
         def adbreakevents(esam_break_points_duration,video_timescale):
-            eventstream = []
+            scte35_events = []
 
             #scte_type = [52,53]
             scte_type = [52]
             for break_point in range(0,len(esam_break_points_duration)):
                 for stype_number in range(0,len(scte_type)):
-                    s_type = scte_type[stype_number]
                     break_info = esam_break_points_duration[break_point]
-                    pts_time = int(float(break_info[0]) * float(video_timescale))
-                    duration = int(float(break_info[1]) * float(video_timescale))
-                    event_id = str(break_point)
-                    dash_event_id = break_point + stype_number
-
-                    LOGGER.debug("EventStream PTS time %s " % (str(pts_time)))
-
-                    scte_event = dict()
-                    #scte_event['@timescale'] = video_timescale
-                    scte_event['@id'] = str(dash_event_id)
-                    scte_event['@duration'] = str(duration)
-                    scte_event['@presentationTime'] = str(pts_time)
-                    scte_event['scte35:SpliceInfoSection'] = {}
-                    scte_event['scte35:SpliceInfoSection']['@protocolVersion'] = "0"
-                    scte_event['scte35:SpliceInfoSection']['@tier'] = "4095"
-                    scte_event['scte35:SpliceInfoSection']['@ptsAdjustment'] = "0"
-                    scte_event['scte35:SpliceInfoSection']['scte35:TimeSignal'] = {}
-                    scte_event['scte35:SpliceInfoSection']['scte35:TimeSignal']['scte35:SpliceTime'] = {}
-                    scte_event['scte35:SpliceInfoSection']['scte35:TimeSignal']['scte35:SpliceTime']['@ptsTime'] = str(pts_time)
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor'] = {}
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['@segmentationEventId'] = event_id
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['@segmentationEventCancelIndicator'] = "false"
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['@segmentationDuration'] = str(duration)
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['@autoReturn'] = "true"
-                    # scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions'] = {}
-                    # scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions']['@webDeliveryAllowedFlag'] = "false"
-                    # scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions']['@noRegionalBlackoutFlag'] = "false"
-                    # scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions']['@archiveAllowedFlag'] = "true"
-                    # scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:DeliveryRestrictions']['@deviceRestrictions'] = "3"
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid'] = {}
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentationUpidType'] = "12"
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentationUpidLength'] = "0"
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentationTypeId'] = str(s_type)
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentNum'] = "0"
-                    scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:SegmentationUpid']['@segmentsExpected'] = "1"
-                    #scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:BreakDuration'] = {}
-                    #scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:BreakDuration']['@autoReturn'] = "true"
-                    #scte_event['scte35:SpliceInfoSection']['scte35:SegmentationDescriptor']['scte35:BreakDuration']['@duration'] = str(duration)
-
-                    eventstream.append(scte_event)
-
-            return eventstream
-
-            #return adbreakevents(esam_break_points_duration,60000)
-
-
-    # Use XMLtoDict package to translate XML to JSON Dictionary
-    mpddoc = xmltodict.parse(mpd_file)
+                    scte35_events.append(scte35_event(break_point + stype_number, break_point, scte_type[stype_number], break_info[0], break_info[1], video_timescale))
+                    LOGGER.debug("EventStream PTS time %s " % (str(scte35_events[-1]['pts_time'])))
+
+            return scte35_events
+
+
+    # Parse the manifest into the MPD object model, see dash_manifest/model.py
+    with metrics.stage("Parse"):
+        mpd = parse_mpd(mpd_file)
 
     manifest_modify_exceptions = []
 
     timescale = ""
+    scte35_events = []
 
     if MANIFESTMODIFY:
 
-        ### All of the MPD modify/delete actions below are inside TRY blocks
-        ### Add or remove more modify/delete/add actions inside individual TRY block
-        ### Any exceptions will be caught and displayed in a DEBUG message.
-        ### An exception does not cause the workflow to fail
+        ### All of the MPD modify/delete actions are manifest rules, see DEFAULT_MANIFEST_RULES
+        ### Add or remove rules there, or supply your own with the MANIFEST_RULES / MANIFEST_RULES_FILE environment variables
+        ### Any rule that fails will be caught and displayed in a DEBUG message.
+        ### A failed rule does not cause the workflow to fail, unless the rule is marked as required
 
         LOGGER.info("Manifest Modifier: Starting...")
 
-        ### Modify at the MPD Level Here ### START
-        # EXAMPLE : mpddoc['MPD']['@attribute'] == XX
+        MANIFEST_RULES.apply(ModelNodeAdapter(), mpd, manifest_modify_exceptions)
+        LOGGER.info("Manifest Modifier: %s rules applied in %.3f ms" % (str(len(MANIFEST_RULES.rules)), MANIFEST_RULES.total_seconds() * 1000))
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("Manifest Modifier - Rule timings : %s " % (MANIFEST_RULES.timings()))
+        metrics.add_rule_timings(MANIFEST_RULES)
 
-
-
-        ### Modify at the MPD Level Here ### END
-
-        if isinstance(mpddoc['MPD']['Period'], list):
-            periods = len(mpddoc['MPD']['Period'])
-            LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(periods)))
-            p_layout = "m"
-        else:
-            periods = 1
-            LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(periods)))
-            p_layout = "s"
+        periods = mpd.periods
+        LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(len(periods))))
         ### PERIOD
-        for period in range(0,periods):
-            if p_layout == "s":
-                p = mpddoc['MPD']['Period']
-            else:
-                p = mpddoc['MPD']['Period'][period]
-
-            ### Modify at the Period Level Here ### START
-            ## p['attribute']
-
-
-            ### Modify at the Period Level Here ### END
+        for period, p in enumerate(periods):
 
             ### ADAPTATION SET
-            if isinstance(p['AdaptationSet'], list):
-                adaptationsets = len(p['AdaptationSet'])
-                LOGGER.debug("Manifest Modifier: Period %s has %s AdaptationSets" % (str(period),str(adaptationsets)))
-                a_layout = "m"
-            else:
-                adaptationsets = 1
-                a_layout = "s"
-            for adaptationset in range(0,adaptationsets):
+            adaptationsets = p.adaptation_sets
+            LOGGER.debug("Manifest Modifier: Period %s has %s AdaptationSets" % (str(period),str(len(adaptationsets))))
+            for adaptationset, a in enumerate(adaptationsets):
                 LOGGER.debug("Manifest Modifier: Iterating through AS %s " % (str(adaptationset)))
-                if a_layout == "s":
-                    a = p['AdaptationSet']
-                else:
-                    a = p['AdaptationSet'][adaptationset]
 
 
                 try: # insert ad break elements after getting timescale
 
                     # get Timescale
-                    if 'video' in a['@mimeType']:
+                    if 'video' in a.mime_type:
                         if len(timescale) < 1:
-                            timescale = a['SegmentTemplate']['@timescale']
+                            timescale = a.segment_template.get('timescale')
 
                 except:
                     LOGGER.info("Couldnt get timescale, it wasnt in adaptationset/segmenttemplate/@timescale, setting to zero to alert you to fix the script")
                     timescale = 0
 
-                ### Modify at the AdaptationSet Level Here ### START
-                ## a['attribute']
-
-                #  ### EXAMPLE:
-                # try: # hard-code CC accessibility elements
-                #     a['Role'] = {}
-                #     a['Role']['@schemeIdUri'] = "urn:mpeg:dash:role:2011"
-                #     a['Role']['@value'] = "main"
-                #     if a['@mimeType'] == "video/mp4":
-                #         a['Accessibility'] = {}
-                #         a['Accessibility']['@schemeIdUri'] = "urn:scte:dash:cc:cea-608:2015"
-                #         a['Accessibility']['@value'] = "CC1=eng"
-                # except Exception as e:
-                #     manifest_modify_exceptions.append("Period %s - AdaptationSet %s : Unable to add Closed Caption Elements : %s" % (period,adaptationset,e))
-
-
-                ### Modify at the AdaptationSet Level Here ### END
-
-
-                ### REPRESENTATION ###
-                if isinstance(a['Representation'], list):
-                    representations = len(a['Representation'])
-                    LOGGER.debug("Manifest Modifier: AdaptationSet %s has %s Representations" % (str(adaptationset),str(representations)))
-                    r_layout = "m"
-                else:
-                    representations = 1
-                    LOGGER.debug("Manifest Modifier: AdaptationSet %s has %s Representations" % (str(adaptationset),str(representations)))
-                    r_layout = "s"
-                for representation in range(0,representations):
-                    LOGGER.debug("Manifest Modifier: Iterating through Representation %s " % (str(representation)))
-                    if r_layout == "s":
-                        r = a['Representation']
-                    else:
-                        r = a['Representation'][representation]
-
-                    ### Modify at the Representation Level Here ### START
-                    ## r['attribute']
-
-                    ### Modify at the Representation Level Here ### END
 
+        events_started = time.perf_counter()
         if len(esam_break_points) > 0:
 
             # esam_break_points = []
@@ -336,54 +290,47 @@ def lambda_handler(event, context):
 
 
 
-            # We are assuming the source is single Period DASH. If it is not, the below compiling of the EventStream element will fail
+            # We are assuming the source is single Period DASH, the EventStream is compiled into the first Period
 
-            subsetexists = False
+            single_period = periods[0]
 
-            try:
-                ascopy = mpddoc['MPD']['Period']['AdaptationSet']
-            except:
+            ascopy = single_period.adaptation_sets
+            if not ascopy:
                 LOGGER.error("ATTEMPT TO COPY ADAPTATIONSET ELEMENT FAILED: Cannot copy adaptationset object from mpd - this needs investigation")
 
-            try:
-                sscopy = mpddoc['MPD']['Period']['Subset']
-                subsetexists = True
-            except:
+            sscopy = single_period.findall('Subset')
+            if not sscopy:
                 LOGGER.info("ATTEMPT TO COPY SUBSET ELEMENT FAILED: no subset element in Period - nothing to copy - this is normal")
 
-            # Delete from single period mpd
-            try:
-                mpddoc['MPD']['Period'].pop('AdaptationSet')
-            except:
-                LOGGER.info("No adaptation set in Period - shouldnt happen")
-
-            try:
-                mpddoc['MPD']['Period'].pop('Subset')
-            except:
-                LOGGER.info("No Subset element in Period - this is quite common and you can ignore")
-
-            try:
-                mpddoc['MPD']['Period'].pop('EventStream')
-            except:
+            if not single_period.remove_children('EventStream'):
                 LOGGER.info("No existing EventStream element in this Period - this is ok")
 
-            mpddoc['MPD']['@xmlns:scte35'] = "urn:scte:scte35:2013:xml"
-            mpddoc['MPD']['Period']['EventStream'] = {}
-            mpddoc['MPD']['Period']['EventStream']['@schemeIdUri'] = "urn:scte:scte35:2013:xml"
-            mpddoc['MPD']['Period']['EventStream']['@timescale'] = timescale
-            mpddoc['MPD']['Period']['EventStream']['Event'] = adbreakevents(esam_break_points_duration,timescale)
-            mpddoc['MPD']['Period']['AdaptationSet'] = ascopy
+            # The EventStream goes after the Period's other children and ahead of its AdaptationSets and Subsets
+            single_period.remove_children('AdaptationSet')
+            single_period.remove_children('Subset')
 
-            if subsetexists:
-                mpddoc['MPD']['Period']['Subset'] = sscopy
+            mpd.set('xmlns:scte35', SCTE35_NAMESPACES[SCTE35_FORMAT])
+            event_stream = single_period.append(element('EventStream'))
+            event_stream.set('schemeIdUri', SCTE35_SCHEMES[SCTE35_FORMAT])
+            event_stream.set('timescale', timescale)
+            # The Events are rendered into the EventStream after the manifest is serialized, see insert_scte35_events
+            scte35_events = adbreakevents(esam_break_points_duration,timescale)
+            event_stream.text = SCTE35_EVENTS_MARKER
+            single_period.children.extend(ascopy)
+            single_period.children.extend(sscopy)
 
-            #return mpddoc
+            #return mpd
+        metrics.add_time("Events", time.perf_counter() - events_started)
+        metrics.add("Events", len(scte35_events))
 
         LOGGER.info("Manifest Modifier: Complete...")
         LOGGER.info("Manifest Modifier: Exceptions during modify : %s " % (str(len(manifest_modify_exceptions))))
         LOGGER.debug("Manifest Modifier - Exceptions caught : %s " % (manifest_modify_exceptions))
+        metrics.add("ModifyExceptions", len(manifest_modify_exceptions))
 
-        new_mpd = xmltodict.unparse(mpddoc, short_empty_elements=True, pretty=True)
+        with metrics.stage("Serialize"):
+            new_mpd = insert_scte35_events(mpd.to_xml(), scte35_events, SCTE35_EVENT_XML)
+        metrics.add("OutputBytes", len(new_mpd), "Bytes")
     else:
         new_mpd = mpd_xml_live # no change from original MPD
 
@@ -391,7 +338,8 @@ def lambda_handler(event, context):
 
     key = key[0:-4] + "-new.mpd"
     try:
-        s3_put_object_response = s3.put_object(Body=new_mpd, Bucket=bucket, Key=key)
+        with metrics.stage("Upload"):
+            s3_put_object_response = s3.put_object(Body=new_mpd, Bucket=bucket, Key=key)
         LOGGER.info("Successfully uploaded new MPD, Bucket: %s, Key: %s" % (bucket,key))
     except Exception as e:
         LOGGER.error("Unable to write new DASH manifest to S3 location, Bucket: %s - Key: %s, Exception: %s" % (bucket,key,e))
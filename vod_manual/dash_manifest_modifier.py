@@ -26,9 +26,20 @@ Original Author: Scott Cunningham
 
 import os
 import sys
+import glob
 import json
+import time
 import logging
-import xmltodict
+
+# The shared dash_manifest package sits at the root of the repository. A copy of the package next to this script takes
+# precedence over it, for deployments that only ship the script and the package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from dash_manifest.rules import ManifestRuleSet, load_manifest_rules
+from dash_manifest.adapters import ModelNodeAdapter
+from dash_manifest.files import parse_manifest_file, atomic_manifest_writer
+from dash_manifest.model import parse_mpd
+from dash_manifest.metrics import InvocationMetrics, set_metrics_sink
 
 #logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
 #LOGGER = logging.getLogger()
@@ -54,128 +65,114 @@ ch.setFormatter(formatter)
 #LOGGER.addHandler(fh) #### Un-comment this line when doing console testing
 LOGGER.addHandler(ch)
 
-if __name__ == '__main__':
+##
+## Manifest rules
+##
 
-    LOGGER.info("Starting DASH Manifest Modifier script")
-    user_args = json.loads(sys.argv[1])
-    LOGGER.info("Attempting to modify manifest in this location : %s " % (user_args))
+### Every edit made to the manifest is a rule: a selector (the element path from MPD down, optionally narrowed with
+### 'where' attribute values), an action and a value. Rules are loaded once, when the script starts, from the
+### MANIFEST_RULES environment variable (a JSON list), from the JSON file named in MANIFEST_RULES_FILE, or from the
+### defaults below. The rule set is compiled so that the manifest is walked once, each element is visited once and
+### only the rules selecting that element's path are evaluated. The rule engine is shared by every variation of the
+### modifier, see dash_manifest/rules.py
+###
+### Actions:
+###   set_attribute     name, value : set attribute 'name' to 'value'
+###   remove_attribute  name        : delete attribute 'name'
+###   remove_element    name        : delete every child element called 'name'
+###   add_element       name, value : replace any child elements called 'name' with one that has the 'value' attributes
+###
+### A rule that fails is logged as a modify exception and the manifest is still written, unless the rule has "required": true
 
+DEFAULT_MANIFEST_RULES = [
+    {"select": "MPD", "action": "set_attribute", "name": "profiles", "value": "urn:mpeg:dash:profile:isoff-live:2011"},
+    {"select": "MPD/Period", "action": "remove_attribute", "name": "start"},
+    {"select": "MPD/Period", "action": "remove_element", "name": "EventStream"},
+    {"select": "MPD/Period/AdaptationSet", "action": "set_attribute", "name": "segmentAlignment", "value": "true"}
+]
 
-    dash_mpd_path = user_args
+MANIFEST_RULES = ManifestRuleSet(load_manifest_rules(DEFAULT_MANIFEST_RULES))
 
-    try:
-        cat_command = 'cat %s' % (dash_mpd_path)
-        cat_stream = os.popen(cat_command)
-        mpeg_dash_xml = str(cat_stream.read())
-    except Exception as e:
-        raise Exception("ERROR reading Manifest, got exception : %s " % (e))
+##
+## Streaming rewrite
+##
 
-    # Use XMLToDict to convert XML to json
-    mpddoc = xmltodict.parse(mpeg_dash_xml)
+### Set the environment variable STREAM_REWRITE=True to rewrite the manifest as a stream of SAX events instead of
+### loading it into a dictionary. Elements are written out as soon as they're read, so memory use stays flat no
+### matter how long the SegmentTimelines are. The manifest rules above are applied to each element as it streams past
+STREAMREWRITE = os.environ.get('STREAM_REWRITE', "False")
 
-    ##
-    ## DASH modifying section
-    ##
+##
+## Invocation metrics
+##
 
-    ### All of the MPD modify/delete actions below are inside TRY blocks
-    ### Add or remove more modify/delete/add actions inside individual TRY block
-    ### Any exceptions will be caught and displayed in a DEBUG message. 
-    ### An exception does not cause the workflow to fail
-   
-    manifest_modify_exceptions = [] 
-    LOGGER.info("Manifest Modifier: Starting...")
-        
-    ### Modify at the MPD Level Here ### START
-    # EXAMPLE : mpddoc['MPD']['@attribute'] == XX
-        
+### One metrics record per manifest, see dash_manifest/metrics.py. There's no CloudWatch reading stdout here, so unless
+### METRICS_SINK says otherwise the record is written to this script's log
+if 'METRICS_SINK' not in os.environ:
+    set_metrics_sink(lambda record: LOGGER.info("Metrics : %s" % (json.dumps(record, separators=(",", ":")))))
+
+def modify_manifest(dash_mpd_path):
+    # Apply the manifest rules to one manifest and overwrite it, returns the rule exceptions that were caught
+    metrics = InvocationMetrics("vod_manual")
     try:
-        mpddoc['MPD']['@profiles'] = "urn:mpeg:dash:profile:isoff-live:2011"
-    except Exception as e:
-        manifest_modify_exceptions.append("Can't change profile attribute value : %s" % (e))
-        
-    ### Modify at the MPD Level Here ### END
-        
-    if isinstance(mpddoc['MPD']['Period'], list):
-        periods = len(mpddoc['MPD']['Period'])
-        LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(periods)))
-        p_layout = "m"
-    else:
-        periods = 1
-        LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(periods)))
-        p_layout = "s"
-    ### PERIOD
-    for period in range(0,periods):
-        if p_layout == "s":
-            p = mpddoc['MPD']['Period']
-        else:
-            p = mpddoc['MPD']['Period'][period]
-
-        ### Modify at the Period Level Here ### START
-        ## p['attribute']
-        try:
-            del p['@start']
-        except Exception as e:
-            manifest_modify_exceptions.append("Period %s : Unable to remove start attribute : %s" % (period,e))
+        return rewrite_manifest(dash_mpd_path, metrics)
+    finally:
+        metrics.emit()
+
+def rewrite_manifest(dash_mpd_path, metrics):
+    if STREAMREWRITE == "True":
+        # xml.sax.saxutils pulls in urllib.request, so the streaming rewriter is only imported when it's used
+        from dash_manifest.stream import stream_rewrite_manifest
+
+        manifest_modify_exceptions = []
+        LOGGER.info("Manifest Modifier: Starting streaming rewrite...")
         try:
-            del p['EventStream']
+            with metrics.stage("Rewrite"):
+                stream_rewrite_manifest(dash_mpd_path, dash_mpd_path, MANIFEST_RULES, manifest_modify_exceptions)
         except Exception as e:
-            manifest_modify_exceptions.append("Period %s : Unable to remove EventStream element : %s" % (period,e))
-        
-        ### Modify at the Period Level Here ### END
-
-        ### ADAPTATION SET
-        if isinstance(p['AdaptationSet'], list):
-            adaptationsets = len(p['AdaptationSet'])
-            LOGGER.debug("Manifest Modifier: Period %s has %s AdaptationSets" % (str(period),str(adaptationsets)))
-            a_layout = "m"
-        else:
-            adaptationsets = 1
-            a_layout = "s"
-        for adaptationset in range(0,adaptationsets):
-            LOGGER.debug("Manifest Modifier: Iterating through AS %s " % (str(adaptationset)))
-            if a_layout == "s":
-                a = p['AdaptationSet']
-            else:
-                a = p['AdaptationSet'][adaptationset]
-                
-            ### Modify at the AdaptationSet Level Here ### START
-            ## a['attribute']
-            try:
-                a['@segmentAlignment'] = "true"
-            except Exception as e:
-                manifest_modify_exceptions.append("Period %s - AdaptationSet %s : Unable to change segmentAlignment value : %s" % (period,adaptationset,e))
-        
-        
-            ### Modify at the AdaptationSet Level Here ### END
-                
-        
-            ### REPRESENTATION ###
-            if isinstance(a['Representation'], list):
-                representations = len(a['Representation'])
-                LOGGER.debug("Manifest Modifier: AdaptationSet %s has %s Representations" % (str(adaptationset),str(representations)))
-                r_layout = "m"
-            else:
-                representations = 1
-                LOGGER.debug("Manifest Modifier: AdaptationSet %s has %s Representations" % (str(adaptationset),str(representations)))
-                r_layout = "s"
-            for representation in range(0,representations):
-                LOGGER.debug("Manifest Modifier: Iterating through Representation %s " % (str(representation)))
-                if r_layout == "s":
-                    r = a['Representation']
-                else:
-                    r = a['Representation'][representation]
-                   
-                ### Modify at the Representation Level Here ### START
-                ## r['attribute']
-                    
-                    
-                ### Modify at the Representation Level Here ### END
-
+            raise Exception("ERROR rewriting Manifest, got exception : %s " % (e))
         LOGGER.info("Manifest Modifier: Complete...")
+        LOGGER.info("Manifest Modifier: %s rules applied in %.3f ms" % (str(len(MANIFEST_RULES.rules)), MANIFEST_RULES.total_seconds() * 1000))
+        LOGGER.debug("Manifest Modifier - Rule timings : %s " % (MANIFEST_RULES.timings()))
         LOGGER.info("Manifest Modifier: Exceptions during modify : %s " % (str(len(manifest_modify_exceptions))))
         LOGGER.debug("Manifest Modifier - Exceptions caught : %s " % (manifest_modify_exceptions))
-    
-        new_mpd = xmltodict.unparse(mpddoc, short_empty_elements=True, pretty=True)
+        metrics.add_rule_timings(MANIFEST_RULES)
+        metrics.add("ModifyExceptions", len(manifest_modify_exceptions))
+        return manifest_modify_exceptions
+
+    # Parse the manifest into the MPD object model, see dash_manifest/model.py
+    try:
+        with metrics.stage("Parse"):
+            mpd = parse_manifest_file(dash_mpd_path, parse_mpd)
+    except OSError as e:
+        raise Exception("ERROR reading Manifest, got exception : %s " % (e))
+
+    ##
+    ## DASH modifying section
+    ##
+
+    ### All of the MPD modify/delete actions are manifest rules, see DEFAULT_MANIFEST_RULES
+    ### Add or remove rules there, or supply your own with the MANIFEST_RULES / MANIFEST_RULES_FILE environment variables
+    ### Any rule that fails will be caught and displayed in a DEBUG message.
+    ### A failed rule does not cause the workflow to fail, unless the rule is marked as required
+
+    manifest_modify_exceptions = []
+    LOGGER.info("Manifest Modifier: Starting...")
+
+    with metrics.stage("Modify"):
+        MANIFEST_RULES.apply(ModelNodeAdapter(), mpd, manifest_modify_exceptions)
+
+    LOGGER.info("Manifest Modifier: Complete...")
+    LOGGER.info("Manifest Modifier: %s rules applied in %.3f ms" % (str(len(MANIFEST_RULES.rules)), MANIFEST_RULES.total_seconds() * 1000))
+    LOGGER.debug("Manifest Modifier - Rule timings : %s " % (MANIFEST_RULES.timings()))
+    LOGGER.info("Manifest Modifier: Exceptions during modify : %s " % (str(len(manifest_modify_exceptions))))
+    LOGGER.debug("Manifest Modifier - Exceptions caught : %s " % (manifest_modify_exceptions))
+    metrics.add_rule_timings(MANIFEST_RULES)
+    metrics.add("ModifyExceptions", len(manifest_modify_exceptions))
+
+    with metrics.stage("Serialize"):
+        new_mpd = mpd.to_xml()
+    metrics.add("OutputBytes", len(new_mpd), "Bytes")
 
 
     ##
@@ -187,6 +184,83 @@ if __name__ == '__main__':
     ##  Write New DASH Manifest to previous one
     ##
     #dash_mpd_path = dash_mpd_path + "-new.mpd"
-    f = open( dash_mpd_path, 'w+' )
-    f.write( str(new_mpd) )
-    f.close() 
+    with metrics.stage("Write"):
+        with atomic_manifest_writer(dash_mpd_path) as f:
+            f.write(new_mpd)
+
+    return manifest_modify_exceptions
+
+##
+## Batch mode
+##
+
+### python dash_manifest_modifier.py --batch <directory | glob | -> modifies many manifests from one process start. A
+### directory is searched for .mpd files, anything else is treated as a glob pattern, and '-' reads a list of manifest
+### paths from stdin, one per line. The manifests are shared out over a pool of worker processes, each of which loads
+### the rule set once. Per file logging in the workers drops to WARNING, the results are logged as they come back
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+BATCH_CHUNKSIZE = int(os.environ.get('BATCH_CHUNKSIZE', 16))
+
+def batch_manifest_paths(source):
+    if source == "-":
+        for line in sys.stdin:
+            if line.strip():
+                yield line.strip()
+    elif os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(".mpd"):
+                    yield os.path.join(root, name)
+    else:
+        for path in sorted(glob.glob(source, recursive=True)):
+            yield path
+
+def batch_worker_init():
+    LOGGER.setLevel(logging.WARNING)
+
+def batch_modify_manifest(dash_mpd_path):
+    # Runs in a worker process: (path, error or None, rule exceptions caught, bytes, seconds)
+    started = time.perf_counter()
+    try:
+        manifest_modify_exceptions = modify_manifest(dash_mpd_path)
+        return dash_mpd_path, None, len(manifest_modify_exceptions), os.path.getsize(dash_mpd_path), time.perf_counter() - started
+    except Exception as e:
+        return dash_mpd_path, str(e), 0, 0, time.perf_counter() - started
+
+def batch_modify(source):
+    # multiprocessing is only loaded in batch mode, a single manifest run doesn't pay for the import
+    from concurrent.futures import ProcessPoolExecutor
+
+    paths = list(batch_manifest_paths(source))
+    LOGGER.info("Batch: modifying %s manifests from %s with %s workers" % (len(paths), source, BATCH_WORKERS))
+
+    started = time.perf_counter()
+    failed = []
+    total_bytes = 0
+    with ProcessPoolExecutor(max_workers=BATCH_WORKERS, initializer=batch_worker_init) as pool:
+        for dash_mpd_path, error, exceptions, size, seconds in pool.map(batch_modify_manifest, paths, chunksize=BATCH_CHUNKSIZE):
+            if error is None:
+                total_bytes += size
+                LOGGER.info("Batch: OK %s , %s rule exceptions, %.3f s" % (dash_mpd_path, exceptions, seconds))
+            else:
+                failed.append((dash_mpd_path, error))
+                LOGGER.error("Batch: FAILED %s : %s " % (dash_mpd_path, error))
+    elapsed = time.perf_counter() - started
+
+    LOGGER.info("Batch: %s manifests, %s succeeded, %s failed in %.3f s (%.1f manifests/s, %.2f MB/s)" % (len(paths), len(paths) - len(failed), len(failed), elapsed, len(paths) / elapsed if elapsed else 0, total_bytes / 1048576 / elapsed if elapsed else 0))
+    for dash_mpd_path, error in failed:
+        LOGGER.info("Batch: failed %s : %s " % (dash_mpd_path, error))
+    return len(failed) == 0
+
+if __name__ == '__main__':
+
+    LOGGER.info("Starting DASH Manifest Modifier script")
+
+    if len(sys.argv) > 2 and sys.argv[1] == "--batch":
+        sys.exit(0 if batch_modify(sys.argv[2]) else 1)
+
+    user_args = json.loads(sys.argv[1])
+    LOGGER.info("Attempting to modify manifest in this location : %s " % (user_args))
+
+    modify_manifest(user_args)
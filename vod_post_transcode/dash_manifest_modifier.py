@@ -27,8 +27,22 @@ Original Author: Scott Cunningham
 import os
 import sys
 import json
+import time
+import tempfile
+import collections
+import signal
+import threading
 import logging
-import xmltodict
+
+# The shared dash_manifest package sits at the root of the repository. A copy of the package next to this script takes
+# precedence over it, for deployments that only ship the script and the package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from dash_manifest.rules import ManifestRuleSet, load_manifest_rules
+from dash_manifest.adapters import ModelNodeAdapter
+from dash_manifest.files import parse_manifest_file, atomic_manifest_writer
+from dash_manifest.model import parse_mpd
+from dash_manifest.metrics import InvocationMetrics, set_metrics_sink
 
 #logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
 #LOGGER = logging.getLogger()
@@ -54,129 +68,115 @@ ch.setFormatter(formatter)
 #LOGGER.addHandler(fh) #### Un-comment this line when doing console testing
 LOGGER.addHandler(ch)
 
-if __name__ == '__main__':
+##
+## Manifest rules
+##
 
-    LOGGER.info("Starting DASH Manifest Modifier script")
-    server_args = json.loads(sys.argv[1])
-    LOGGER.debug("Elemental Server Output : %s " % (str(server_args)))
-    LOGGER.info(server_args['output_groups'][0]['outputs'][0]['output_path'])
+### Every edit made to the manifest is a rule: a selector (the element path from MPD down, optionally narrowed with
+### 'where' attribute values), an action and a value. Rules are loaded once, when the script starts, from the
+### MANIFEST_RULES environment variable (a JSON list), from the JSON file named in MANIFEST_RULES_FILE, or from the
+### defaults below. The rule set is compiled so that the manifest is walked once, each element is visited once and
+### only the rules selecting that element's path are evaluated. The rule engine is shared by every variation of the
+### modifier, see dash_manifest/rules.py
+###
+### Actions:
+###   set_attribute     name, value : set attribute 'name' to 'value'
+###   remove_attribute  name        : delete attribute 'name'
+###   remove_element    name        : delete every child element called 'name'
+###   add_element       name, value : replace any child elements called 'name' with one that has the 'value' attributes
+###
+### A rule that fails is logged as a modify exception and the manifest is still written, unless the rule has "required": true
 
+DEFAULT_MANIFEST_RULES = [
+    {"select": "MPD", "action": "set_attribute", "name": "profiles", "value": "urn:mpeg:dash:profile:isoff-live:2011"},
+    {"select": "MPD/Period", "action": "remove_attribute", "name": "start"},
+    {"select": "MPD/Period", "action": "remove_element", "name": "EventStream"},
+    {"select": "MPD/Period/AdaptationSet", "action": "set_attribute", "name": "segmentAlignment", "value": "true"}
+]
 
-    dash_mpd_path = server_args['output_groups'][0]['outputs'][0]['output_path']
+MANIFEST_RULES = ManifestRuleSet(load_manifest_rules(DEFAULT_MANIFEST_RULES))
 
-    try:
-        cat_command = 'cat %s' % (dash_mpd_path)
-        cat_stream = os.popen(cat_command)
-        mpeg_dash_xml = str(cat_stream.read())
-    except Exception as e:
-        raise Exception("ERROR reading Manifest, got exception : %s " % (e))
+##
+## Streaming rewrite
+##
 
-    # Use XMLToDict to convert XML to json
-    mpddoc = xmltodict.parse(mpeg_dash_xml)
+### Set the environment variable STREAM_REWRITE=True to rewrite the manifest as a stream of SAX events instead of
+### loading it into a dictionary. Elements are written out as soon as they're read, so memory use stays flat no
+### matter how long the SegmentTimelines are. The manifest rules above are applied to each element as it streams past
+STREAMREWRITE = os.environ.get('STREAM_REWRITE', "False")
 
-    ##
-    ## DASH modifying section
-    ##
+##
+## Invocation metrics
+##
 
-    ### All of the MPD modify/delete actions below are inside TRY blocks
-    ### Add or remove more modify/delete/add actions inside individual TRY block
-    ### Any exceptions will be caught and displayed in a DEBUG message. 
-    ### An exception does not cause the workflow to fail
-   
-    manifest_modify_exceptions = [] 
-    LOGGER.info("Manifest Modifier: Starting...")
-        
-    ### Modify at the MPD Level Here ### START
-    # EXAMPLE : mpddoc['MPD']['@attribute'] == XX
-        
+### One metrics record per manifest, see dash_manifest/metrics.py. There's no CloudWatch reading stdout here, so unless
+### METRICS_SINK says otherwise the record is written to this script's log
+if 'METRICS_SINK' not in os.environ:
+    set_metrics_sink(lambda record: LOGGER.info("Metrics : %s" % (json.dumps(record, separators=(",", ":")))))
+
+def modify_manifest(dash_mpd_path):
+    # Apply the manifest rules to one manifest and write the result next to it with a -new.mpd suffix, returns the rule
+    # exceptions that were caught
+    metrics = InvocationMetrics("vod_post_transcode")
     try:
-        mpddoc['MPD']['@profiles'] = "urn:mpeg:dash:profile:isoff-live:2011"
-    except Exception as e:
-        manifest_modify_exceptions.append("Can't change profile attribute value : %s" % (e))
-        
-    ### Modify at the MPD Level Here ### END
-        
-    if isinstance(mpddoc['MPD']['Period'], list):
-        periods = len(mpddoc['MPD']['Period'])
-        LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(periods)))
-        p_layout = "m"
-    else:
-        periods = 1
-        LOGGER.debug("Manifest Modifier: Manifest has %s Periods" % (str(periods)))
-        p_layout = "s"
-    ### PERIOD
-    for period in range(0,periods):
-        if p_layout == "s":
-            p = mpddoc['MPD']['Period']
-        else:
-            p = mpddoc['MPD']['Period'][period]
+        return rewrite_manifest(dash_mpd_path, metrics)
+    finally:
+        metrics.emit()
 
-        ### Modify at the Period Level Here ### START
-        ## p['attribute']
-        try:
-            del p['@start']
-        except Exception as e:
-            manifest_modify_exceptions.append("Period %s : Unable to remove start attribute : %s" % (period,e))
+def rewrite_manifest(dash_mpd_path, metrics):
+    if STREAMREWRITE == "True":
+        # xml.sax.saxutils pulls in urllib.request, so the streaming rewriter is only imported when it's used
+        from dash_manifest.stream import stream_rewrite_manifest
+
+        manifest_modify_exceptions = []
+        LOGGER.info("Manifest Modifier: Starting streaming rewrite...")
         try:
-            del p['EventStream']
+            with metrics.stage("Rewrite"):
+                stream_rewrite_manifest(dash_mpd_path, dash_mpd_path + "-new.mpd", MANIFEST_RULES, manifest_modify_exceptions)
         except Exception as e:
-            manifest_modify_exceptions.append("Period %s : Unable to remove EventStream element : %s" % (period,e))
-        
-        ### Modify at the Period Level Here ### END
-
-        ### ADAPTATION SET
-        if isinstance(p['AdaptationSet'], list):
-            adaptationsets = len(p['AdaptationSet'])
-            LOGGER.debug("Manifest Modifier: Period %s has %s AdaptationSets" % (str(period),str(adaptationsets)))
-            a_layout = "m"
-        else:
-            adaptationsets = 1
-            a_layout = "s"
-        for adaptationset in range(0,adaptationsets):
-            LOGGER.debug("Manifest Modifier: Iterating through AS %s " % (str(adaptationset)))
-            if a_layout == "s":
-                a = p['AdaptationSet']
-            else:
-                a = p['AdaptationSet'][adaptationset]
-                
-            ### Modify at the AdaptationSet Level Here ### START
-            ## a['attribute']
-            try:
-                a['@segmentAlignment'] = "true"
-            except Exception as e:
-                manifest_modify_exceptions.append("Period %s - AdaptationSet %s : Unable to change segmentAlignment value : %s" % (period,adaptationset,e))
-        
-        
-            ### Modify at the AdaptationSet Level Here ### END
-                
-        
-            ### REPRESENTATION ###
-            if isinstance(a['Representation'], list):
-                representations = len(a['Representation'])
-                LOGGER.debug("Manifest Modifier: AdaptationSet %s has %s Representations" % (str(adaptationset),str(representations)))
-                r_layout = "m"
-            else:
-                representations = 1
-                LOGGER.debug("Manifest Modifier: AdaptationSet %s has %s Representations" % (str(adaptationset),str(representations)))
-                r_layout = "s"
-            for representation in range(0,representations):
-                LOGGER.debug("Manifest Modifier: Iterating through Representation %s " % (str(representation)))
-                if r_layout == "s":
-                    r = a['Representation']
-                else:
-                    r = a['Representation'][representation]
-                   
-                ### Modify at the Representation Level Here ### START
-                ## r['attribute']
-                    
-                    
-                ### Modify at the Representation Level Here ### END
-
+            raise Exception("ERROR rewriting Manifest, got exception : %s " % (e))
         LOGGER.info("Manifest Modifier: Complete...")
+        LOGGER.info("Manifest Modifier: %s rules applied in %.3f ms" % (str(len(MANIFEST_RULES.rules)), MANIFEST_RULES.total_seconds() * 1000))
+        LOGGER.debug("Manifest Modifier - Rule timings : %s " % (MANIFEST_RULES.timings()))
         LOGGER.info("Manifest Modifier: Exceptions during modify : %s " % (str(len(manifest_modify_exceptions))))
         LOGGER.debug("Manifest Modifier - Exceptions caught : %s " % (manifest_modify_exceptions))
-    
-        new_mpd = xmltodict.unparse(mpddoc, short_empty_elements=True, pretty=True)
+        metrics.add_rule_timings(MANIFEST_RULES)
+        metrics.add("ModifyExceptions", len(manifest_modify_exceptions))
+        return manifest_modify_exceptions
+
+    # Parse the manifest into the MPD object model, see dash_manifest/model.py
+    try:
+        with metrics.stage("Parse"):
+            mpd = parse_manifest_file(dash_mpd_path, parse_mpd)
+    except OSError as e:
+        raise Exception("ERROR reading Manifest, got exception : %s " % (e))
+
+    ##
+    ## DASH modifying section
+    ##
+
+    ### All of the MPD modify/delete actions are manifest rules, see DEFAULT_MANIFEST_RULES
+    ### Add or remove rules there, or supply your own with the MANIFEST_RULES / MANIFEST_RULES_FILE environment variables
+    ### Any rule that fails will be caught and displayed in a DEBUG message.
+    ### A failed rule does not cause the workflow to fail, unless the rule is marked as required
+
+    manifest_modify_exceptions = []
+    LOGGER.info("Manifest Modifier: Starting...")
+
+    with metrics.stage("Modify"):
+        MANIFEST_RULES.apply(ModelNodeAdapter(), mpd, manifest_modify_exceptions)
+
+    LOGGER.info("Manifest Modifier: Complete...")
+    LOGGER.info("Manifest Modifier: %s rules applied in %.3f ms" % (str(len(MANIFEST_RULES.rules)), MANIFEST_RULES.total_seconds() * 1000))
+    LOGGER.debug("Manifest Modifier - Rule timings : %s " % (MANIFEST_RULES.timings()))
+    LOGGER.info("Manifest Modifier: Exceptions during modify : %s " % (str(len(manifest_modify_exceptions))))
+    LOGGER.debug("Manifest Modifier - Exceptions caught : %s " % (manifest_modify_exceptions))
+    metrics.add_rule_timings(MANIFEST_RULES)
+    metrics.add("ModifyExceptions", len(manifest_modify_exceptions))
+
+    with metrics.stage("Serialize"):
+        new_mpd = mpd.to_xml()
+    metrics.add("OutputBytes", len(new_mpd), "Bytes")
 
 
     ##
@@ -188,6 +188,177 @@ if __name__ == '__main__':
     ##  Write New DASH Manifest to previous one
     ##
     dash_mpd_path = dash_mpd_path + "-new.mpd"
-    f = open( dash_mpd_path, 'w+' )
-    f.write( str(new_mpd) )
-    f.close() 
+    with metrics.stage("Write"):
+        with atomic_manifest_writer(dash_mpd_path) as f:
+            f.write(new_mpd)
+
+    return manifest_modify_exceptions
+
+##
+## Daemon mode
+##
+
+### python dash_manifest_modifier.py --daemon keeps the script resident, so the Python start up, the imports and the
+### rule set are paid for once instead of for every job. Jobs are the Elemental Server JSON, dropped as .json files
+### into the 'incoming' directory of DAEMON_SPOOL_DIR (see enqueue_job.sh, or --enqueue). The daemon claims a job by
+### moving it to 'processing', runs it on a pool of DAEMON_WORKERS worker processes, deletes it when it succeeds and
+### moves it to 'failed', with the error alongside, when it doesn't. Jobs left in 'processing' by a daemon that was
+### stopped are picked up again at start up. Queue depth, throughput and latency are logged and written to stats.json
+DAEMON_SPOOL_DIR = os.environ.get('DAEMON_SPOOL_DIR', os.path.join(tempfile.gettempdir(), "dash-manifest-modifier"))
+DAEMON_WORKERS = int(os.environ.get('DAEMON_WORKERS', os.cpu_count() or 1))
+DAEMON_POLL_INTERVAL = float(os.environ.get('DAEMON_POLL_INTERVAL', 0.25))
+DAEMON_STATS_INTERVAL = float(os.environ.get('DAEMON_STATS_INTERVAL', 60))
+
+def enqueue_job(server_args):
+    incoming = os.path.join(DAEMON_SPOOL_DIR, "incoming")
+    os.makedirs(incoming, exist_ok=True)
+    temporary_fd, temporary_path = tempfile.mkstemp(dir=incoming, prefix=".", suffix=".tmp")
+    with os.fdopen(temporary_fd, 'w') as job_file:
+        job_file.write(server_args)
+    job_path = os.path.join(incoming, "%s-%s.json" % (time.time_ns(), os.getpid()))
+    os.replace(temporary_path, job_path)
+    return job_path
+
+def daemon_job(job_path):
+    # Runs in a worker process: (rule exceptions caught, seconds spent on the manifest)
+    started = time.perf_counter()
+    with open(job_path) as job_file:
+        server_args = json.load(job_file)
+    dash_mpd_path = server_args['output_groups'][0]['outputs'][0]['output_path']
+    LOGGER.info("Daemon: modifying %s " % (dash_mpd_path))
+    manifest_modify_exceptions = modify_manifest(dash_mpd_path)
+    return len(manifest_modify_exceptions), time.perf_counter() - started
+
+class DaemonStats(object):
+
+    def __init__(self):
+        self.started = time.time()
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = collections.deque(maxlen=1000)
+        self.processing_seconds = collections.deque(maxlen=1000)
+
+    def record(self, enqueued_at, processing_seconds, failed):
+        self.latencies.append(time.time() - enqueued_at)
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+            self.processing_seconds.append(processing_seconds)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        def percentile(values, fraction):
+            return round(values[min(int(len(values) * fraction), len(values) - 1)], 3) if values else None
+        return {
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "jobs_per_second": round((self.completed + self.failed) / max(time.time() - self.started, 0.001), 3),
+            "latency_p50_seconds": percentile(latencies, 0.5),
+            "latency_p95_seconds": percentile(latencies, 0.95),
+            "latency_max_seconds": round(latencies[-1], 3) if latencies else None,
+            "processing_mean_seconds": round(sum(self.processing_seconds) / len(self.processing_seconds), 3) if self.processing_seconds else None
+        }
+
+    def publish(self):
+        snapshot = self.snapshot()
+        LOGGER.info("Daemon stats : %s " % (json.dumps(snapshot)))
+        with atomic_manifest_writer(os.path.join(DAEMON_SPOOL_DIR, "stats.json")) as stats_file:
+            json.dump(snapshot, stats_file)
+
+def run_daemon():
+    # multiprocessing is only loaded in daemon mode, a single manifest run doesn't pay for the import
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    incoming, processing, failed = [os.path.join(DAEMON_SPOOL_DIR, name) for name in ("incoming", "processing", "failed")]
+    for directory in (incoming, processing, failed):
+        os.makedirs(directory, exist_ok=True)
+
+    # Anything still in processing belonged to a daemon that stopped before it finished
+    for name in os.listdir(processing):
+        if name.endswith(".json"):
+            os.replace(os.path.join(processing, name), os.path.join(incoming, name))
+
+    stopping = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda signum, frame: stopping.set())
+
+    stats = DaemonStats()
+    in_flight = {}
+    max_in_flight = DAEMON_WORKERS * 2
+    next_stats = time.time() + DAEMON_STATS_INTERVAL
+
+    def finish(future):
+        name, job_path, enqueued_at = in_flight.pop(future)
+        try:
+            exceptions, seconds = future.result()
+            os.remove(job_path)
+            stats.record(enqueued_at, seconds, False)
+            LOGGER.info("Daemon: completed %s , %s rule exceptions, %.3f s" % (name, exceptions, seconds))
+        except Exception as e:
+            os.replace(job_path, os.path.join(failed, name))
+            with open(os.path.join(failed, name + ".error"), 'w') as error_file:
+                error_file.write("%s\n" % (e))
+            stats.record(enqueued_at, 0, True)
+            LOGGER.error("Daemon: FAILED %s : %s " % (name, e))
+
+    LOGGER.info("Daemon: watching %s with %s workers" % (incoming, DAEMON_WORKERS))
+    with ProcessPoolExecutor(max_workers=DAEMON_WORKERS) as pool:
+        while not stopping.is_set():
+            for future in [future for future in in_flight if future.done()]:
+                finish(future)
+
+            waiting = sorted(name for name in os.listdir(incoming) if name.endswith(".json") and not name.startswith("."))
+            claimed = 0
+            for name in waiting[:max(max_in_flight - len(in_flight), 0)]:
+                job_path = os.path.join(processing, name)
+                try:
+                    os.replace(os.path.join(incoming, name), job_path)
+                except FileNotFoundError:
+                    continue
+                in_flight[pool.submit(daemon_job, job_path)] = (name, job_path, os.stat(job_path).st_mtime)
+                claimed += 1
+            stats.queued = len(waiting) - claimed
+            stats.in_flight = len(in_flight)
+
+            if time.time() >= next_stats:
+                stats.publish()
+                next_stats = time.time() + DAEMON_STATS_INTERVAL
+
+            if in_flight:
+                wait(list(in_flight), timeout=DAEMON_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            else:
+                stopping.wait(DAEMON_POLL_INTERVAL)
+
+        LOGGER.info("Daemon: stopping, waiting for %s jobs in progress" % (len(in_flight)))
+        for future in list(in_flight):
+            future.exception()
+            finish(future)
+    stats.in_flight = 0
+    stats.publish()
+
+if __name__ == '__main__':
+
+    LOGGER.info("Starting DASH Manifest Modifier script")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--daemon":
+        run_daemon()
+        sys.exit(0)
+
+    if len(sys.argv) > 2 and sys.argv[1] == "--enqueue":
+        LOGGER.info("Queued job for the daemon : %s " % (enqueue_job(sys.argv[2])))
+        sys.exit(0)
+
+    server_args = json.loads(sys.argv[1])
+    LOGGER.debug("Elemental Server Output : %s " % (str(server_args)))
+    LOGGER.info(server_args['output_groups'][0]['outputs'][0]['output_path'])
+
+
+    dash_mpd_path = server_args['output_groups'][0]['outputs'][0]['output_path']
+
+    modify_manifest(dash_mpd_path)
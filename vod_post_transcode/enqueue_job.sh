@@ -0,0 +1,11 @@
+#!/bin/sh
+#
+# Post-processing hook for daemon mode: queues the Elemental Server job JSON for a resident
+# "dash_manifest_modifier.py --daemon" instead of starting Python for every job.
+#
+# The job is written to a hidden temporary file and renamed into place, so the daemon never reads a partial job
+
+SPOOL="${DAEMON_SPOOL_DIR:-/tmp/dash-manifest-modifier}/incoming"
+mkdir -p "$SPOOL" || exit 1
+TMP=$(mktemp "$SPOOL/.job.XXXXXX") || exit 1
+printf '%s' "$1" > "$TMP" && mv "$TMP" "$SPOOL/$(date +%s%N)-$$.json"